@@ -0,0 +1,326 @@
+#! /usr/bin/python3
+
+
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import subprocess
+import tracemalloc
+
+bench_dir = os.path.dirname(os.path.realpath(__file__))
+src_dir = os.path.join(bench_dir, "..", "src")
+sys.path.insert(0, src_dir)
+import synth
+import utils
+import tblastn
+import hittable
+import subseq
+import exonerate
+import augustus
+import kmerseed
+
+
+def measure(fn, *args, memory=True) -> dict:
+    """
+    wall time of fn(*args) and, in a second call under tracemalloc, its peak
+    python heap in MB
+    """
+    gc.collect()
+    start = time.perf_counter()
+    fn(*args)
+    out = {"seconds": round(time.perf_counter() - start, 4)}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        fn(*args)
+        out["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20,
+                               2)
+        tracemalloc.stop()
+    return out
+
+
+def consume(it):
+    for _ in it:
+        pass
+
+
+def convert_hints(rawf: str, queryf: str):
+    with open(rawf, "r", encoding="utf-8") as inf, \
+            open(os.devnull, "w") as outf:
+        hints = exonerate.hint_writer(outf, queryf)
+        for line in inf:
+            hints.feed(line)
+
+
+def stage_inputs(workdir: str, scale: int, seed: int) -> dict:
+    """
+    write the inputs each stage benchmark reads at this scale, returning the
+    stage callables and their input sizes
+    """
+    rng = random.Random(seed)
+    d = os.path.join(workdir, "stages_%d" % scale)
+    paths = synth.write_dataset(d, seed, contigs=4 * scale,
+                                contig_length=250000, families=2 * scale,
+                                members=5)
+    truth = synth.read_truth(paths["truth"])
+
+    outfmt7 = os.path.join(d, "hits.outfmt7")
+    n_rows = 50000 * scale
+    synth.write_tblastn(synth.random_tblastn_rows(rng, n_rows), outfmt7)
+    hits = tblastn.parse_tblastn(outfmt7)
+
+    index = subseq.load_index(paths["genome"])
+    windows = []
+    for t in truth:
+        s = min(x[0] for x in t["exons"])
+        e = max(x[1] for x in t["exons"])
+        windows.append(utils.genome_range([t["query"], t["contig"],
+                                           max(1, s - 3000),
+                                           min(e + 3000,
+                                               index[t["contig"]].length)]))
+    windir = os.path.join(d, "windows")
+    os.makedirs(windir, exist_ok=True)
+
+    rawf = os.path.join(d, "exonerate.out")
+    queries = [t["query"] for t in truth]
+    with open(rawf, "w", encoding="utf-8") as outf:
+        for _ in range(20 * scale):
+            for w in windows:
+                for line in synth.exonerate_lines(
+                        w.subject + "_%d_%d" % (w.start, w.end), w.start,
+                        w.end - w.start + 1, w.subject, queries, truth):
+                    outf.write(line + "\n")
+
+    augf = os.path.join(d, "augustus.out")
+    subseq.write_subseq(paths["genome"], windows, outdir=windir)
+    seqs = []
+    hints = []
+    for w in windows:
+        seqs.append((w.seqid, "".join(s for _, s in
+                                      utils.parse_fasta(w.file))))
+        for line in synth.exonerate_lines(w.seqid, w.start,
+                                          w.end - w.start + 1, w.subject,
+                                          [w.query], truth):
+            rec = line.split("\t")
+            if len(rec) > 3 and rec[2] == "cds":
+                hints.append([rec[0], "xnt2h", "CDSpart",
+                              str(int(rec[3]) + 9), str(int(rec[4]) - 9),
+                              ".", rec[6], "."])
+    with open(augf, "w", encoding="utf-8") as outf:
+        for _ in range(200 * scale):
+            for line in synth.augustus_lines(seqs, hints):
+                outf.write(line + "\n")
+
+    stages = {
+        "parse_fasta": (lambda: consume(utils.parse_fasta(paths["genome"])),
+                        os.path.getsize(paths["genome"])),
+        "parse_fasta_mmap": (lambda: consume(utils.parse_fasta(
+            paths["genome"], use_mmap=True)), os.path.getsize(paths["genome"])),
+        "parse_tblastn": (lambda: tblastn.parse_tblastn(outfmt7), n_rows),
+        "join_hits": (lambda: tblastn.join_hits(hits), len(hits)),
+        "write_subseq": (lambda: subseq.write_subseq(paths["genome"], windows,
+                                                     outdir=windir),
+                         len(windows)),
+        "exonerate_hints": (lambda: convert_hints(rawf, "queries.fa"),
+                            os.path.getsize(rawf)),
+        "parse_augustus": (lambda: consume(augustus.iter_augustus(augf)),
+                           os.path.getsize(augf)),
+    }
+    if hittable.np is not None:
+        stages["hittable_parse_tblastn"] = (
+            lambda: hittable.parse_tblastn(outfmt7), n_rows)
+    return stages
+
+
+def run_pipeline(workdir: str, scale: int, seed: int, threads=1,
+                 extra=None) -> dict:
+    """
+    run peppercorn.py end to end against the stub tools, reporting wall
+    time, the largest child RSS and the fraction of planted loci predicted
+    """
+    d = os.path.join(workdir, "pipeline_%d" % scale)
+    paths = synth.write_dataset(d, seed, contigs=4 * scale,
+                                contig_length=250000, families=2 * scale,
+                                members=5)
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(bench_dir, "stubs") + os.pathsep + env["PATH"]
+    env["PEPPERCORN_BENCH_TRUTH"] = paths["truth"]
+    cmd = [sys.executable, os.path.join(src_dir, "peppercorn.py"),
+           "genome.fa", "queries.fa", "-t", str(threads), "--no-cache"]
+    cmd += extra or []
+    start = time.perf_counter()
+    with open(os.path.join(d, "stderr.txt"), "w") as errf:
+        p = subprocess.Popen(cmd, cwd=d, env=env, stdout=subprocess.DEVNULL,
+                             stderr=errf)
+        # rusage of this run only: peppercorn.py and the tools it waited on
+        _, status, usage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd)
+    return {"seconds": round(seconds, 3),
+            "cpu_seconds": round(usage.ru_utime + usage.ru_stime, 3),
+            "max_rss_mb": round(usage.ru_maxrss / 1024, 1),
+            "recall": recall(os.path.join(d,
+                                          "final_supported_predictions.gtf"),
+                             synth.read_truth(paths["truth"]))}
+
+
+def exon_sensitivity(hits: list[utils.tblastnhit], truth: list[dict],
+                     min_len=15) -> float:
+    """
+    fraction of planted exons of at least min_len residues overlapped, on
+    their contig and strand, by a hit of their own query
+    """
+    byquery = {}
+    for h in hits:
+        byquery.setdefault(h.query, []).append(h)
+    found = total = 0
+    for t in truth:
+        for s, e, qs, qe in t["exons"]:
+            if qe - qs + 1 < min_len:
+                continue
+            total += 1
+            if any(h.subject == t["contig"] and h.sstartorder <= e and
+                   s <= h.sendorder and (h.sstart > h.send) ==
+                   (t["strand"] == "-") for h in byquery.get(t["query"], [])):
+                found += 1
+    return round(found / total, 4) if total else 0.0
+
+
+def compare_finders(workdir: str, scale: int, seed: int, threads=1) -> list:
+    """
+    time each locus finder from scratch (building its index or blast db,
+    then searching) and score the hits against the planted exons. tblastn
+    is only compared where a real one is on PATH; the stubs are not
+    """
+    d = os.path.join(workdir, "finders_%d" % scale)
+    paths = synth.write_dataset(d, seed, contigs=4 * scale,
+                                contig_length=250000, families=2 * scale,
+                                members=5)
+    truth = synth.read_truth(paths["truth"])
+    out = []
+    if kmerseed.np is not None:
+        start = time.perf_counter()
+        kmerseed.load_index(paths["genome"])
+        built = time.perf_counter()
+        hits = [h for _, batch in kmerseed.stream_kmer(paths["queries"],
+                                                       paths["genome"],
+                                                       threads=threads)
+                for h in batch]
+        out.append({"finder": "kmer",
+                    "index_seconds": round(built - start, 3),
+                    "search_seconds": round(time.perf_counter() - built, 3),
+                    "hits": len(hits),
+                    "exon_sensitivity": exon_sensitivity(hits, truth)})
+    if utils.tool_version("tblastn"):
+        start = time.perf_counter()
+        tblastn.ensure_blastdb(paths["genome"])
+        built = time.perf_counter()
+        hits = tblastn.parse_tblastn(tblastn.run_tblastn(paths["queries"],
+                                                         paths["genome"],
+                                                         threads))
+        out.append({"finder": "tblastn",
+                    "index_seconds": round(built - start, 3),
+                    "search_seconds": round(time.perf_counter() - built, 3),
+                    "hits": len(hits),
+                    "exon_sensitivity": exon_sensitivity(hits, truth)})
+    for res in out:
+        res["scale"] = scale
+    return out
+
+
+def recall(gtff: str, truth: list[dict]) -> float:
+    """
+    fraction of planted loci overlapped by a predicted gene, mapping window
+    coordinates (seqname contig_start_end) back to the contig
+    """
+    genes = []
+    with open(gtff, "r", encoding="utf-8") as inf:
+        for line in inf:
+            rec = line.split("\t")
+            if len(rec) < 5 or rec[2] != "gene":
+                continue
+            contig, start, _ = rec[0].rsplit("_", 2)
+            genes.append((contig, int(start) + int(rec[3]) - 1,
+                          int(start) + int(rec[4]) - 1))
+    found = 0
+    for t in truth:
+        s = min(x[0] for x in t["exons"])
+        e = max(x[1] for x in t["exons"])
+        if any(c == t["contig"] and gs <= e and s <= ge
+               for c, gs, ge in genes):
+            found += 1
+    return round(found / len(truth), 4) if truth else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark peppercorn \
+                                     stages and the full pipeline on \
+                                     synthetic data, writing JSON")
+    parser.add_argument("--scales", help="Comma-separated data scale \
+                        multipliers [1,2,4]", type=str, default="1,2,4")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-t", "--threads", help="Threads for the pipeline \
+                        runs [1]", type=int, default=1)
+    parser.add_argument("--stages", help="Comma-separated subset of stages \
+                        to run [all]", type=str, default=None)
+    parser.add_argument("--no-pipeline", help="Skip the end-to-end runs",
+                        action="store_true")
+    parser.add_argument("--no-finders", help="Skip comparing the kmer and \
+                        tblastn locus finders", action="store_true")
+    parser.add_argument("--no-memory", help="Skip peak memory measurement",
+                        action="store_true")
+    parser.add_argument("-o", "--out", help="Write JSON here instead of \
+                        stdout", type=str, default=None)
+    parser.add_argument("--keep", help="Keep the working directory",
+                        action="store_true")
+    args = parser.parse_args()
+
+    scales = [int(x) for x in args.scales.split(",")]
+    report = {"python": platform.python_version(),
+              "numpy": hittable.np is not None,
+              "scales": scales, "stages": {}, "pipeline": [],
+              "finders": []}
+    workdir = tempfile.mkdtemp(prefix="peppercorn_bench")
+    try:
+        for scale in scales:
+            sys.stderr.write("Benchmarking scale %d\n\n" % scale)
+            for name, (fn, size) in stage_inputs(workdir, scale,
+                                                 args.seed).items():
+                if args.stages and name not in args.stages.split(","):
+                    continue
+                res = measure(fn, memory=not args.no_memory)
+                res.update({"scale": scale, "size": size})
+                report["stages"].setdefault(name, []).append(res)
+            if not args.no_finders:
+                report["finders"] += compare_finders(workdir, scale,
+                                                     args.seed, args.threads)
+            if not args.no_pipeline:
+                finders = ["tblastn"]
+                if kmerseed.np is not None:
+                    finders.append("kmer")
+                for finder in finders:
+                    res = run_pipeline(workdir, scale, args.seed, args.threads,
+                                       ["--finder", finder])
+                    res.update({"scale": scale, "finder": finder})
+                    report["pipeline"].append(res)
+    finally:
+        if args.keep:
+            sys.stderr.write("Kept %s\n" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=1) + "\n"
+    if args.out is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as outf:
+            outf.write(text)
@@ -0,0 +1,366 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+
+aa_alphabet = "ACDEFGHIKLMNPQRSTVWY"
+codon_table = {
+    "A": ["GCT", "GCC", "GCA", "GCG"], "C": ["TGT", "TGC"],
+    "D": ["GAT", "GAC"], "E": ["GAA", "GAG"], "F": ["TTT", "TTC"],
+    "G": ["GGT", "GGC", "GGA", "GGG"], "H": ["CAT", "CAC"],
+    "I": ["ATT", "ATC", "ATA"], "K": ["AAA", "AAG"],
+    "L": ["TTA", "TTG", "CTT", "CTC", "CTA", "CTG"], "M": ["ATG"],
+    "N": ["AAT", "AAC"], "P": ["CCT", "CCC", "CCA", "CCG"],
+    "Q": ["CAA", "CAG"], "R": ["CGT", "CGC", "CGA", "CGG", "AGA", "AGG"],
+    "S": ["TCT", "TCC", "TCA", "TCG", "AGT", "AGC"],
+    "T": ["ACT", "ACC", "ACA", "ACG"], "V": ["GTT", "GTC", "GTA", "GTG"],
+    "W": ["TGG"], "Y": ["TAT", "TAC"], "*": ["TAA", "TAG", "TGA"]}
+translation = {c: aa for aa, cs in codon_table.items() for c in cs}
+complement = str.maketrans("ACGTacgtN", "TGCAtgcaN")
+
+
+def revcomp(seq: str) -> str:
+    return seq.translate(complement)[::-1]
+
+
+def translate(seq: str) -> str:
+    return "".join(translation.get(seq[i:i+3].upper(), "X")
+                   for i in range(0, len(seq) - 2, 3))
+
+
+def random_dna(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices("ACGT", k=length))
+
+
+def random_protein(rng: random.Random, length: int) -> str:
+    return "M" + "".join(rng.choices(aa_alphabet, k=length - 1))
+
+
+def mutate_protein(rng: random.Random, seq: str, rate=0.1) -> str:
+    return "".join(rng.choice(aa_alphabet) if rng.random() < rate else x
+                   for x in seq)
+
+
+def back_translate(rng: random.Random, seq: str) -> str:
+    return "".join(rng.choice(codon_table[x]) for x in seq)
+
+
+def make_gene(rng: random.Random, protein: str, exons=4,
+              intron_range=(100, 2000)) -> tuple[str, list[list[int]]]:
+    """
+    back-translate protein into a gene of exons separated by GT..AG introns,
+    returning its sequence and, per exon, [start, end, qstart, qend] with
+    start/end 1-based on the gene and qstart/qend on the protein
+    """
+    cds = back_translate(rng, protein) + rng.choice(codon_table["*"])
+    exons = max(1, min(exons, len(protein) // 10))
+    cuts = sorted(rng.sample(range(3, len(cds) - 3), exons - 1))
+    bounds = list(zip([0] + cuts, cuts + [len(cds)]))
+    pieces = []
+    coords = []
+    pos = 0
+    for i, (a, b) in enumerate(bounds):
+        if i > 0:
+            intron = "GT" + random_dna(rng, rng.randint(*intron_range) - 4) + \
+                "AG"
+            pieces.append(intron)
+            pos += len(intron)
+        pieces.append(cds[a:b])
+        coords.append([pos + 1, pos + b - a, a // 3 + 1,
+                       min(len(protein), (b - 1) // 3 + 1)])
+        pos += b - a
+    return "".join(pieces), coords
+
+
+def make_dataset(rng: random.Random, contigs=4, contig_length=250000,
+                 families=2, members=5, protein_length=300, exons=4,
+                 divergence=0.1):
+    """
+    build a random genome with every member of each protein family planted
+    once, at spacer-separated loci on either strand. Returns (genome,
+    proteins, truth): genome and proteins as lists of (name, sequence) and
+    truth as one record per planted locus
+    """
+    proteins = []
+    for f in range(families):
+        ancestor = random_protein(rng, protein_length)
+        for m in range(members):
+            proteins.append(("fam%d_p%d" % (f, m), "fam%d" % f,
+                             mutate_protein(rng, ancestor, divergence)))
+    pieces = {"chr%d" % (c + 1): [] for c in range(contigs)}
+    lengths = dict.fromkeys(pieces, 0)
+    truth = []
+    for i, (name, family, seq) in enumerate(proteins):
+        contig = "chr%d" % (i % contigs + 1)
+        spacer = random_dna(rng, rng.randint(5000, 20000))
+        gene, coords = make_gene(rng, seq, exons)
+        strand = rng.choice("+-")
+        offset = lengths[contig] + len(spacer)
+        if strand == "-":
+            gene = revcomp(gene)
+            coords = [[len(gene) - e + 1, len(gene) - s + 1, qs, qe]
+                      for s, e, qs, qe in coords]
+        truth.append({"query": name, "family": family, "contig": contig,
+                      "strand": strand, "qlen": len(seq),
+                      "exons": [[s + offset, e + offset, qs, qe]
+                                for s, e, qs, qe in coords]})
+        pieces[contig] += [spacer, gene]
+        lengths[contig] += len(spacer) + len(gene)
+    genome = []
+    for contig, parts in pieces.items():
+        tail = max(5000, contig_length - lengths[contig])
+        genome.append((contig, "".join(parts) + random_dna(rng, tail)))
+    return genome, [(n, s) for n, _, s in proteins], truth
+
+
+def write_fasta(records, path: str, width=60):
+    with open(path, "w", encoding="utf-8") as outf:
+        for name, seq in records:
+            outf.write(">%s\n" % name)
+            for i in range(0, len(seq), width):
+                outf.write(seq[i:i+width] + "\n")
+
+
+def write_dataset(outdir: str, seed=1, **kwargs) -> dict:
+    """
+    write genome.fa, queries.fa and truth.jsonl to outdir, returning their
+    paths
+    """
+    os.makedirs(outdir, exist_ok=True)
+    genome, proteins, truth = make_dataset(random.Random(seed), **kwargs)
+    paths = {"genome": os.path.join(outdir, "genome.fa"),
+             "queries": os.path.join(outdir, "queries.fa"),
+             "truth": os.path.join(outdir, "truth.jsonl")}
+    write_fasta(genome, paths["genome"])
+    write_fasta(proteins, paths["queries"])
+    with open(paths["truth"], "w", encoding="utf-8") as outf:
+        for t in truth:
+            outf.write(json.dumps(t) + "\n")
+    return paths
+
+
+def read_truth(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as inf:
+        return [json.loads(line) for line in inf]
+
+
+def tblastn_rows(truth: list[dict], queries: list[str], subjects=None):
+    """
+    rows of tblastn outfmt 6 as a real search would report them: every query
+    hits each exon of every locus of its family, best at its own locus.
+    Loci on contigs outside subjects (if given) are skipped
+    """
+    by_family = {}
+    for t in truth:
+        by_family.setdefault(t["family"], []).append(t)
+    family = {t["query"]: t["family"] for t in truth}
+    for q in queries:
+        for t in by_family.get(family.get(q), []):
+            if subjects is not None and t["contig"] not in subjects:
+                continue
+            own = t["query"] == q
+            for s, e, qs, qe in t["exons"]:
+                alen = qe - qs + 1
+                ident = 100.0 if own else 90.0
+                score = round(alen * (2.0 if own else 1.6), 1)
+                evalue = "%.2e" % (10 ** -min(180, alen // 2))
+                sstart, send = (s, e) if t["strand"] == "+" else (e, s)
+                yield [q, t["contig"], "%.3f" % ident, str(alen),
+                       str(round(alen * (100 - ident) / 100)), "0", str(qs),
+                       str(qe), str(sstart), str(send), evalue, str(score)]
+
+
+def random_tblastn_rows(rng: random.Random, n: int, queries=300,
+                        subjects=25, subject_length=10 ** 7):
+    """
+    n unstructured outfmt 6 rows, for parser benchmarks
+    """
+    for i in range(n):
+        s = rng.randint(1, subject_length)
+        e = s + rng.choice([-1, 1]) * rng.randint(30, 600)
+        yield ["q%d" % (i % queries), "chr%d" % (i % subjects),
+               "%.3f" % rng.uniform(30, 100), str(abs(e - s) // 3),
+               "5", "0", "1", "100", str(s), str(e),
+               "%.2e" % (10 ** -rng.randint(0, 60)),
+               "%.1f" % rng.uniform(10, 400)]
+
+
+def write_tblastn(rows, path: str, outfmt=7, queries=None, delay=0.0):
+    """
+    write rows as outfmt 6 or 7. With queries (in search order), outfmt 7
+    has a comment block for every query, hits or not, as BLAST writes it.
+    delay seconds are slept after each query, as if searching
+    """
+    with open(path, "w", encoding="utf-8") as outf:
+        if outfmt != 7:
+            for r in rows:
+                outf.write("\t".join(r) + "\n")
+            return
+        by_query = {}
+        for r in rows:
+            by_query.setdefault(r[0], []).append(r)
+        for q in queries if queries is not None else by_query:
+            outf.write("# TBLASTN 2.14.0+\n# Query: %s\n" % q)
+            hits = by_query.get(q, [])
+            if hits:
+                outf.write("# Fields: query acc.ver, subject acc.ver, "
+                           "% identity, alignment length, mismatches, gap "
+                           "opens, q. start, q. end, s. start, s. end, "
+                           "evalue, bit score\n")
+            outf.write("# %d hits found\n" % len(hits))
+            for r in hits:
+                outf.write("\t".join(r) + "\n")
+            outf.flush()
+            time.sleep(delay)
+        if queries is not None:
+            outf.write("# BLAST processed %d queries\n" % len(queries))
+
+
+def exonerate_lines(target: str, offset: int, length: int, contig: str,
+                    queries: list[str], truth: list[dict]):
+    """
+    exonerate --showtargetgff output for queries against a window of contig
+    starting at offset (1-based) of length bases, with an alignment block
+    and GFF dump for each family locus with exons inside the window
+    """
+    family = {t["query"]: t["family"] for t in truth}
+    yield "Command line: [exonerate -m protein2genome --showtargetgff TRUE]"
+    yield "Hostname: [synthetic]"
+    for q in queries:
+        for t in truth:
+            if t["contig"] != contig or t["family"] != family.get(q):
+                continue
+            # local alignment: only exons wholly inside the window align
+            exons = sorted([s - offset + 1, e - offset + 1]
+                           for s, e, _, _ in t["exons"]
+                           if s >= offset and e - offset < length)
+            if not exons:
+                continue
+            gstart, gend = exons[0][0], exons[-1][1]
+            score = sum(e - s + 1 for s, e in exons)
+            yield ""
+            yield "C4 Alignment:"
+            yield "------------"
+            yield "         Query: %s" % q
+            yield "        Target: %s" % target
+            yield "         Model: protein2genome:local"
+            yield "     Raw score: %d" % score
+            for s, e in exons:  # stand-in for the alignment text
+                yield "  %8d : %s : %8d" % (s, "X" * 60, e)
+            yield "# --- START OF GFF DUMP ---"
+            yield "#"
+            yield "\t".join([target, "exonerate:protein2genome:local",
+                             "gene", str(gstart), str(gend), str(score),
+                             t["strand"], ".",
+                             "gene_id 1 ; sequence %s" % q])
+            for i, (s, e) in enumerate(exons):
+                if i > 0:
+                    yield "\t".join([target,
+                                     "exonerate:protein2genome:local",
+                                     "intron", str(exons[i - 1][1] + 1),
+                                     str(s - 1), ".", t["strand"], ".",
+                                     "intron_id %d" % i])
+                yield "\t".join([target, "exonerate:protein2genome:local",
+                                 "cds", str(s), str(e), ".", t["strand"],
+                                 ".", ""])
+            yield "# --- END OF GFF DUMP ---"
+    yield "-- completed exonerate analysis"
+
+
+def augustus_lines(windows: list[tuple[str, str]], hints: list[list[str]],
+                   trim=9, gap=2500):
+    """
+    augustus --codingseq=on output predicting one gene per cluster of
+    CDSpart hints on each window
+    """
+    yield "# This output was generated with AUGUSTUS (version 3.4.0)."
+    by_seq = {}
+    for h in hints:
+        if h[2] == "CDSpart":
+            by_seq.setdefault(h[0], []).append((int(h[3]) - trim,
+                                                int(h[4]) + trim, h[6]))
+    g = 0
+    for n, (name, seq) in enumerate(windows, start=1):
+        yield "# ----- prediction on sequence number %d (length = %d, " \
+            "name = %s) -----" % (n, len(seq), name)
+        clusters = []
+        for s, e, strand in sorted(by_seq.get(name, [])):
+            if clusters and s <= clusters[-1][-1][1] + gap and \
+                    strand == clusters[-1][-1][2]:
+                if s <= clusters[-1][-1][1]:  # same exon from another query
+                    last = clusters[-1][-1]
+                    clusters[-1][-1] = (last[0], max(last[1], e), strand)
+                else:
+                    clusters[-1].append((s, e, strand))
+            else:
+                clusters.append([(s, e, strand)])
+        for exons in clusters:
+            g += 1
+            strand = exons[0][2]
+            start, end = exons[0][0], exons[-1][1]
+            yield "# start gene g%d" % g
+            yield "\t".join([name, "AUGUSTUS", "gene", str(start), str(end),
+                             "1", strand, ".", "g%d" % g])
+            yield "\t".join([name, "AUGUSTUS", "transcript", str(start),
+                             str(end), "1", strand, ".", "g%d.t1" % g])
+            for s, e, _ in exons:
+                yield "\t".join([name, "AUGUSTUS", "CDS", str(s), str(e),
+                                 "1", strand, "0",
+                                 'transcript_id "g%d.t1"; gene_id "g%d";'
+                                 % (g, g)])
+            cds = "".join(seq[s-1:e] for s, e, _ in exons)
+            if strand == "-":
+                cds = revcomp(cds)
+            protein = translate(cds).rstrip("*")
+            cds = cds.lower()
+            lines = [cds[i:i+100] for i in range(0, len(cds), 100)] or [""]
+            yield "# coding sequence = [" + lines[0] + \
+                ("]" if len(lines) == 1 else "")
+            for i, line in enumerate(lines[1:], start=2):
+                yield "# " + line + ("]" if i == len(lines) else "")
+            lines = [protein[i:i+100] for i in range(0, len(protein), 100)] \
+                or [""]
+            yield "# protein sequence = [" + lines[0] + \
+                ("]" if len(lines) == 1 else "")
+            for i, line in enumerate(lines[1:], start=2):
+                yield "# " + line + ("]" if i == len(lines) else "")
+            yield "# Evidence for and against this transcript:"
+            yield "# % of transcript supported by hints (any source): 100"
+            yield "# CDS exons: %d/%d" % (len(exons), len(exons))
+            yield "#      M:   %d " % len(exons)
+            yield "# CDS introns: %d/%d" % (len(exons) - 1, len(exons) - 1)
+            yield "# hint groups fully obeyed: 1"
+            yield "# incompatible hint groups: 0"
+            yield "# end gene g%d" % g
+            yield "###"
+    yield "# command line:"
+    yield "# augustus --species=synthetic"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic genome, \
+                                     planted protein families and their \
+                                     truth loci")
+    parser.add_argument("outdir", help="Directory to write genome.fa, \
+                        queries.fa and truth.jsonl")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--contigs", type=int, default=4)
+    parser.add_argument("--contig-length", type=int, default=250000)
+    parser.add_argument("--families", type=int, default=2)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--protein-length", type=int, default=300)
+    parser.add_argument("--exons", type=int, default=4)
+    args = parser.parse_args()
+
+    paths = write_dataset(args.outdir, args.seed, contigs=args.contigs,
+                          contig_length=args.contig_length,
+                          families=args.families, members=args.members,
+                          protein_length=args.protein_length,
+                          exons=args.exons)
+    sys.stdout.write(json.dumps(paths) + "\n")
@@ -3,15 +3,24 @@
 
 import re
 import sys
+import shutil
 import subprocess
+import concurrent.futures
+import instrument
 
 
 class AugustusRes():
     """
     simple class to hold Augustus results
     """
+    __slots__ = ("gene", "seqname", "gff", "codingseq", "aaseq",
+                 "percent_support", "support_exons", "unsupport_exons",
+                 "support_introns", "unsupport_introns", "fully",
+                 "incompatible")
+
     def __init__(self):
         self.gene = ""
+        self.seqname = ""  # sequence the gene was predicted on
         self.gff = []
         self.codingseq = ""
         self.aaseq = ""
@@ -34,103 +43,192 @@ class AugustusRes():
         return out
 
 
-def run_augustus(dbf: str, hintsf: str, species="arabidopsis",
-                 coding=True) -> str:
+def augustus_cmd(dbf: str, hintsf: str, species="arabidopsis",
+                 coding=True) -> tuple[list[str], str]:
     """
-    run augustus using arabidopsis model and returning coding sequences by default
+    the augustus command predicting on dbf with hintsf, and its output file
     """
     cmd = ["augustus", "--species=" + species,
            "--hintsfile=" + hintsf, dbf]
     if coding:
         cmd += ["--codingseq=on"]
+    return cmd, dbf + ".hints.augustus.out"
+
+
+def fetch_cached(cache, cmd: list[str], dbf: str, hintsf: str, out: str):
+    """
+    the cache key of an augustus run, and whether out was restored from
+    cache
+    """
+    if cache is None:
+        return None, False
+    key = cache.key("augustus", cmd, [dbf, hintsf])
+    return key, cache.fetch("augustus", key, [out]) is not None
+
+
+def store_cached(cache, key: str, out: str):
+    if cache is not None:
+        cache.store("augustus", key, [out])
+
+
+def finish_range(r, augout: str, progress=None):
+    """
+    record range r's augustus step in the run manifest progress
+    """
+    if progress is not None:
+        progress.step_done(r, "augustus", out=augout, files=[augout])
+
+
+def run_augustus(dbf: str, hintsf: str, species="arabidopsis",
+                 coding=True, cache=None) -> str:
+    """
+    run augustus using arabidopsis model and returning coding sequences by default
+    """
+    cmd, out = augustus_cmd(dbf, hintsf, species, coding)
+    key, hit = fetch_cached(cache, cmd, dbf, hintsf, out)
+    if hit:
+        return out
     sys.stderr.write(subprocess.list2cmdline(cmd)+"\n\n")
-    p = subprocess.run(cmd, shell=False, capture_output=True, text=True, check=True)
-    out = dbf + ".hints.augustus.out"
     with open(out, "w", encoding="utf-8") as outf:
-        for line in p.stdout.splitlines():
-            outf.write(line+"\n")
+        instrument.run(cmd, stdout=outf, stderr=subprocess.PIPE, text=True,
+                       check=True, inputs=[dbf, hintsf], outputs=[out])
+    store_cached(cache, key, out)
     return out
 
 
-def parse_augustus(outf: str) -> list[AugustusRes]:
+def run_augustus_batch(dbfs: list[str], hintsfs: list[str],
+                       species="arabidopsis", coding=True, shards=1,
+                       cache=None, prefix="augustus_batch"
+                       ) -> tuple[dict[str, list[AugustusRes]], dict[str, str]]:
     """
-    parse augustus output gff
+    predict over many windows with one augustus process per shard, instead
+    of one per window, so the species parameters are loaded once per shard.
+    Windows and their hints are concatenated into prefix.N.fa and
+    prefix.N.hints (hint seqnames are already the window ids). Returns
+    predictions keyed by the window they were made on, and the error of
+    each window (as its dbf) whose shard failed, so one failure loses only
+    its shard's windows
+    """
+    if not dbfs:
+        return {}, {}
+    shards = max(1, min(shards, len(dbfs)))
+    jobs = []
+    for j in range(shards):
+        shardf = "%s.%d.fa" % (prefix, j + 1)
+        shardh = "%s.%d.hints" % (prefix, j + 1)
+        with open(shardf, "wb") as outf, open(shardh, "wb") as outh:
+            for dbf, hintsf in list(zip(dbfs, hintsfs))[j::shards]:
+                with open(dbf, "rb") as inf:
+                    shutil.copyfileobj(inf, outf)
+                with open(hintsf, "rb") as inf:
+                    shutil.copyfileobj(inf, outh)
+        jobs.append((shardf, shardh, dbfs[j::shards]))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=shards) as pool:
+        futures = [pool.submit(run_augustus, shardf, shardh, species, coding,
+                               cache) for shardf, shardh, _ in jobs]
+    out = {}
+    failed = {}
+    for (shardf, _, members), f in zip(jobs, futures):
+        try:
+            augout = f.result()
+        except Exception as e:
+            sys.stderr.write("Failed to run augustus on %s: %s\n\n"
+                             % (shardf, e))
+            failed.update((dbf, str(e)) for dbf in members)
+            continue
+        for a in parse_augustus(augout):
+            try:
+                out[a.seqname].append(a)
+            except KeyError:
+                out[a.seqname] = [a]
+    for genes in out.values():  # numbered per process, not per window
+        rename(genes)
+    return out, failed
+
+
+def iter_augustus(outf: str):
+    """
+    parse augustus output gff in a single pass, yielding each gene as soon as
+    its "end gene" line is read. Sequence lines are collected in lists and
+    joined once per gene
     """
-    out = []
     with open(outf, "r", encoding="utf-8") as res:
-        gene = False
-        cds = False
-        aa = False
+        newres = None
+        seq = None  # pieces of the coding or protein sequence being read
         for line in res:
-            if line.startswith("#"):
-                line = line.lstrip("# ").strip()
-            else:  # gff
-                newres.gff.append(line.strip().split())  # order is meaningful
-            if gene:
-                if line.startswith("end gene"):
-                    gene = False
-                    out.append(newres)
-                if cds:
-                    if line.endswith("]"):
-                        cds = False
-                        line = re.sub("\\]",
-                                      "",
-                                      line)
-                        newres.codingseq += line
-                        newres.codingseq = newres.codingseq.upper()
-                    else:
-                        newres.codingseq += line.strip()
-                if line.startswith("coding sequence"):
-                    cds = True
-                    line = re.sub("coding sequence = \\[",
-                                  "",
-                                  line)
-                    newres.codingseq += line
-                if aa:
-                    if line.endswith("]"):
-                        aa = False
-                        line = re.sub("\\]",
-                                      "",
-                                      line)
-                        newres.aaseq += line
-                    else:
-                        newres.aaseq += line
-                if line.startswith("protein sequence"):
-                    aa = True
-                    line = re.sub("protein sequence = \\[",
-                                  "",
-                                  line)
-                    newres.aaseq += line
-                if line.startswith("%"):
-                    newres.percent_support = float(line.split(":")[1].strip())
-                if line.startswith("CDS exons"):
-                    num = int(line.split(":")[1].strip().split("/")[0])
-                    denom = int(line.split(":")[1].strip().split("/")[1])
-                    newres.support_exons = num
-                    newres.unsupport_exons = denom
-                if line.startswith("CDS introns"):
-                    num = int(line.split(":")[1].strip().split("/")[0])
-                    denom = int(line.split(":")[1].strip().split("/")[1])
-                    newres.support_introns = num
-                    newres.unsupport_introns = denom
-                if line.startswith("hint groups"):
-                    num = int(line.split(":")[1].strip())
-                    newres.fully = num
-                if line.startswith("incompatible"):
-                    num = int(line.split(":")[1].strip())
-                    newres.incompatible = num
-            if line.startswith("start gene"):
-                gene = True
-                newres = AugustusRes()
-                newres.gene = line.split(" ")[2]
-    return out
+            if not line.startswith("#"):  # gff
+                if newres is not None:
+                    rec = line.split()  # order is meaningful
+                    if rec:
+                        newres.gff.append(rec)
+                        if not newres.seqname:
+                            newres.seqname = rec[0]
+                continue
+            line = line.lstrip("# ").strip()
+            if newres is None:
+                if line.startswith("start gene"):
+                    newres = AugustusRes()
+                    newres.gene = line.split(" ")[2]
+                    cds = []
+                    aa = []
+                continue
+            if seq is not None:  # inside a [...] sequence block
+                if line.endswith("]"):
+                    seq.append(line[:-1])
+                    seq = None
+                else:
+                    seq.append(line)
+            elif line.startswith("coding sequence"):
+                seq = cds
+                line = line[line.index("[") + 1:]
+                if line.endswith("]"):
+                    line = line[:-1]
+                    seq = None
+                cds.append(line)
+            elif line.startswith("protein sequence"):
+                seq = aa
+                line = line[line.index("[") + 1:]
+                if line.endswith("]"):
+                    line = line[:-1]
+                    seq = None
+                aa.append(line)
+            elif line.startswith("%"):
+                newres.percent_support = float(line.split(":")[1].strip())
+            elif line.startswith("CDS exons"):
+                num, denom = line.split(":")[1].strip().split("/")
+                newres.support_exons = int(num)
+                newres.unsupport_exons = int(denom)
+            elif line.startswith("CDS introns"):
+                num, denom = line.split(":")[1].strip().split("/")
+                newres.support_introns = int(num)
+                newres.unsupport_introns = int(denom)
+            elif line.startswith("hint groups"):
+                newres.fully = int(line.split(":")[1].strip())
+            elif line.startswith("incompatible"):
+                newres.incompatible = int(line.split(":")[1].strip())
+            elif line.startswith("end gene"):
+                newres.codingseq = "".join(cds).upper()
+                newres.aaseq = "".join(aa)
+                yield newres
+                newres = None
+
+
+def parse_augustus(outf: str) -> list[AugustusRes]:
+    """
+    parse augustus output gff
+    """
+    return list(iter_augustus(outf))
 
 
 def rename(results: list[AugustusRes]):
     """
-    rename a list of Augustus annotations to consecutive integer format
+    rename a list of Augustus annotations to consecutive integer format,
+    along with the gene and transcript ids of their gff
     """
     i = 1
     for r in results:
+        old = re.compile(r'(^|")%s(?=[."]|$)' % re.escape(r.gene))
         r.gene = f"g{i}"
+        for rec in r.gff:
+            rec[8:] = [old.sub(r"\g<1>" + r.gene, x) for x in rec[8:]]
         i += 1
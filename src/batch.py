@@ -0,0 +1,233 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import utils
+import argparse
+import tblastn
+import subseq
+import peppercorn
+import instrument
+import checkpoint
+import kmerseed
+import hitstore
+
+
+def read_manifest(manifestf: str) -> list[tuple[str, str]]:
+    """
+    parse a tab-separated manifest of family name and query FASTA per line.
+    Relative query paths are taken relative to the manifest
+    """
+    out = []
+    base = os.path.dirname(manifestf)
+    with open(manifestf, "r", encoding="utf-8") as inf:
+        for line in inf:
+            if line.startswith("#") or not line.strip():
+                continue
+            family, queryf = line.rstrip("\n").split("\t")[:2]
+            out.append((family, os.path.join(base, queryf)))
+    return out
+
+
+def combine_queries(families: list[tuple[str, str]],
+                    outf: str) -> dict[str, str]:
+    """
+    write every family's queries to outf for a single tblastn search,
+    returning the family of each query id. Query ids must be unique across
+    families, so hits can be split back by id
+    """
+    owner = {}
+    with open(outf, "w", encoding="utf-8") as out:
+        for family, queryf in families:
+            for name, seq in utils.parse_fasta(queryf):
+                qid = name.split()[0]
+                if qid in owner:
+                    raise ValueError("Query %s is in both %s and %s"
+                                     % (qid, owner[qid], family))
+                owner[qid] = family
+                out.write(">%s\n%s\n" % (name, seq))
+    return owner
+
+
+def split_hits(tblastn_hits: list[utils.tblastnhit],
+               owner: dict[str, str]) -> dict[str, list[utils.tblastnhit]]:
+    out = {}
+    for h in tblastn_hits:
+        try:
+            out[owner[h.query]].append(h)
+        except KeyError:
+            out[owner[h.query]] = [h]
+    return out
+
+
+def parsed_groups(tblastn_out: str, owner: dict[str, str]):
+    """
+    (family, hits) from a finished tblastn search, parsed on first use
+    """
+    with instrument.span("parse_hits"):
+        tblastn_hits, _ = peppercorn.parse_hits(tblastn_out)
+    yield from split_hits(tblastn_hits, owner).items()
+
+
+class hit_source():
+    """
+    each family's hits, drawn from (family, hits) pairs only as far as the
+    family asked for, so streamed families are handed over as soon as
+    tblastn has finished with them
+    """
+    def __init__(self, groups):
+        self.groups = iter(groups)
+        self.pending = {}
+
+    def get(self, family: str) -> list[utils.tblastnhit]:
+        if family not in self.pending:
+            for group, hits in self.groups:
+                self.pending[group] = hits
+                if group == family:
+                    break
+        return self.pending.pop(family, [])
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Annotate many query \
+                                     families against one genome, with a \
+                                     single tblastn search")
+    parser.add_argument("genome", help="FASTA-formatted genomic contigs to \
+                        annotate homologues")
+    parser.add_argument("manifest", help="Tab-separated family name and \
+                        FASTA-formatted protein queries, one family per line")
+    parser.add_argument("-o", "--outdir", help="Directory for per-family \
+                        output directories [.]", type=str, default=".")
+    peppercorn.add_run_args(parser)
+    args = parser.parse_args()
+
+    results = peppercorn.open_cache(args)
+    peppercorn.start_trace(args)
+    families = read_manifest(args.manifest)
+    os.makedirs(args.outdir, exist_ok=True)
+    combinedf = os.path.join(args.outdir, "batch_queries.pep.fa")
+    owner = combine_queries(families, combinedf)
+    # ids are unique across families, so one store serves them all
+    queries = utils.query_store(combinedf, args.outdir)
+    qlens = queries.lengths()
+    progress = peppercorn.open_progress(args, [args.genome] +
+                                        [q for _, q in families],
+                                        args.outdir, families=families)
+
+    store = None
+    genome_key = None
+    if args.hitstore is not None:
+        store = hitstore.hit_store(args.hitstore)
+        genome_key = store.genome_digest(args.genome)
+        hits, _ = peppercorn.stored_hits(store, genome_key, args.genome,
+                                         queries, args, results)
+        family_hits = hit_source(split_hits(hits, owner).items())
+    elif args.finder == "kmer":
+        with instrument.span("kmer_index"):
+            kmerseed.load_index(args.genome, args.kmer_size)
+        family_hits = hit_source(tblastn.group_batches(
+            kmerseed.stream_kmer(combinedf, args.genome, args.kmer_size,
+                                 args.threads), owner))
+    elif args.stream_tblastn:
+        with instrument.span("blastdb"):
+            tblastn.ensure_blastdb(args.genome)
+        # families are contiguous in combinedf, so each is complete as soon
+        # as the search moves on to the next, while later ones are searched
+        family_hits = hit_source(utils.read_ahead(tblastn.group_batches(
+            tblastn.stream_tblastn(combinedf, args.genome, args.threads),
+            owner)))
+    else:
+        done = progress.stage("tblastn")
+        if done is not None:
+            tblastn_out = done["out"]
+        else:
+            with instrument.span("blastdb"):
+                tblastn.ensure_blastdb(args.genome)
+            with instrument.span("tblastn"):
+                tblastn_out = tblastn.run_tblastn(combinedf, args.genome,
+                                                  args.threads, cache=results,
+                                                  shards=args.tblastn_shards,
+                                                  genome_shards=args.genome_shards)
+            progress.stage_done("tblastn", out=tblastn_out,
+                                files=[tblastn_out])
+        # parsed only if a family's ranges are not recorded
+        family_hits = hit_source(parsed_groups(tblastn_out, owner))
+
+    for family, _ in families:
+        famdir = os.path.join(args.outdir, family)
+        os.makedirs(famdir, exist_ok=True)
+        ranges = peppercorn.resume_ranges(progress, "ranges:" + family,
+                                          args.genome, famdir,
+                                          extract=not args.pipelined)
+        if ranges is None:
+            hits = family_hits.get(family)
+            if not hits:
+                sys.stderr.write("No tblastn hits for %s\n\n" % family)
+                peppercorn.write_results([], [], famdir)
+                continue
+            # as in a single-family run, padding uses the family's own hits
+            mean_hit_len = peppercorn.mean_length(hits)
+            with instrument.span("find_ranges", family=family):
+                ranges = peppercorn.find_ranges(hits, mean_hit_len,
+                                                args.intronlength,
+                                                args.stranded,
+                                                None if args.fixed_windows
+                                                else qlens, args.genome)
+                peppercorn.screen_queries(ranges, hits, queries,
+                                          args.max_queries,
+                                          args.collapse_similar)
+            # windows are read through the genome index, never a full parse
+            with instrument.span("write_subseq", family=family):
+                ranges = [r for r in ranges
+                          if subseq.name_window(args.genome, r, famdir)]
+                stored = peppercorn.stored_windows(store, genome_key, ranges,
+                                                   queries, args.species)
+                if not args.pipelined:
+                    subseq.write_subseq(args.genome, [r for r in ranges
+                                                      if r.seqid not in stored],
+                                        outdir=famdir)
+            progress.stage_done("ranges:" + family,
+                                ranges=checkpoint.ranges_to_json(ranges))
+        else:
+            stored = peppercorn.stored_windows(store, genome_key, ranges,
+                                               queries, args.species)
+        todo = [r for r in ranges if r.seqid not in stored]
+        finished = []
+        sys.stderr.write("Annotating %s\n\n" % family)
+        with instrument.span("process_ranges", family=family):
+            if args.pipelined:
+                goodres, badres = peppercorn.process_ranges_pipelined(todo,
+                                                                      args.genome,
+                                                                      queries,
+                                                                      args.species,
+                                                                      args.threads,
+                                                                      cache=results,
+                                                                      outdir=famdir,
+                                                                      chunks=args.exonerate_chunks,
+                                                                      progress=progress,
+                                                                      finished=finished)
+            else:
+                goodres, badres = peppercorn.process_ranges(todo, queries,
+                                                            args.species,
+                                                            args.threads,
+                                                            cache=results,
+                                                            outdir=famdir,
+                                                            batch_augustus=args.batch_augustus,
+                                                            chunks=args.exonerate_chunks,
+                                                            progress=progress,
+                                                            finished=finished)
+        goodres, badres = peppercorn.store_windows(store, genome_key, ranges,
+                                                  stored, finished, goodres,
+                                                  badres, queries,
+                                                  args.species)
+        peppercorn.write_results(goodres, badres, famdir)
+        progress.stage_done("results:" + family)
+
+    progress.close()
+    if results is not None:
+        results.report()
+    peppercorn.finish_trace(args)
@@ -0,0 +1,165 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from utils import tool_version
+
+
+def default_cachedir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME",
+                          os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "peppercorn")
+
+
+class result_cache():
+    """
+    on-disk, content-addressed store of tool outputs. Entries are keyed by a
+    hash of the tool version, its command line and the contents of its input
+    files, and evicted least recently used first once the store grows past
+    max_size bytes, down to low_water of it so the next eviction is some
+    stores away. The store's size is scanned once, then kept as a running
+    total, so only a store that takes it past max_size (or every rescan-th
+    store, to notice other writers) walks the whole cache
+    """
+    low_water = 0.9
+
+    def __init__(self, root=None, max_size=10 * 1024 ** 3, rescan=1000):
+        self.root = root if root is not None else default_cachedir()
+        self.max_size = max_size
+        self.rescan = rescan
+        self.stats = {}
+        self._size = None  # bytes stored, as of the last scan plus our stores
+        self._stores = 0
+        self._digests = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def digest(self, path: str) -> str:
+        """
+        sha256 of a file's contents, remembered while its size and mtime are
+        unchanged
+        """
+        st = os.stat(path)
+        memo = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if memo in self._digests:
+                return self._digests[memo]
+        h = hashlib.sha256()
+        with open(path, "rb") as inf:
+            for block in iter(lambda: inf.read(1 << 20), b""):
+                h.update(block)
+        with self._lock:
+            self._digests[memo] = h.hexdigest()
+        return h.hexdigest()
+
+    def key(self, tool: str, cmd: list[str], inputs: list[str]) -> str:
+        h = hashlib.sha256()
+        h.update(tool_version(tool).encode())
+        h.update(b"\0".join(x.encode() for x in cmd))
+        for f in inputs:
+            h.update(b"\0" + self.digest(f).encode())
+        return h.hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _count(self, stage: str, outcome: str):
+        with self._lock:
+            counts = self.stats.setdefault(stage, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    def fetch(self, stage: str, key: str, outputs: list[str]):
+        """
+        copy a stored result to outputs, returning its metadata dict, or None
+        on a miss
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "meta.json"), "r",
+                      encoding="utf-8") as inf:
+                meta = json.load(inf)
+            for i, o in enumerate(outputs):
+                shutil.copyfile(os.path.join(entry, str(i)), o)
+            os.utime(entry)  # mark as recently used
+        except (OSError, ValueError):
+            self._count(stage, "misses")
+            return None
+        sys.stderr.write("Using cached %s result %s\n\n" % (stage, key[:12]))
+        self._count(stage, "hits")
+        return meta
+
+    def store(self, stage: str, key: str, outputs: list[str], meta=None):
+        """
+        store outputs under key. Entries are assembled in a temporary
+        directory and renamed into place, so concurrent writers are safe
+        """
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp")
+        try:
+            for i, o in enumerate(outputs):
+                shutil.copyfile(o, os.path.join(tmp, str(i)))
+            with open(os.path.join(tmp, "meta.json"), "w",
+                      encoding="utf-8") as outf:
+                json.dump({"stage": stage,
+                           "outputs": [os.path.basename(o) for o in outputs],
+                           **(meta or {})}, outf)
+            added = sum(os.path.getsize(os.path.join(tmp, f))
+                        for f in os.listdir(tmp))
+            os.rename(tmp, entry)
+        except OSError:  # lost a race to another writer, or out of space
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        with self._lock:
+            self._stores += 1
+            if self._size is not None:
+                self._size += added
+            scan = self._size is None or self._size > self.max_size or \
+                self._stores % self.rescan == 0
+        if scan:
+            self.evict()
+
+    def evict(self):
+        """
+        remove least recently used entries, if the cache is over max_size,
+        until it fits low_water of it
+        """
+        entries = []
+        total = 0
+        for d in os.listdir(self.root):
+            sub = os.path.join(self.root, d)
+            if d.startswith(".") or not os.path.isdir(sub):
+                continue
+            for e in os.listdir(sub):
+                entry = os.path.join(sub, e)
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, f))
+                               for f in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    continue
+                total += size
+        entries.sort()
+        target = self.max_size * self.low_water \
+            if total > self.max_size else self.max_size
+        for _, size, entry in entries:
+            if total <= target:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def report(self):
+        for stage, counts in self.stats.items():
+            sys.stderr.write("Cache %s: %d hits, %d misses\n"
+                             % (stage, counts["hits"], counts["misses"]))
+        sys.stderr.write("\n")
@@ -0,0 +1,144 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import threading
+from utils import genome_range
+
+
+class run_manifest():
+    """
+    records what a run has finished, so a rerun with resume=True can skip
+    it: each completed stage, and the exonerate and augustus outcome of each
+    range (keyed by its extracted window file). The manifest is a journal of
+    JSON lines, one event appended per completion, so finishing a range costs
+    one small write however many ranges there are, and a run killed mid-write
+    loses at most its last line.
+
+    The first line holds the run's parameters; a manifest written with
+    different parameters or inputs is not resumed from
+    """
+    def __init__(self, path: str, params: dict, resume=False):
+        self.path = path
+        self.params = json.loads(json.dumps(params))  # as it reads back
+        self.stages = {}
+        self.ranges = {}
+        self._lock = threading.Lock()
+        resumed = resume and self.load()
+        if resumed:
+            sys.stderr.write("Resuming from %s: %d stages and %d ranges done\n\n"
+                             % (path, len(self.stages), len(self.ranges)))
+        elif resume:
+            sys.stderr.write("Nothing to resume in %s, starting over\n\n"
+                             % path)
+        # start from a compacted journal, dropping any torn final line
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as outf:
+            outf.write(json.dumps({"params": self.params}) + "\n")
+            for name, info in self.stages.items():
+                outf.write(json.dumps({"stage": name, "info": info}) + "\n")
+            for rfile, steps in self.ranges.items():
+                for step, info in steps.items():
+                    outf.write(json.dumps({"range": rfile, "step": step,
+                                           "info": info}) + "\n")
+        os.replace(tmp, path)
+        self._out = open(path, "a", encoding="utf-8")
+
+    def load(self) -> bool:
+        """
+        replay the journal at self.path, returning whether it was written by
+        a run with the same parameters
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as inf:
+                lines = inf.readlines()
+        except OSError:
+            return False
+        events = []
+        for line in lines:
+            try:
+                events.append(json.loads(line))
+            except ValueError:  # torn final write
+                break
+        if not events or events[0].get("params") != self.params:
+            return False
+        for e in events[1:]:
+            if "stage" in e:
+                self.stages[e["stage"]] = e["info"]
+            elif "range" in e:
+                self.ranges.setdefault(e["range"], {})[e["step"]] = e["info"]
+        return True
+
+    def _write(self, event: dict):
+        with self._lock:
+            self._out.write(json.dumps(event) + "\n")
+            self._out.flush()
+            os.fsync(self._out.fileno())
+
+    def stage(self, name: str):
+        """
+        what stage name recorded when it finished, or None if it has not,
+        or its outputs have since gone
+        """
+        info = self.stages.get(name)
+        if info is None or not all(os.path.isfile(f)
+                                   for f in info.get("files", [])):
+            return None
+        return info
+
+    def stage_done(self, name: str, **info):
+        self.stages[name] = info
+        self._write({"stage": name, "info": info})
+
+    def step(self, r: genome_range, step: str):
+        """
+        what step ("exonerate" or "augustus") recorded for range r, or None
+        if it has not finished, or its outputs have since gone
+        """
+        info = self.ranges.get(r.file, {}).get(step)
+        if info is None or not all(os.path.isfile(f)
+                                   for f in info.get("files", [])):
+            return None
+        return info
+
+    def step_done(self, r: genome_range, step: str, **info):
+        with self._lock:
+            self.ranges.setdefault(r.file, {})[step] = info
+        self._write({"range": r.file, "step": step, "info": info})
+
+    def close(self):
+        self._out.close()
+
+
+def finished_step(progress, r: genome_range, step: str):
+    """
+    as run_manifest.step, or None without a manifest
+    """
+    return progress.step(r, step) if progress is not None else None
+
+
+def ranges_to_json(ranges: list[genome_range]) -> list:
+    return [[r.query, r.subject, r.start, r.end, r.queries, r.file, r.seqid]
+            for r in ranges]
+
+
+def ranges_from_json(records: list) -> list[genome_range]:
+    out = []
+    for rec in records:
+        r = genome_range(rec[:4])
+        r.queries, r.file, r.seqid = rec[4:]
+        out.append(r)
+    return out
+
+
+def file_params(paths: list[str]) -> dict:
+    """
+    size and mtime of each input, so edited inputs are not resumed from
+    """
+    out = {}
+    for p in paths:
+        st = os.stat(p)
+        out[p] = [st.st_size, st.st_mtime_ns]
+    return out
@@ -1,50 +1,205 @@
 #! /usr/bin/python3
 
 
+import os
 import sys
+import shutil
 import argparse
+import tempfile
 import subprocess
+import concurrent.futures
+import instrument
 
 
-def run_exonerate(dbf, queryf, model="protein2genome", trim=9):
-    sys.stderr.write("Aligning proteins to genome with Exonerate\n\n")
+class hint_writer():
+    """
+    converts exonerate --showtargetgff output to augustus hints one line at a
+    time, so output never has to be held in memory. result is set once a GFF
+    dump has been seen
+    """
+    def __init__(self, outf, queryf, trim=9):
+        self.outf = outf
+        self.queryf = queryf
+        self.trim = trim
+        self.going = False
+        self.result = False
+
+    def feed(self, line: str):
+        line = line.rstrip("\n")
+        if line == "# --- START OF GFF DUMP ---":
+            self.going = True
+            self.result = True
+        elif line == "# --- END OF GFF DUMP ---":
+            self.going = False
+        if not self.going or line.startswith("#"):
+            return
+        rec = line.split("\t")
+        if len(rec) < 8:
+            return
+        if rec[2] == "intron":
+            self.outf.write("\t".join([rec[0], "xnt2h", "intron",
+                                       rec[3], rec[4], rec[5], rec[6],
+                                       rec[7],
+                                       "src=M;grep=" + self.queryf +
+                                       ";pri=4\n"
+                                       ]))
+        elif rec[2] == "cds":
+            self.outf.write("\t".join([rec[0], "xnt2h", "CDSpart",
+                                       str(int(rec[3]) + self.trim),
+                                       str(int(rec[4]) - self.trim),
+                                       rec[5], rec[6],
+                                       rec[7],
+                                       "src=M;grep=" + self.queryf +
+                                       ";pri=4\n"
+                                       ]))
+
+
+def stream_exonerate(cmd: list[str], out: str, outgff: str, queryf: str,
+                     trim=9) -> bool:
+    """
+    run an exonerate command, streaming its stdout to out and converting it
+    to hints in outgff in the same pass. Returns whether any alignment was
+    reported
+    """
+    with open(out, "w", encoding="utf-8") as rawf, \
+            open(outgff, "w", encoding="utf-8") as outf, \
+            tempfile.TemporaryFile(mode="w+", encoding="utf-8") as errf:
+        hints = hint_writer(outf, queryf, trim)
+        start = instrument.now()
+        p = subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE,
+                             stderr=errf, text=True, encoding="utf-8")
+        for line in p.stdout:
+            rawf.write(line)
+            hints.feed(line)
+        p.stdout.close()
+        rawf.flush()
+        outf.flush()
+        if instrument.wait(p, cmd[-2:], [out, outgff], start) != 0:
+            errf.seek(0)
+            raise subprocess.CalledProcessError(p.returncode, cmd,
+                                                stderr=errf.read())
+    return hints.result
+
+
+def chunk_cmd(cmd: list[str], i: int, chunks: int) -> list[str]:
+    return cmd[:-2] + ["--querychunkid", str(i),
+                       "--querychunktotal", str(chunks)] + cmd[-2:]
+
+
+def join_chunks(out: str, outgff: str, chunks: int):
+    """
+    concatenate chunk outputs out.N and outgff.N in chunk order, removing them
+    """
+    for f in [out, outgff]:
+        with open(f, "wb") as outf:
+            for i in range(1, chunks + 1):
+                with open("%s.%d" % (f, i), "rb") as inf:
+                    shutil.copyfileobj(inf, outf)
+                os.remove("%s.%d" % (f, i))
+
+
+def run_chunked(cmd: list[str], out: str, outgff: str, queryf: str, trim=9,
+                chunks=2) -> bool:
+    """
+    split the queries over chunks concurrent exonerate processes with
+    --querychunkid/--querychunktotal. Query chunks are contiguous, so
+    concatenating the chunk outputs in order gives the same hints as a
+    single run
+    """
+    def chunk(i):
+        chunkcmd = chunk_cmd(cmd, i, chunks)
+        sys.stderr.write(subprocess.list2cmdline(chunkcmd)+"\n\n")
+        return stream_exonerate(chunkcmd, "%s.%d" % (out, i),
+                                "%s.%d" % (outgff, i), queryf, trim)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=chunks) as pool:
+        results = list(pool.map(instrument.bind(chunk),
+                                range(1, chunks + 1)))
+    join_chunks(out, outgff, chunks)
+    return any(results)
+
+
+def exonerate_cmd(dbf, queryf, model="protein2genome"):
+    """
+    the exonerate command aligning queryf to dbf, and its raw output and
+    hints files, dbf.queryf.exonerate.out and dbf.queryf.exonerate.hints
+    """
     cmd = ["exonerate", "-m", model, "--showtargetgff", "TRUE", #"--refine", "full",
            queryf, dbf]
-    sys.stderr.write(subprocess.list2cmdline(cmd)+"\n\n")
-    p = subprocess.run(cmd, shell=False, capture_output=True, text=True, check=True)
-    out = ".".join([dbf, queryf, "exonerate.out"])
-    with open(out, "w", encoding="utf-8") as outf:
-        outf.write(p.stdout + "\n")
-    outgff = ".".join([dbf, queryf, "exonerate.hints"])
-    with open(outgff, "w", encoding="utf-8") as outf:
-        going = False
-        result = False
-        for line in p.stdout.splitlines():
-            if line == "# --- START OF GFF DUMP ---":
-                going = True
-                result = True
-            elif line == "# --- END OF GFF DUMP ---":
-                going = False
-            if going:
-                if not line.startswith("#"):
-                    rec = line.split("\t")
-                    if rec[2] == "intron":
-                        outf.write("\t".join([rec[0], "xnt2h", "intron",
-                                              rec[3], rec[4], rec[5], rec[6],
-                                              rec[7],
-                                              "src=M;grep=" + queryf +
-                                              ";pri=4\n"
-                                              ]))
-                    elif rec[2] == "cds":
-                        outf.write("\t".join([rec[0], "xnt2h", "CDSpart",
-                                              str(int(rec[3]) + trim),
-                                              str(int(rec[4]) - trim),
-                                              rec[5], rec[6],
-                                              rec[7],
-                                              "src=M;grep=" + queryf +
-                                              ";pri=4\n"
-                                              ]))
+    out = ".".join([dbf, os.path.basename(queryf), "exonerate.out"])
+    outgff = ".".join([dbf, os.path.basename(queryf), "exonerate.hints"])
+    return cmd, out, outgff
+
+
+def fetch_cached(cache, cmd: list[str], dbf: str, queryf: str, out: str,
+                 outgff: str, trim=9):
+    """
+    the cache key of an exonerate run, and whether it aligned anything if
+    out and outgff were restored from cache (else None). Chunking does not
+    change the hints, so it is not part of the key
+    """
+    if cache is None:
+        return None, None
+    key = cache.key("exonerate", cmd + ["trim=%d" % trim], [queryf, dbf])
+    meta = cache.fetch("exonerate", key, [out, outgff])
+    return key, None if meta is None else meta["result"]
+
+
+def store_cached(cache, key: str, out: str, outgff: str, result: bool):
+    if cache is not None:
+        cache.store("exonerate", key, [out, outgff], {"result": result})
+
+
+def finish_range(r, hintsf: str, result: bool, progress=None):
+    """
+    record range r's exonerate step in the run manifest progress, returning
+    its hints file, or None (after removing the window and hints) if nothing
+    aligned
+    """
+    if not result:
+        sys.stderr.write("No exonerate result for %s, discarding\n"
+                         % r.file)
+        os.remove(r.file)
+        os.remove(hintsf)
+        hintsf = None
+    if progress is not None:
+        progress.step_done(r, "exonerate", hints=hintsf,
+                           files=[r.file, hintsf] if hintsf else [])
+    return hintsf
+
+
+def run_exonerate(dbf, queryf, model="protein2genome", trim=9, stream=True,
+                  cache=None, chunks=1):
+    """
+    align queryf to dbf, writing raw output to dbf.queryf.exonerate.out and
+    augustus hints to dbf.queryf.exonerate.hints. By default exonerate stdout
+    is streamed, writing both files in the same pass; stream=False buffers
+    the whole output first. chunks > 1 splits the queries over that many
+    concurrent exonerate processes
+    """
+    sys.stderr.write("Aligning proteins to genome with Exonerate\n\n")
+    cmd, out, outgff = exonerate_cmd(dbf, queryf, model)
+    key, result = fetch_cached(cache, cmd, dbf, queryf, out, outgff, trim)
+    if result is not None:
         return out, outgff, result
+    if chunks > 1:
+        result = run_chunked(cmd, out, outgff, queryf, trim, chunks)
+    elif stream:
+        sys.stderr.write(subprocess.list2cmdline(cmd)+"\n\n")
+        result = stream_exonerate(cmd, out, outgff, queryf, trim)
+    else:
+        sys.stderr.write(subprocess.list2cmdline(cmd)+"\n\n")
+        p = instrument.run(cmd, capture_output=True, text=True, check=True,
+                           inputs=[queryf, dbf])
+        with open(out, "w", encoding="utf-8") as outf:
+            outf.write(p.stdout + "\n")
+        with open(outgff, "w", encoding="utf-8") as outf:
+            hints = hint_writer(outf, queryf, trim)
+            for line in p.stdout.splitlines():
+                hints.feed(line)
+        result = hints.result
+    store_cached(cache, key, out, outgff, result)
+    return out, outgff, result
 
 
 if __name__ == "__main__":
@@ -56,7 +211,11 @@ if __name__ == "__main__":
                         queries with exonerate")
     parser.add_argument("query", help="FASTA-formatted protein queries to \
                         align")
+    parser.add_argument("-c", "--chunks", help="Split the queries over this \
+                        many concurrent exonerate processes [1]", type=int,
+                        default=1)
     args = parser.parse_args()
 
-    xnt_out, xnt_hint, _ = run_exonerate(args.database, args.query)
+    xnt_out, xnt_hint, _ = run_exonerate(args.database, args.query,
+                                         chunks=args.chunks)
     print(xnt_out, xnt_hint)
@@ -0,0 +1,190 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
+import augustus
+from utils import tblastnhit, genome_range, query_store, tool_version
+
+
+schema = """
+CREATE TABLE IF NOT EXISTS genomes (path TEXT PRIMARY KEY, size INTEGER,
+                                    mtime_ns INTEGER, digest TEXT);
+CREATE TABLE IF NOT EXISTS searched (genome TEXT, query TEXT, params TEXT,
+                                     PRIMARY KEY (genome, query, params));
+CREATE TABLE IF NOT EXISTS hits (genome TEXT, query TEXT, params TEXT,
+                                 subject TEXT, id REAL, len INTEGER,
+                                 mm INTEGER, gapopens INTEGER, qstart INTEGER,
+                                 qend INTEGER, sstart INTEGER, send INTEGER,
+                                 evalue REAL, bitscore REAL);
+CREATE INDEX IF NOT EXISTS hits_by_query ON hits (genome, query, params);
+CREATE TABLE IF NOT EXISTS windows (genome TEXT, key TEXT, predictions TEXT,
+                                    PRIMARY KEY (genome, key));
+"""
+
+
+def sequence_hash(seq: str) -> str:
+    return hashlib.sha1(seq.upper().encode()).hexdigest()
+
+
+class hit_store():
+    """
+    persistent SQLite store of search hits, keyed by the genome's contents,
+    each query's sequence and the search parameters, so a rerun with a grown
+    query set searches only the queries it has not seen. Also holds the
+    predictions of each window, keyed by its coordinates and the sequences
+    of its queries, so windows that did not change are not rerun
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(schema)
+        self._lock = threading.Lock()
+
+    def genome_digest(self, genome: str) -> str:
+        """
+        sha256 of genome's contents, recomputed only when its size or mtime
+        changes
+        """
+        st = os.stat(genome)
+        path = os.path.abspath(genome)
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, digest FROM genomes "
+                                   "WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[:2] == (st.st_size, st.st_mtime_ns):
+            return row[2]
+        sys.stderr.write("Hashing %s\n\n" % genome)
+        h = hashlib.sha256()
+        with open(genome, "rb") as inf:
+            for block in iter(lambda: inf.read(1 << 20), b""):
+                h.update(block)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO genomes VALUES "
+                             "(?, ?, ?, ?)", (path, st.st_size,
+                                              st.st_mtime_ns, h.hexdigest()))
+        return h.hexdigest()
+
+    def missing(self, genome: str, queries: query_store,
+                params: str) -> list[str]:
+        """
+        ids of queries whose sequence has not been searched against genome
+        (a digest) with params
+        """
+        out = []
+        with self._lock:
+            for qid, (_, seq) in queries.seqs.items():
+                if self._db.execute("SELECT 1 FROM searched WHERE genome = ? "
+                                    "AND query = ? AND params = ?",
+                                    (genome, sequence_hash(seq),
+                                     params)).fetchone() is None:
+                    out.append(qid)
+        return out
+
+    def add(self, genome: str, queries: query_store, params: str,
+            searched: list[str], hits: list[tblastnhit]):
+        """
+        record the hits of a search of the queries in searched, including
+        those that found nothing
+        """
+        hashes = {qid: sequence_hash(queries.seqs[qid][1]) for qid in searched}
+        first = {}  # one id per sequence, so duplicate queries are kept once
+        for qid, x in hashes.items():
+            first.setdefault(x, qid)
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM hits WHERE genome = ? AND "
+                                 "query = ? AND params = ?",
+                                 [(genome, x, params)
+                                  for x in set(hashes.values())])
+            self._db.executemany(
+                "INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                "?, ?, ?)",
+                [(genome, hashes[h.query], params, h.subject, h.id, h.len,
+                  h.mm, h.gapopens, h.qstart, h.qend, h.sstart, h.send,
+                  h.evalue, h.bitscore) for h in hits
+                 if h.query in hashes and first[hashes[h.query]] == h.query])
+            self._db.executemany("INSERT OR IGNORE INTO searched VALUES "
+                                 "(?, ?, ?)", [(genome, x, params)
+                                               for x in set(hashes.values())])
+
+    def hits(self, genome: str, queries: query_store,
+             params: str) -> list[tblastnhit]:
+        """
+        stored hits of every query, named by its id in queries
+        """
+        out = []
+        with self._lock:
+            for qid, (_, seq) in queries.seqs.items():
+                for row in self._db.execute(
+                        "SELECT subject, id, len, mm, gapopens, qstart, qend, "
+                        "sstart, send, evalue, bitscore FROM hits WHERE "
+                        "genome = ? AND query = ? AND params = ? ORDER BY "
+                        "rowid", (genome, sequence_hash(seq), params)):
+                    out.append(tblastnhit([qid] + list(row)))
+        return out
+
+    def window(self, genome: str, key: str):
+        """
+        (supported, unsupported) predictions stored for the window key, or
+        None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT predictions FROM windows WHERE "
+                                   "genome = ? AND key = ?",
+                                   (genome, key)).fetchone()
+        if row is None:
+            return None
+        return tuple([to_prediction(x) for x in kind]
+                     for kind in json.loads(row[0]))
+
+    def add_window(self, genome: str, key: str, good: list, bad: list):
+        text = json.dumps([[from_prediction(a) for a in kind]
+                           for kind in (good, bad)])
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO windows VALUES (?, ?, ?)",
+                             (genome, key, text))
+
+    def close(self):
+        self._db.close()
+
+
+def from_prediction(a: augustus.AugustusRes) -> dict:
+    return {s: getattr(a, s) for s in augustus.AugustusRes.__slots__}
+
+
+def to_prediction(fields: dict) -> augustus.AugustusRes:
+    a = augustus.AugustusRes()
+    for s, v in fields.items():
+        setattr(a, s, v)
+    return a
+
+
+def window_key(r: genome_range, queries: query_store,
+               species="arabidopsis") -> str:
+    """
+    what a window's predictions depend on: its coordinates, the sequences of
+    its queries, the species model and the exonerate and augustus versions
+    """
+    return hashlib.sha1(json.dumps(
+        [r.subject, r.start, r.end,
+         sorted(sequence_hash(queries.seqs[q][1]) for q in r.queries),
+         species, tool_version("exonerate"),
+         tool_version("augustus")]).encode()).hexdigest()
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Summarise a hit store")
+    parser.add_argument("store", help="SQLite hit store")
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.store)
+    for table in ["genomes", "searched", "hits", "windows"]:
+        n = db.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+        sys.stdout.write("%s\t%d\n" % (table, n))
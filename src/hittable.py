@@ -0,0 +1,119 @@
+#! /usr/bin/python3
+
+
+import io
+import sys
+from utils import tblastnhit
+
+try:
+    import numpy as np
+except ImportError:  # fall back to tblastn.parse_tblastn
+    np = None
+
+
+outfmt_cols = ["query", "subject", "id", "len", "mm", "gapopens", "qstart",
+               "qend", "sstart", "send", "evalue", "bitscore"]
+
+if np is not None:
+    hit_dtype = np.dtype([("query", np.int32), ("subject", np.int32),
+                          ("id", np.float64), ("len", np.int32),
+                          ("mm", np.int32), ("gapopens", np.int32),
+                          ("qstart", np.int32), ("qend", np.int32),
+                          ("sstart", np.int64), ("send", np.int64),
+                          ("evalue", np.float64), ("bitscore", np.float64),
+                          ("sstartorder", np.int64), ("sendorder", np.int64)])
+
+
+class hit_table():
+    """
+    columnar store of tblastn hits in a numpy structured array, with query
+    and subject names interned to integer codes into self.queries and
+    self.subjects. Used to parse and filter hits quickly; clustering still
+    takes them as tblastnhit objects (see to_hits)
+    """
+    def __init__(self, rows=None, queries=None, subjects=None):
+        if np is None:
+            raise ImportError("hit_table requires numpy")
+        self.rows = rows if rows is not None else np.empty(0, hit_dtype)
+        self.queries = queries if queries is not None else []
+        self.subjects = subjects if subjects is not None else []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def mean_hit_len(self) -> int:
+        if len(self.rows) == 0:
+            return 0
+        return round(float(np.mean(self.rows["sendorder"] -
+                                   self.rows["sstartorder"])))
+
+    def to_hits(self) -> list[tblastnhit]:
+        """
+        materialise rows as tblastnhit objects for the clustering functions
+        """
+        cols = [self.rows[c].tolist() for c in outfmt_cols]
+        cols[0] = [self.queries[i] for i in cols[0]]
+        cols[1] = [self.subjects[i] for i in cols[1]]
+        return [tblastnhit(input=list(x)) for x in zip(*cols)]
+
+
+def _intern(names, lookup: dict, table: list[str]):
+    """
+    map an array of byte-string names to integer codes, adding unseen names
+    to table
+    """
+    uniq, inv = np.unique(names, return_inverse=True)
+    codes = np.empty(len(uniq), np.int32)
+    for i, n in enumerate(uniq.tolist()):
+        try:
+            codes[i] = lookup[n]
+        except KeyError:
+            lookup[n] = codes[i] = len(table)
+            table.append(n.decode())
+    return codes[inv.reshape(-1)]
+
+
+def parse_tblastn(outf: str, e=1e-5, bitscore=30,
+                  chunk=1000000) -> hit_table:
+    """
+    parse tblastn outfmt 6/7 into a hit_table. Rows are converted with
+    numpy's C parser and filtered chunk rows at a time, so the unfiltered
+    hits are never all held at once
+    """
+    sys.stderr.write("Parsing tblastn hits\n\n")
+    qlookup = {}
+    slookup = {}
+    queries = []
+    subjects = []
+    parts = []
+
+    def convert(lines: list[bytes]):
+        blob = b"".join(lines)
+        nums = np.loadtxt(io.BytesIO(blob), dtype=np.float64, delimiter="\t",
+                          usecols=range(2, 12), ndmin=2)
+        keep = (nums[:, 8] < e) & (nums[:, 9] > bitscore)
+        nums = nums[keep]
+        names = np.loadtxt(io.BytesIO(blob), dtype=bytes, delimiter="\t",
+                           usecols=(0, 1), ndmin=2)[keep]
+        rows = np.empty(len(nums), hit_dtype)
+        for i, c in enumerate(outfmt_cols[2:]):
+            rows[c] = nums[:, i]
+        rows["query"] = _intern(names[:, 0], qlookup, queries)
+        rows["subject"] = _intern(names[:, 1], slookup, subjects)
+        rows["sstartorder"] = np.minimum(rows["sstart"], rows["send"])
+        rows["sendorder"] = np.maximum(rows["sstart"], rows["send"])
+        parts.append(rows)
+
+    with open(outf, "rb") as raw:
+        lines = []
+        for line in raw:
+            if line.startswith(b"#") or not line.strip():
+                continue
+            lines.append(line)
+            if len(lines) == chunk:
+                convert(lines)
+                lines = []
+        if lines:
+            convert(lines)
+    rows = np.concatenate(parts) if parts else np.empty(0, hit_dtype)
+    return hit_table(rows, queries, subjects)
@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import threading
+import contextlib
+import contextvars
+import subprocess
+
+
+_active = None  # the tracer started by start(), if any
+_range = contextvars.ContextVar("range", default=None)
+
+
+class tracer():
+    """
+    collects timed events: pipeline stages, per-range work and every child
+    process, with its CPU time, max RSS and the sizes of the files it read
+    and wrote
+    """
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+        self._tids = {}
+
+    def now(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def add(self, name: str, cat: str, start: float, end: float, **args):
+        with self._lock:
+            tid = self._tids.setdefault(threading.get_ident(),
+                                        len(self._tids) + 1)
+            self.events.append({"name": name, "cat": cat,
+                                "start": round(start, 6),
+                                "dur": round(end - start, 6), "tid": tid,
+                                "args": args})
+
+    def write(self, path: str):
+        """
+        write events as JSON lines, or as a Chrome trace (chrome://tracing,
+        Perfetto) if path ends in .json
+        """
+        with open(path, "w", encoding="utf-8") as outf:
+            if path.endswith(".json"):
+                json.dump({"traceEvents": [
+                    {"name": e["name"], "cat": e["cat"], "ph": "X",
+                     "ts": round(e["start"] * 1e6),
+                     "dur": round(e["dur"] * 1e6), "pid": os.getpid(),
+                     "tid": e["tid"], "args": e["args"]}
+                    for e in self.events]}, outf)
+            else:
+                for e in self.events:
+                    outf.write(json.dumps(e) + "\n")
+
+    def summary(self, slowest=5) -> str:
+        """
+        table of total wall time per stage and per tool, with the CPU time,
+        peak RSS and bytes moved by child processes, followed by the slowest
+        ranges
+        """
+        rows = {}
+        for e in self.events:
+            if e["cat"] == "range":
+                continue
+            row = rows.setdefault((e["cat"], e["name"]),
+                                  [0, 0.0, 0.0, 0.0, 0, 0])
+            row[0] += 1
+            row[1] += e["dur"]
+            row[2] += e["args"].get("cpu", 0.0)
+            row[3] = max(row[3], e["args"].get("maxrss_mb", 0.0))
+            row[4] += sum(e["args"].get("read", {}).values())
+            row[5] += sum(e["args"].get("written", {}).values())
+        out = ["%-8s %-16s %6s %10s %10s %10s %10s %10s"
+               % ("kind", "name", "n", "wall_s", "cpu_s", "maxrss_mb",
+                  "read_mb", "write_mb")]
+        for (cat, name), row in rows.items():
+            out.append("%-8s %-16s %6d %10.2f %10.2f %10.1f %10.1f %10.1f"
+                       % (cat, name, row[0], row[1], row[2], row[3],
+                          row[4] / 2 ** 20, row[5] / 2 ** 20))
+        ranges = sorted((e for e in self.events if e["cat"] == "range"),
+                        key=lambda e: -e["dur"])
+        if ranges:
+            out.append("")
+            out.append("slowest of %d ranges:" % len(ranges))
+            for e in ranges[:slowest]:
+                out.append("  %-40s %10.2f" % (e["name"], e["dur"]))
+        out.append("")
+        out.append("total %.2f s, peppercorn maxrss %.1f MB"
+                   % (self.now(), resource.getrusage(
+                       resource.RUSAGE_SELF).ru_maxrss / 1024))
+        return "\n".join(out) + "\n"
+
+
+def start() -> tracer:
+    global _active
+    _active = tracer()
+    return _active
+
+
+def finish(path=None, summary=True):
+    """
+    stop tracing, writing the trace to path and the summary table to stderr
+    """
+    global _active
+    t = _active
+    _active = None
+    if t is None:
+        return
+    if path is not None:
+        t.write(path)
+    if summary:
+        sys.stderr.write("\n" + t.summary())
+
+
+@contextlib.contextmanager
+def span(name: str, cat="stage", **args):
+    """
+    time the enclosed block as a stage. Ranges (cat="range") also label
+    every event recorded inside them, including child processes
+    """
+    if _active is None:
+        yield
+        return
+    token = _range.set(name) if cat == "range" else None
+    start = _active.now()
+    try:
+        yield
+    finally:
+        if token is not None:
+            _range.reset(token)
+        elif _range.get() is not None:
+            args["range"] = _range.get()
+        _active.add(name, cat, start, _active.now(), **args)
+
+
+def now():
+    """
+    seconds since tracing started, or None when not tracing
+    """
+    return _active.now() if _active is not None else None
+
+
+def bind(fn):
+    """
+    carry the calling thread's range label into fn when it is run on a pool
+    thread
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args: ctx.copy().run(fn, *args)
+
+
+def sizes(paths) -> dict[str, int]:
+    out = {}
+    for p in paths:
+        try:
+            out[p] = os.path.getsize(p)
+        except OSError:
+            pass
+    return out
+
+
+def wait(p: subprocess.Popen, inputs=(), outputs=(), start=None) -> int:
+    """
+    wait for p with wait4 so its CPU time and max RSS can be recorded, then
+    set and return its returncode
+    """
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    process(p.args, p.returncode, start, usage, inputs, outputs)
+    return p.returncode
+
+
+def process(cmd: list[str], returncode: int, start=None, usage=None,
+            inputs=(), outputs=()):
+    """
+    record a finished child process, with its CPU time and max RSS if its
+    rusage is known
+    """
+    if _active is None:
+        return
+    args = {"cmd": subprocess.list2cmdline(cmd), "returncode": returncode,
+            "read": sizes(inputs), "written": sizes(outputs)}
+    if usage is not None:
+        args["cpu"] = round(usage.ru_utime + usage.ru_stime, 3)
+        args["maxrss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    if _range.get() is not None:
+        args["range"] = _range.get()
+    _active.add(os.path.basename(cmd[0]), "process",
+                start if start is not None else _active.now(),
+                _active.now(), **args)
+
+
+def run(cmd: list[str], stdout=None, stderr=None, capture_output=False,
+        text=False, check=False, inputs=(), outputs=()
+        ) -> subprocess.CompletedProcess:
+    """
+    subprocess.run, recording the child with wait(). Piped output is spooled
+    through temporary files rather than pipes, so the child can be reaped
+    with wait4 without risk of it blocking on a full pipe
+    """
+    if capture_output:
+        stdout = stderr = subprocess.PIPE
+    with tempfile.TemporaryFile() as outf, tempfile.TemporaryFile() as errf:
+        start = now()
+        p = subprocess.Popen(cmd, shell=False,
+                             stdout=outf if stdout == subprocess.PIPE
+                             else stdout,
+                             stderr=errf if stderr == subprocess.PIPE
+                             else stderr)
+        wait(p, inputs, outputs, start)
+        res = []
+        for f, dest in [(outf, stdout), (errf, stderr)]:
+            if dest != subprocess.PIPE:
+                res.append(None)
+                continue
+            f.seek(0)
+            res.append(f.read().decode() if text else f.read())
+    if check and p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd, res[0], res[1])
+    return subprocess.CompletedProcess(cmd, p.returncode, res[0], res[1])
@@ -0,0 +1,451 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import math
+import shutil
+import argparse
+import threading
+import concurrent.futures
+import utils
+from utils import tblastnhit
+
+try:
+    import numpy as np
+except ImportError:  # required, --finder kmer is unavailable without it
+    np = None
+
+
+# residues in k-mer code order; stops, X and segment separators end seeds
+aa_alphabet = "ARNDCQEGHILKMFPSTWYV"
+STOP = 20
+UNKNOWN = 21
+SEPARATOR = 22
+# standard genetic code, codons ordered TTT, TTC, TTA, TTG, TCT ...
+genetic_code = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+blosum62 = """
+ 4 -1 -2 -2  0 -1 -1  0 -2 -1 -1 -1 -1 -2 -1  1  0 -3 -2  0
+-1  5  0 -2 -3  1  0 -2  0 -3 -2  2 -1 -3 -2 -1 -1 -3 -2 -3
+-2  0  6  1 -3  0  0  0  1 -3 -3  0 -2 -3 -2  1  0 -4 -2 -3
+-2 -2  1  6 -3  0  2 -1 -1 -3 -4 -1 -3 -3 -1  0 -1 -4 -3 -3
+ 0 -3 -3 -3  9 -3 -4 -3 -3 -1 -1 -3 -1 -2 -3 -1 -1 -2 -2 -1
+-1  1  0  0 -3  5  2 -2  0 -3 -2  1  0 -3 -1  0 -1 -2 -1 -2
+-1  0  0  2 -4  2  5 -2  0 -3 -3  1 -2 -3 -1  0 -1 -3 -2 -2
+ 0 -2  0 -1 -3 -2 -2  6 -2 -4 -4 -2 -3 -3 -2  0 -2 -2 -3 -3
+-2  0  1 -1 -3  0  0 -2  8 -3 -3 -1 -2 -1 -2 -1 -2 -2  2 -3
+-1 -3 -3 -3 -1 -3 -3 -4 -3  4  2 -3  1  0 -3 -2 -1 -3 -1  3
+-1 -2 -3 -4 -1 -2 -3 -4 -3  2  4 -2  2  0 -3 -2 -1 -2 -1  1
+-1  2  0 -1 -3  1  1 -2 -1 -3 -2  5 -1 -3 -1  0 -1 -3 -2 -2
+-1 -1 -2 -3 -1  0 -2 -3 -2  1  2 -1  5  0 -2 -1 -1 -1 -1  1
+-2 -3 -3 -3 -2 -3 -3 -3 -1  0  0 -3  0  6 -4 -2 -2  1  3 -1
+-1 -2 -2 -1 -3 -1 -1 -2 -2 -3 -3 -1 -2 -4  7 -1 -1 -4 -3 -2
+ 1 -1  1  0 -1  0  0  0 -1 -2 -2  0 -1 -2 -1  4  1 -3 -2 -2
+ 0 -1  0 -1 -1 -1 -1 -2 -2 -1 -1 -1 -1 -2 -1  1  5 -2 -2  0
+-3 -3 -4 -4 -2 -2 -3 -2 -2 -3 -2 -3 -1  1 -4 -3 -2 11  2 -3
+-2 -2 -2 -3 -2 -1 -2 -3  2 -1 -1 -2 -1  3 -3 -2 -2  2  7 -1
+ 0 -3 -3 -3 -1 -2 -2 -3 -3  3  1 -2  1 -1 -2 -2  0 -3 -1  4
+"""
+# Karlin-Altschul parameters of ungapped BLOSUM62
+LAMBDA = 0.3176
+K = 0.134
+MAX_K = 7  # k-mer codes are uint32, and 20 ** 8 overflows them
+CHUNK = 1 << 24  # k-mers sorted at once while building an index
+
+if np is not None:
+    nt_code = np.full(256, 4, np.uint8)
+    for i, b in enumerate(b"TCAG"):
+        nt_code[b] = nt_code[b + 32] = i
+    nt_complement = np.array([2, 3, 0, 1, 4], np.uint8)
+    codon_aa = np.full(65, UNKNOWN, np.uint8)  # 64: codon with an N
+    for i, aa in enumerate(genetic_code):
+        codon_aa[i] = STOP if aa == "*" else aa_alphabet.index(aa)
+    aa_code = np.full(256, UNKNOWN, np.uint8)
+    for i, aa in enumerate(aa_alphabet):
+        aa_code[ord(aa)] = aa_code[ord(aa.lower())] = i
+    aa_code[ord("*")] = STOP
+    scores = np.full((23, 23), -1, np.int32)
+    scores[:20, :20] = np.array(blosum62.split(), np.int32).reshape(20, 20)
+    scores[STOP, :] = scores[:, STOP] = -4
+    scores[SEPARATOR, :] = scores[:, SEPARATOR] = -1000
+
+
+def translate_frames(seq: bytes) -> list:
+    """
+    the six-frame translation of seq as arrays of residue codes: frames 0-2
+    read the forward strand from offsets 0-2, frames 3-5 the reverse
+    complement
+    """
+    nt = nt_code[np.frombuffer(seq, np.uint8)]
+    out = []
+    for strand in (nt, nt_complement[nt][::-1]):
+        for f in range(3):
+            n = (len(strand) - f) // 3
+            codons = strand[f:f + 3 * n].reshape(n, 3).astype(np.int16)
+            idx = codons[:, 0] * 16 + codons[:, 1] * 4 + codons[:, 2]
+            idx[(codons == 4).any(axis=1)] = 64
+            out.append(codon_aa[idx])
+    return out
+
+
+def kmer_codes(aa, k: int):
+    """
+    the code of the k-mer starting at each position of aa, and whether it is
+    made of standard residues only
+    """
+    n = max(0, len(aa) - k + 1)
+    codes = np.zeros(n, np.uint32)
+    valid = np.ones(n, bool)
+    for i in range(k):
+        part = aa[i:i + n]
+        valid &= part < 20
+        codes = codes * np.uint32(20) + np.minimum(part, 19).astype(np.uint32)
+    return codes, valid
+
+
+class seed_index():
+    """
+    every k-mer of a genome's six-frame translation. The translations are
+    concatenated, with separators, into self.trans; self.keys holds the
+    sorted k-mer codes and self.pos where each occurs in self.trans. Each
+    segment of self.trans is one frame of one contig. The arrays are .npy
+    files in one directory, memory-mapped so processes share their pages
+    """
+    arrays = ["meta", "keys", "pos", "trans", "seg_start", "seg_frame",
+              "seg_contig", "names", "lengths"]
+
+    def __init__(self, arrays: dict):
+        self.k = int(arrays["meta"][0])
+        self.meta = arrays["meta"]
+        self.keys = arrays["keys"]
+        self.pos = arrays["pos"]
+        self.trans = arrays["trans"]
+        self.seg_start = arrays["seg_start"]
+        self.seg_frame = arrays["seg_frame"]
+        self.seg_contig = arrays["seg_contig"]
+        self.names = [str(x) for x in arrays["names"]]
+        self.lengths = arrays["lengths"]
+        self.space = int(self.meta[3])
+
+    @classmethod
+    def open(cls, path: str):
+        return cls({name: np.load(os.path.join(path, name + ".npy"),
+                                  mmap_mode="r") for name in cls.arrays})
+
+    @classmethod
+    def build(cls, genome: str, path: str, k=5, chunk=CHUNK):
+        """
+        build the index of genome into the directory path. Contigs are
+        translated one at a time straight into the mapped translation, and
+        k-mers sorted chunk by chunk then merged a range of codes at a time,
+        so memory is bounded by the largest contig and chunk, not the genome
+        """
+        sys.stderr.write("Building %d-mer seed index of %s\n\n" % (k, genome))
+        st = os.stat(genome)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        def create(name, dtype, n):
+            return np.lib.format.open_memmap(os.path.join(tmp, name + ".npy"),
+                                             mode="w+", dtype=dtype,
+                                             shape=(n,))
+
+        names = []
+        lengths = []
+        for name, seq in utils.parse_fasta(genome, binary=True,
+                                           use_mmap=True):
+            names.append(name.split()[0].decode())
+            lengths.append(len(seq))
+        total = sum(2 * sum((n - f) // 3 for f in range(3)) + 6
+                    for n in lengths)
+        trans = create("trans", np.uint8, total)
+        seg_start = []
+        seg_frame = []
+        seg_contig = []
+        at = 0
+        for c, (_, seq) in enumerate(utils.parse_fasta(genome, binary=True,
+                                                       use_mmap=True)):
+            for f, frame in enumerate(translate_frames(seq)):
+                seg_start.append(at)
+                seg_frame.append(f)
+                seg_contig.append(c)
+                trans[at:at + len(frame)] = frame
+                trans[at + len(frame)] = SEPARATOR
+                at += len(frame) + 1
+        space = int(sum(int((trans[i:i + chunk] < SEPARATOR).sum())
+                        for i in range(0, total, chunk)))
+
+        # sorted runs of at most chunk k-mers, and how many k-mers start
+        # with each prefix of up to three residues
+        div = 20 ** max(0, k - 3)
+        counts = np.zeros(20 ** min(k, 3), np.int64)
+        runs = []
+        for s in range(0, max(0, total - k + 1), chunk):
+            e = min(s + chunk, total - k + 1)
+            codes, valid = kmer_codes(trans[s:e + k - 1], k)
+            pos = np.flatnonzero(valid).astype(np.int64) + s
+            codes = codes[valid]
+            order = np.argsort(codes, kind="stable")
+            run = os.path.join(tmp, "run%d" % len(runs))
+            np.save(run + ".keys.npy", codes[order])
+            np.save(run + ".pos.npy", pos[order])
+            runs.append(run)
+            counts += np.bincount(codes // div, minlength=len(counts))
+
+        # merge the runs a range of prefixes (about a chunk of k-mers) at a
+        # time; runs are in position order, so a stable sort keeps each
+        # code's positions ascending
+        keys = create("keys", np.uint32, int(counts.sum()))
+        pos = create("pos", np.int64, int(counts.sum()))
+        runs = [(np.load(r + ".keys.npy", mmap_mode="r"),
+                 np.load(r + ".pos.npy", mmap_mode="r")) for r in runs]
+        bounds = [0]
+        size = 0
+        for p, n in enumerate(counts.tolist()):
+            if size and size + n > chunk:
+                bounds.append(p)
+                size = 0
+            size += n
+        bounds.append(len(counts))
+        at = 0
+        for lo, hi in zip(bounds, bounds[1:]):
+            lo *= div
+            hi *= div
+            parts = []
+            for rk, rp in runs:
+                a, b = np.searchsorted(rk, [lo, hi])
+                parts.append((rk[a:b], rp[a:b]))
+            if not parts:
+                continue
+            group_keys = np.concatenate([x for x, _ in parts])
+            order = np.argsort(group_keys, kind="stable")
+            keys[at:at + len(order)] = group_keys[order]
+            pos[at:at + len(order)] = np.concatenate([x for _, x in
+                                                      parts])[order]
+            at += len(order)
+        keys.flush()
+        pos.flush()
+        trans.flush()
+        del runs, keys, pos, trans
+        for f in os.listdir(tmp):
+            if f.startswith("run"):
+                os.remove(os.path.join(tmp, f))
+
+        small = {"meta": np.array([k, st.st_size, st.st_mtime_ns, space],
+                                  np.int64),
+                 "seg_start": np.array(seg_start, np.int64),
+                 "seg_frame": np.array(seg_frame, np.int8),
+                 "seg_contig": np.array(seg_contig, np.int32),
+                 "names": np.array(names, dtype=str),
+                 "lengths": np.array(lengths, np.int64)}
+        for name, a in small.items():
+            np.save(os.path.join(tmp, name + ".npy"), a)
+        shutil.rmtree(path, ignore_errors=True)  # built from an older genome
+        try:
+            os.replace(tmp, path)
+        except OSError:  # another process finished it first
+            shutil.rmtree(tmp, ignore_errors=True)
+        return cls.open(path)
+
+    def seeds(self, aa, max_occ=1000):
+        """
+        (query position, translation position) of every k-mer aa shares with
+        the genome, leaving out k-mers occurring more than max_occ times
+        """
+        codes, valid = kmer_codes(aa, self.k)
+        qpos = np.flatnonzero(valid)
+        lo = np.searchsorted(self.keys, codes[qpos], "left")
+        hi = np.searchsorted(self.keys, codes[qpos], "right")
+        counts = hi - lo
+        counts[counts > max_occ] = 0  # repeats, or low complexity
+        total = int(counts.sum())
+        first = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+        tpos = self.pos[first + np.arange(total)]
+        return np.repeat(qpos, counts), tpos
+
+    def extend(self, aa, d: int, q0: int, q1: int, xdrop=20):
+        """
+        extend the ungapped alignment of aa[q0:q1 + 1] on diagonal d (aa
+        position q against translation position q + d) in both directions
+        while its score stays within xdrop of the best, returning the new
+        q0, q1 and the score. q0 and q1 may come from seeds on nearby
+        diagonals, so they are first clamped to where d meets the
+        translation
+        """
+        def best_run(s):
+            if len(s) == 0:
+                return 0, 0
+            run = np.cumsum(s)
+            peak = np.maximum.accumulate(run)
+            drop = np.flatnonzero(peak - run > xdrop)
+            if len(drop):
+                run = run[:drop[0]]
+            if len(run) == 0 or run.max() <= 0:
+                return 0, 0
+            i = int(run.argmax())
+            return i + 1, int(run[i])
+
+        q0 = max(q0, -d)
+        q1 = min(q1, len(self.trans) - d - 1)
+        if q0 > q1:
+            return q0, q1, 0
+        core = scores[aa[q0:q1 + 1], self.trans[q0 + d:q1 + d + 1]]
+        right_end = min(len(aa), len(self.trans) - d)
+        right, rscore = best_run(scores[aa[q1 + 1:right_end],
+                                        self.trans[q1 + 1 + d:right_end + d]])
+        left_end = max(0, -d)
+        left, lscore = best_run(scores[aa[left_end:q0][::-1],
+                                       self.trans[left_end + d:q0 + d][::-1]])
+        return q0 - left, q1 + right, int(core.sum()) + rscore + lscore
+
+    def coords(self, t0: int, t1: int) -> tuple[str, int, int]:
+        """
+        contig, sstart and send (1-based, reversed on the minus strand as
+        tblastn reports them) of translation positions t0 to t1
+        """
+        seg = int(np.searchsorted(self.seg_start, t0, "right")) - 1
+        a0 = t0 - int(self.seg_start[seg])
+        a1 = t1 - int(self.seg_start[seg])
+        frame = int(self.seg_frame[seg])
+        contig = int(self.seg_contig[seg])
+        if frame < 3:
+            return self.names[contig], frame + 3 * a0 + 1, frame + 3 * a1 + 3
+        length = int(self.lengths[contig])
+        frame -= 3
+        return (self.names[contig], length - frame - 3 * a0,
+                length - frame - 3 * a1 - 2)
+
+    def search(self, query: str, seq: str, band=5, gap=10, min_seeds=2,
+               e=1e-5, bitscore=30) -> list[tblastnhit]:
+        """
+        find seq in the genome: seeds are chained along nearby diagonals
+        (shifted by at most band, for small indels) with at most gap
+        residues between them, chains of at least min_seeds are extended
+        ungapped on their best diagonal and scored with BLOSUM62, and those
+        passing the e-value and bitscore cutoffs of parse_tblastn are
+        returned as tblastn would report them
+        """
+        aa = aa_code[np.frombuffer(seq.encode(), np.uint8)]
+        qpos, tpos = self.seeds(aa)
+        if len(qpos) == 0:
+            return []
+        diag = tpos - qpos
+        order = np.lexsort((tpos, diag))
+        chains = []
+        current = None
+        for d, q, t in zip(diag[order].tolist(), qpos[order].tolist(),
+                           tpos[order].tolist()):
+            if current is not None and d - current["last"] <= band and \
+                    current["t0"] - gap <= t <= current["t1"] + gap:
+                current["q0"] = min(current["q0"], q)
+                current["q1"] = max(current["q1"], q + self.k - 1)
+                current["t0"] = min(current["t0"], t)
+                current["t1"] = max(current["t1"], t + self.k - 1)
+                current["diags"][d] = current["diags"].get(d, 0) + 1
+                current["last"] = d
+                continue
+            current = {"q0": q, "q1": q + self.k - 1, "t0": t,
+                       "t1": t + self.k - 1, "diags": {d: 1}, "last": d}
+            chains.append(current)
+        out = []
+        seen = set()  # chains extended into the same alignment
+        for c in chains:
+            if sum(c["diags"].values()) < min_seeds:
+                continue
+            d = max(c["diags"], key=c["diags"].get)
+            q0, q1, score = self.extend(aa, d, c["q0"], c["q1"])
+            if (d, q0, q1) in seen:
+                continue
+            seen.add((d, q0, q1))
+            bits = (LAMBDA * score - math.log(K)) / math.log(2)
+            evalue = len(aa) * self.space * 2 ** -bits
+            if evalue >= e or bits <= bitscore:
+                continue
+            span = q1 - q0 + 1
+            ident = int((aa[q0:q1 + 1] ==
+                         self.trans[q0 + d:q1 + d + 1]).sum())
+            subject, sstart, send = self.coords(q0 + d, q1 + d)
+            out.append(tblastnhit([query, subject,
+                                   round(100 * ident / span, 3), span,
+                                   span - ident, 0,  # ungapped
+                                   q0 + 1, q1 + 1, sstart, send,
+                                   float("%.2g" % evalue), round(bits, 1)]))
+        return out
+
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def load_index(genome: str, k=5) -> seed_index:
+    """
+    the seed index of genome, mapped from the directory genome.kmer<k> if it
+    was built from the genome as it is now and (re)built otherwise. Indexes
+    are kept open per process
+    """
+    if np is None:
+        raise ImportError("the k-mer finder requires numpy")
+    if not 1 <= k <= MAX_K:
+        raise ValueError("k-mer size must be between 1 and %d" % MAX_K)
+    path = "%s.kmer%d" % (genome, k)
+    st = os.stat(genome)
+    meta = [k, st.st_size, st.st_mtime_ns]
+    with _index_lock:
+        cached = _index_cache.get((genome, k))
+        if cached is not None and cached.meta[:3].tolist() == meta:
+            return cached
+        index = None
+        try:
+            if np.load(os.path.join(path, "meta.npy"))[:3].tolist() == meta:
+                index = seed_index.open(path)
+        except (OSError, ValueError):  # missing, or from an older version
+            pass
+        if index is None:
+            index = seed_index.build(genome, path, k)
+        _index_cache[(genome, k)] = index
+    return index
+
+
+def stream_kmer(queryf: str, genome: str, k=5, threads=1, e=1e-5,
+                bitscore=30):
+    """
+    as tblastn.stream_tblastn, searching the seed index instead: yields
+    (query, hits) for every query in file order, so tblastn.group_batches
+    and the rest of the pipeline take either
+    """
+    sys.stderr.write("Seeding matches to quer(y/ies)\n\n")
+    index = load_index(genome, k)
+    records = [(name.split()[0], seq)
+               for name, seq in utils.parse_fasta(queryf)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        found = pool.map(lambda rec: index.search(rec[0], rec[1], e=e,
+                                                  bitscore=bitscore),
+                         records)
+        for (query, _), hits in zip(records, found):
+            yield query, hits
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Find protein queries in a \
+                                     genome through a six-frame k-mer seed \
+                                     index, writing tblastn-style tabular \
+                                     hits to stdout")
+    parser.add_argument("genome", help="FASTA-formatted genomic contigs")
+    parser.add_argument("queries", help="FASTA-formatted protein queries")
+    parser.add_argument("-k", "--kmer-size", help="Seed length in residues \
+                        (1-%d) [5]" % MAX_K, type=int, default=5,
+                        choices=range(1, MAX_K + 1), metavar="K")
+    parser.add_argument("-t", "--threads", help="Number of threads [1]",
+                        type=int, default=1)
+    args = parser.parse_args()
+
+    for _, hits in stream_kmer(args.queries, args.genome, args.kmer_size,
+                               args.threads):
+        for h in hits:
+            sys.stdout.write("\t".join(str(x) for x in [
+                h.query, h.subject, h.id, h.len, h.mm, h.gapopens, h.qstart,
+                h.qend, h.sstart, h.send, h.evalue, h.bitscore]) + "\n")
@@ -3,47 +3,430 @@
 
 import os
 import sys
+import json
 import utils
 import argparse
+import concurrent.futures
+import cache
 import tblastn
+import hittable
 import subseq
 import exonerate
 import augustus
+import instrument
+import checkpoint
+import scheduler
+import kmerseed
+import hitstore
 
 
-def split_query(queryf, queries=None):
-    queryseqs = dict([x for x in utils.parse_fasta(queryf)])
-    if queries is not None:
-        if len(queries) > 1:
-            with open("multiquery.pep.fa", "w") as outf:
-                for k, v in queryseqs.items():
-                    if k in queries:
-                        outf.write(">%s\n" % k)
-                        outf.write("%s\n" % v)
-            return "multiquery.pep.fa"
+def exonerate_range(r: utils.genome_range, queries: utils.query_store,
+                    cache=None, chunks=1, progress=None):
+    """
+    align a range's queries to it with exonerate, returning the hints file,
+    or None (after cleaning up) if nothing aligned. A range the run manifest
+    progress has already seen through exonerate is not aligned again
+    """
+    done = checkpoint.finished_step(progress, r, "exonerate")
+    if done is not None:
+        return done["hints"]
+    qf = queries.subset(r.queries)
+    out, hintsf, res = exonerate.run_exonerate(r.file, qf, cache=cache,
+                                               chunks=chunks)
+    return exonerate.finish_range(r, hintsf, res, progress)
+
+
+def exonerate_range_traced(r: utils.genome_range, queries: utils.query_store,
+                           cache=None, chunks=1, progress=None):
+    with instrument.span(r.seqid, cat="range"):
+        with instrument.span("exonerate"):
+            return exonerate_range(r, queries, cache, chunks, progress)
+
+
+def classify(r: utils.genome_range, auggenes: list[augustus.AugustusRes]):
+    """
+    name a range's predictions after it and split them into (supported,
+    unsupported) by hint support
+    """
+    goodres = []
+    badres = []
+    for a in auggenes:
+        a.gene = "%s_%s_%s_%s" % (r.subject,
+                                  r.start, r.end,
+                                  a.gene)
+        if a.percent_support > 0:
+            goodres.append(a)
         else:
-            with open(queries[0] + ".pep.fa", "w") as outf:
-                for k, v in queryseqs.items():
-                    if k in queries:
-                        outf.write(">%s\n" % k)
-                        outf.write("%s\n" % v)
-            return queries[0] + ".pep.fa"
+            badres.append(a)
+    return goodres, badres
+
+
+def process_range(r: utils.genome_range, queries: utils.query_store,
+                  species="arabidopsis", cache=None, chunks=1, progress=None):
+    """
+    run exonerate and augustus over a single extracted range, returning
+    (supported, unsupported) predictions. Safe to run concurrently, as all
+    intermediate files are named after the range
+    """
+    with instrument.span(r.seqid, cat="range"):
+        with instrument.span("exonerate"):
+            hintsf = exonerate_range(r, queries, cache, chunks, progress)
+        if hintsf is None:
+            return [], []
+        with instrument.span("augustus"):
+            done = checkpoint.finished_step(progress, r, "augustus")
+            if done is not None:
+                augout = done["out"]
+            else:
+                augout = augustus.run_augustus(r.file, hintsf, species,
+                                               cache=cache)
+                augustus.finish_range(r, augout, progress)
+            auggenes = augustus.parse_augustus(augout)
+        return classify(r, auggenes)
+
+
+def range_workers(threads: int, chunks=1) -> int:
+    """
+    how many ranges to run at once for at most threads processes at a time,
+    each range's exonerate being split over chunks of them
+    """
+    return max(1, threads // max(1, chunks))
+
+
+def process_ranges(ranges: list[utils.genome_range],
+                   queries: utils.query_store, species="arabidopsis",
+                   threads=1, cache=None, outdir="", batch_augustus=False,
+                   chunks=1, progress=None, finished=None):
+    """
+    run process_range over all ranges with a pool of workers. Results
+    are gathered in the order of ranges so output is reproducible, and a
+    failure in one range is reported without stopping the others.
+
+    With batch_augustus, all ranges are aligned first and augustus is then
+    run once per worker over all hinted windows (see augustus.run_augustus_batch).
+    chunks > 1 splits each range's exonerate run over that many processes,
+    and the pool shrinks to match (see range_workers). Finished steps are
+    recorded in, and skipped if already in, the run manifest progress (a
+    checkpoint.run_manifest). Ranges processed without error are appended
+    to finished, if given
+    """
+    if batch_augustus:
+        return process_ranges_batched(ranges, queries, species, threads,
+                                      cache, outdir, chunks, progress,
+                                      finished)
+    goodres = []
+    badres = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=range_workers(threads, chunks)) as pool:
+        futures = [pool.submit(process_range, r, queries, species, cache,
+                               chunks, progress)
+                   for r in ranges]
+        for r, f in zip(ranges, futures):
+            try:
+                good, bad = f.result()
+            except Exception as e:
+                sys.stderr.write("Failed to process %s: %s, discarding\n"
+                                 % (r.file, e))
+                continue
+            if finished is not None:
+                finished.append(r)
+            goodres += good
+            badres += bad
+    return goodres, badres
+
+
+def process_ranges_batched(ranges: list[utils.genome_range],
+                           queries: utils.query_store, species="arabidopsis",
+                           threads=1, cache=None, outdir="", chunks=1,
+                           progress=None, finished=None):
+    hinted = []
+    hintsfs = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=range_workers(threads, chunks)) as pool:
+        futures = [pool.submit(exonerate_range_traced, r, queries, cache,
+                               chunks, progress)
+                   for r in ranges]
+        for r, f in zip(ranges, futures):
+            try:
+                hintsf = f.result()
+            except Exception as e:
+                sys.stderr.write("Failed to process %s: %s, discarding\n"
+                                 % (r.file, e))
+                continue
+            if hintsf is not None:
+                hinted.append(r)
+                hintsfs.append(hintsf)
+            elif finished is not None:
+                finished.append(r)
+    with instrument.span("augustus"):
+        by_seq, failed = augustus.run_augustus_batch([r.file for r in hinted],
+                                                     hintsfs, species,
+                                                     shards=threads,
+                                                     cache=cache,
+                                                     prefix=os.path.join(outdir,
+                                                                         "augustus_batch"))
+    goodres = []
+    badres = []
+    for r in hinted:
+        if r.file in failed:
+            sys.stderr.write("Failed to process %s: %s, discarding\n"
+                             % (r.file, failed[r.file]))
+            continue
+        good, bad = classify(r, by_seq.get(r.seqid, []))
+        if finished is not None:
+            finished.append(r)
+        goodres += good
+        badres += bad
+    return goodres, badres
+
+
+def process_ranges_pipelined(ranges: list[utils.genome_range], genome: str,
+                             queries: utils.query_store,
+                             species="arabidopsis", threads=1, cache=None,
+                             outdir=None, chunks=1, progress=None,
+                             finished=None):
+    """
+    as process_ranges, but extracting windows as well, with each range's
+    exonerate starting as soon as its window is written and its augustus as
+    soon as its hints are, all sharing threads CPU slots (see scheduler)
+    """
+    goodres = []
+    badres = []
+    for r, auggenes in zip(ranges, scheduler.run_ranges(ranges, genome,
+                                                        queries, species,
+                                                        threads, cache,
+                                                        chunks, progress,
+                                                        outdir)):
+        if auggenes is not None and finished is not None:
+            finished.append(r)
+        if auggenes:
+            good, bad = classify(r, auggenes)
+            goodres += good
+            badres += bad
+    return goodres, badres
+
+
+def parse_hits(tblastn_out: str) -> tuple[list[utils.tblastnhit], int]:
+    """
+    parse and filter tblastn output, returning the hits and their mean
+    length on the subject
+    """
+    if hittable.np is not None:
+        hit_tab = hittable.parse_tblastn(tblastn_out)
+        return hit_tab.to_hits(), hit_tab.mean_hit_len()
+    tblastn_hits = tblastn.parse_tblastn(tblastn_out)
+    return tblastn_hits, mean_length(tblastn_hits)
+
+
+def mean_length(tblastn_hits: list[utils.tblastnhit]) -> int:
+    """
+    mean length of hits on the subject, used to pad ranges
+    """
+    hit_lens = [x.sendorder - x.sstartorder for x in tblastn_hits]
+    return round(sum(hit_lens) / len(hit_lens)) if hit_lens else 0
+
+
+def find_ranges(tblastn_hits: list[utils.tblastnhit], mean_hit_len: int,
+                intronlength=3000, stranded=False, qlens=None,
+                genome=None) -> list[utils.genome_range]:
+    """
+    join hits into candidate ranges and pad them for extraction. Given query
+    lengths qlens, each range is padded for the query residues its own hits
+    missed (see tblastn.window_pads), up to the fixed padding of
+    intronlength + mean_hit_len used otherwise. Ranges are clamped to the
+    contigs of genome, if given, and merged where padding makes them overlap
+    """
+    # unique_hits = tblastn.unique_hits(tblastn_hits)
+    clusters = tblastn.join_hits(tblastn_hits, intronlength, mean_hit_len,
+                                 stranded=stranded)
+    ranges = tblastn.hits_to_range(clusters)
+    if qlens is None:
+        tblastn.pad_range(ranges, length=intronlength + mean_hit_len)
     else:
-        with open(k + ".pep.fa", "w") as outf:
-            for k, v in queryseqs.items():
-                outf.write(">%s\n" % k)
-                outf.write("%s\n" % v)
+        members = tblastn.cluster_members(clusters, tblastn_hits, stranded)
+        tblastn.pad_adaptive(ranges, members, qlens,
+                             limit=intronlength + mean_hit_len)
+    if genome is not None:
+        tblastn.clamp_range(ranges, {name: e.length for name, e in
+                                     subseq.load_index(genome).items()})
+    ranges = tblastn.merge_range(ranges)
+    return ranges
 
 
-if __name__ == "__main__":
-    if len(sys.argv[1:]) == 0:
-        sys.argv.append("-h")
+def screen_queries(ranges: list[utils.genome_range],
+                   tblastn_hits: list[utils.tblastnhit],
+                   queries: utils.query_store, top=5, similarity=None):
+    """
+    cut each range's queries down to the top (all, if 0), ranked by the
+    bitscore and query coverage of their hits in the range, so exonerate
+    aligns only the best. With similarity, a query whose k-mer similarity
+    to a better ranked one reaches it is dropped first. Pruned queries are
+    logged
+    """
+    if top <= 0 and similarity is None:
+        return
+    qlens = queries.lengths()
+    for r, hits in zip(ranges, tblastn.range_members(ranges, tblastn_hits)):
+        ranked = [q for q in tblastn.rank_queries(hits, qlens)
+                  if q in r.queries]
+        ranked += [q for q in r.queries if q not in ranked]
+        keep = []
+        for q in ranked:
+            if similarity is not None and q in queries.seqs and \
+                    any(queries.similarity(q, x) >= similarity
+                        for x in keep if x in queries.seqs):
+                continue
+            keep.append(q)
+        if top > 0:
+            keep = keep[:top]
+        pruned = [q for q in ranked if q not in keep]
+        if pruned:
+            sys.stderr.write("Pruned %d queries from %s:%d-%d: %s\n\n"
+                             % (len(pruned), r.subject, r.start, r.end,
+                                " ".join(pruned)))
+        r.queries = keep
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("genome", help="FASTA-formatted genomic contigs to \
-                        annotate homologues")
-    parser.add_argument("queries", help="FASTA-formatted protein queries for \
-                        homology-based annotation")
+
+def search_params(args) -> str:
+    """
+    the settings a query's hits depend on, besides its sequence and the
+    genome, as the hit store records them
+    """
+    if args.finder == "kmer":
+        params = {"finder": "kmer", "k": args.kmer_size}
+    else:
+        params = {"finder": "tblastn",
+                  "version": utils.tool_version("tblastn"),
+                  "genome_shards": args.genome_shards}
+    params.update({"e": 1e-5, "bitscore": 30})
+    return json.dumps(params, sort_keys=True)
+
+
+def stored_hits(store: hitstore.hit_store, genome_key: str, genome: str,
+                queries: utils.query_store, args, results=None
+                ) -> tuple[list[utils.tblastnhit], int]:
+    """
+    hits of every query from the hit store, searching genome (whose digest
+    is genome_key) only for the queries the store has not seen with these
+    settings, and adding theirs
+    """
+    params = search_params(args)
+    missing = store.missing(genome_key, queries, params)
+    sys.stderr.write("%d of %d queries in the hit store\n\n"
+                     % (len(queries.seqs) - len(missing), len(queries.seqs)))
+    if missing:
+        queryf = queries.subset(missing)
+        if args.finder == "kmer":
+            with instrument.span("kmer_search"):
+                hits = [h for _, batch in
+                        kmerseed.stream_kmer(queryf, genome, args.kmer_size,
+                                             args.threads)
+                        for h in batch]
+        else:
+            with instrument.span("blastdb"):
+                tblastn.ensure_blastdb(genome)
+            with instrument.span("tblastn"):
+                tblastn_out = tblastn.run_tblastn(queryf, genome, args.threads,
+                                                  cache=results,
+                                                  shards=args.tblastn_shards,
+                                                  genome_shards=args.genome_shards)
+            with instrument.span("parse_hits"):
+                hits, _ = parse_hits(tblastn_out)
+        store.add(genome_key, queries, params, missing, hits)
+    hits = store.hits(genome_key, queries, params)
+    return hits, mean_length(hits)
+
+
+def stored_windows(store, genome_key: str, ranges: list[utils.genome_range],
+                   queries: utils.query_store, species="arabidopsis") -> dict:
+    """
+    predictions the hit store holds for named ranges whose window and
+    queries are unchanged, keyed by window sequence id
+    """
+    if store is None:
+        return {}
+    out = {}
+    for r in ranges:
+        done = store.window(genome_key, hitstore.window_key(r, queries,
+                                                            species))
+        if done is not None:
+            out[r.seqid] = done
+    if out:
+        sys.stderr.write("Reusing predictions for %d of %d unchanged windows\n\n"
+                         % (len(out), len(ranges)))
+    return out
+
+
+def store_windows(store, genome_key: str, ranges: list[utils.genome_range],
+                  stored: dict, finished: list[utils.genome_range],
+                  goodres: list, badres: list, queries: utils.query_store,
+                  species="arabidopsis") -> tuple[list, list]:
+    """
+    record the predictions of each finished range in the hit store, then
+    return them together with the stored ones, in the order of ranges
+    """
+    if store is None:
+        return goodres, badres
+    found = {}
+    for i, kind in enumerate((goodres, badres)):
+        for a in kind:
+            found.setdefault(a.seqname, ([], []))[i].append(a)
+    for r in finished:
+        good, bad = found.get(r.seqid, ([], []))
+        store.add_window(genome_key, hitstore.window_key(r, queries, species),
+                         good, bad)
+    goodres = []
+    badres = []
+    for r in ranges:
+        good, bad = stored.get(r.seqid) or found.get(r.seqid, ([], []))
+        goodres += good
+        badres += bad
+    return goodres, badres
+
+
+def resume_ranges(progress: checkpoint.run_manifest, name: str, genome: str,
+                  outdir=None, extract=True):
+    """
+    the ranges recorded by stage name of an earlier run, or None. Windows
+    still to be aligned whose files have gone are extracted again, unless
+    extract is False
+    """
+    done = progress.stage(name)
+    if done is None:
+        return None
+    ranges = checkpoint.ranges_from_json(done["ranges"])
+    missing = [r for r in ranges if not os.path.isfile(r.file) and
+               progress.step(r, "exonerate") is None]
+    if missing and extract:
+        subseq.write_subseq(genome, missing, outdir=outdir)
+    return ranges
+
+
+def write_predictions(results, fastaf: str, gtff: str):
+    """
+    write coding sequences and gtf for an iterable of AugustusRes in a single
+    pass, so predictions can be streamed from augustus.iter_augustus
+    """
+    with open(fastaf, "w") as outf, open(gtff, "w") as outg:
+        for r in results:
+            outf.write(r.write_fasta(coding=True))
+            for i in r.gff:
+                outg.write("\t".join(i) + "\n")
+
+
+def write_results(goodres, badres, outdir=""):
+    write_predictions(goodres,
+                      os.path.join(outdir, "final_supported_predictions.cds.fa"),
+                      os.path.join(outdir, "final_supported_predictions.gtf"))
+    write_predictions(badres,
+                      os.path.join(outdir, "final_unsupported_predictions.cds.fa"),
+                      os.path.join(outdir, "final_unsupported_predictions.gtf"))
+
+
+def add_run_args(parser: argparse.ArgumentParser):
+    """
+    options shared by every entry point that runs the pipeline
+    """
     parser.add_argument("-i", "--intronlength", help="Expected maximum intron \
                         length (if unsure, longer better) [3000]", type=int,
                         default=3000)
@@ -52,78 +435,240 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--species", help="Species model to use for \
                         Augustus. The more closely related, the better [arabidopsis]",
                         type=str, default="arabidopsis")
-    args = parser.parse_args()
+    parser.add_argument("--stranded", help="Only join hits on the same \
+                        strand of a contig into ranges", action="store_true")
+    parser.add_argument("--fixed-windows", help="Pad every range by \
+                        intronlength plus the mean hit length, instead of by \
+                        how much of each query its hits left uncovered",
+                        action="store_true")
+    parser.add_argument("--max-queries", help="Align at most this many \
+                        queries per range with exonerate, the best by \
+                        tblastn bitscore and coverage (0 for all) [5]",
+                        type=int, default=5)
+    parser.add_argument("--collapse-similar", help="Before taking the best \
+                        queries, drop those whose 3-mer Jaccard similarity \
+                        to a better one is at least this (0-1)", type=float,
+                        default=None)
+    parser.add_argument("--finder", help="Find candidate loci with tblastn, \
+                        or by seeding queries against a six-frame k-mer index \
+                        of the genome (kmer; faster for small, conserved \
+                        families, and needs no blast db) [tblastn]",
+                        choices=["tblastn", "kmer"], default="tblastn")
+    parser.add_argument("--kmer-size", help="Seed length in residues for \
+                        --finder kmer (1-%d) [5]" % kmerseed.MAX_K, type=int,
+                        default=5, choices=range(1, kmerseed.MAX_K + 1),
+                        metavar="K")
+    parser.add_argument("--tblastn-shards", help="Split the queries into \
+                        this many tblastn searches run concurrently [1]",
+                        type=int, default=1)
+    parser.add_argument("--genome-shards", help="Also split the genome into \
+                        this many contig groups, each with its own blast db \
+                        [1]", type=int, default=1)
+    parser.add_argument("--exonerate-chunks", help="Split each range's \
+                        queries over this many concurrent exonerate processes, \
+                        running --threads / this many ranges at once [1]",
+                        type=int, default=1)
+    parser.add_argument("--batch-augustus", help="Run augustus once per \
+                        thread over all windows instead of once per window",
+                        action="store_true")
+    parser.add_argument("--stream-tblastn", help="Read tblastn output \
+                        through a pipe, filtering hits as they arrive instead \
+                        of writing and re-reading the full table. Not cached \
+                        or resumed, and ignores the shard options",
+                        action="store_true")
+    parser.add_argument("--pipelined", help="Schedule window extraction, \
+                        exonerate and augustus per range as soon as each \
+                        one's input is ready, sharing --threads CPU slots \
+                        between all tool processes, rather than stage by \
+                        stage. Ignores --batch-augustus", action="store_true")
+    parser.add_argument("--hitstore", help="Keep hits and window predictions \
+                        in this SQLite file, so reruns search only new or \
+                        changed queries and rerun only windows whose \
+                        coordinates or queries changed", type=str,
+                        default=None)
+    parser.add_argument("--no-cache", help="Always rerun tblastn, exonerate \
+                        and augustus instead of reusing cached results",
+                        action="store_true")
+    parser.add_argument("--cachedir", help="Directory for cached tool \
+                        results [$XDG_CACHE_HOME/peppercorn]", type=str,
+                        default=cache.default_cachedir())
+    parser.add_argument("--cachesize", help="Maximum size of the result \
+                        cache in GB [10]", type=float, default=10)
+    parser.add_argument("--resume", help="Skip the stages and ranges an \
+                        interrupted run with the same inputs and options \
+                        finished, as recorded in peppercorn.run.jsonl",
+                        action="store_true")
+    parser.add_argument("--profile", help="Print time, CPU and memory used \
+                        by each stage and tool at the end of the run",
+                        action="store_true")
+    parser.add_argument("--trace", help="Write a timed event for every \
+                        stage, range and child process to this file, as JSON \
+                        lines, or as a Chrome trace if it ends in .json",
+                        type=str, default=None)
 
-    # run tblastn
-    blastdbsuf = [".ndb", ".nhr", ".nin", ".nog", ".nos", ".not",
-                  ".nsq", ".ntf", ".nto"]
-    for s in blastdbsuf:
-        if not os.path.isfile(args.genome + s):
-            tblastn.run_makeblastdb(args.genome)
-    tblastn_out = tblastn.run_tblastn(args.queries, args.genome, args.threads)
-    tblastn_hits = tblastn.parse_tblastn(tblastn_out)
-    hit_lens = [x.sendorder - x.sstartorder for x in tblastn_hits]
-    mean_hit_len = round(sum(hit_lens) / len(hit_lens))
-    # unique_hits = tblastn.unique_hits(tblastn_hits)
-    ranges = tblastn.hits_to_range(tblastn.join_hits(tblastn_hits, args.intronlength, mean_hit_len))
-    print([(x.query, x.subject,
-            x.start, x.end,
-            x.file) for x in ranges])
-    tblastn.pad_range(ranges, length=args.intronlength + mean_hit_len)
-    print([(x.query, x.subject,
-            x.start, x.end,
-            x.file) for x in ranges])
-    # sys.exit()
-    # start pulling subsequences
-    subseq.write_subseq(args.genome, ranges)
-    # print([(x.query, x.subject,
-    #         x.start, x.end,
-    #         x.file) for x in ranges])
-    goodres = []
-    badres = []
-    for r in ranges:
-        print(r.query)
-        print(r.queries)
-        qf = split_query(args.queries, r.queries)
-        out, hintsf, res = exonerate.run_exonerate(r.file, qf)
-        if not res:
-            sys.stderr.write("No exonerate result for %s, discarding\n"
-                             % r.file)
-            os.remove(r.file)
-            os.remove(hintsf)
-            # os.remove(res)
-            ranges.remove(r)
-        else:
-            augout = augustus.run_augustus(r.file, hintsf, args.species)
-            auggenes = augustus.parse_augustus(augout)
-            for a in auggenes:
-                if a.percent_support > 0:
-                    a.gene = "%s_%s_%s_%s" % (r.subject,
-                                              r.start, r.end,
-                                              a.gene)
-                    goodres.append(a)
-                else:
-                    a.gene = "%s_%s_%s_%s" % (r.subject,
-                                              r.start, r.end,
-                                              a.gene)
-                    badres.append(a)
 
-    # augustus.rename(goodres)
+def open_cache(args):
+    if args.no_cache:
+        return None
+    return cache.result_cache(args.cachedir, int(args.cachesize * 1024 ** 3))
 
-    with open("final_supported_predictions.cds.fa", "w") as outf:
-        for r in goodres:
-            outf.write(r.write_fasta(coding=True))
 
-    with open("final_supported_predictions.gtf", "w") as outf:
-        for r in goodres:
-            for i in r.gff:
-                outf.write("\t".join(i) + "\n")
+def run_params(args, inputs: list[str], **params) -> dict:
+    """
+    the inputs and options a run's ranges depend on, as compared before
+    picking up an earlier run
+    """
+    params.update({"inputs": checkpoint.file_params(inputs),
+                   "intronlength": args.intronlength,
+                   "stranded": args.stranded, "species": args.species,
+                   "fixed_windows": args.fixed_windows,
+                   "finder": args.finder, "kmer_size": args.kmer_size,
+                   "max_queries": args.max_queries,
+                   "collapse_similar": args.collapse_similar,
+                   "genome_shards": args.genome_shards})
+    return params
 
-    with open("final_unsupported_predictions.cds.fa", "w") as outf:
-        for r in badres:
-            outf.write(r.write_fasta(coding=True))
 
-    with open("final_unsupported_predictions.gtf", "w") as outf:
-        for r in badres:
-            for i in r.gff:
-                outf.write("\t".join(i) + "\n")
+def open_progress(args, inputs: list[str], outdir="",
+                  **params) -> checkpoint.run_manifest:
+    """
+    the run manifest in outdir, resumed from if --resume was given and it
+    was written for the same inputs and options
+    """
+    return checkpoint.run_manifest(os.path.join(outdir,
+                                                "peppercorn.run.jsonl"),
+                                   run_params(args, inputs, **params),
+                                   args.resume)
+
+
+def start_trace(args):
+    if args.profile or args.trace is not None:
+        instrument.start()
+
+
+def finish_trace(args):
+    instrument.finish(args.trace)
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("genome", help="FASTA-formatted genomic contigs to \
+                        annotate homologues")
+    parser.add_argument("queries", help="FASTA-formatted protein queries for \
+                        homology-based annotation")
+    add_run_args(parser)
+    args = parser.parse_args()
+
+    results = open_cache(args)
+    start_trace(args)
+    progress = open_progress(args, [args.genome, args.queries])
+    queries = utils.query_store(args.queries)
+    store = None
+    genome_key = None
+    if args.hitstore is not None:
+        store = hitstore.hit_store(args.hitstore)
+        genome_key = store.genome_digest(args.genome)
+
+    ranges = resume_ranges(progress, "ranges", args.genome,
+                           extract=not args.pipelined)
+    if ranges is None and store is not None:
+        tblastn_hits, mean_hit_len = stored_hits(store, genome_key,
+                                                 args.genome, queries, args,
+                                                 results)
+    elif ranges is None and args.finder == "kmer":
+        with instrument.span("kmer_index"):
+            kmerseed.load_index(args.genome, args.kmer_size)
+        with instrument.span("kmer_search"):
+            tblastn_hits = [h for _, hits in
+                            kmerseed.stream_kmer(args.queries, args.genome,
+                                                 args.kmer_size, args.threads)
+                            for h in hits]
+        mean_hit_len = mean_length(tblastn_hits)
+    elif ranges is None and args.stream_tblastn:
+        with instrument.span("blastdb"):
+            tblastn.ensure_blastdb(args.genome)
+        with instrument.span("tblastn"):
+            # ranges join hits across queries, so they still wait for the
+            # whole search; batch.py starts each family as it completes
+            tblastn_hits = [h for _, hits in
+                            tblastn.stream_tblastn(args.queries, args.genome,
+                                                   args.threads)
+                            for h in hits]
+        mean_hit_len = mean_length(tblastn_hits)
+    elif ranges is None:
+        done = progress.stage("tblastn")
+        if done is not None:
+            tblastn_out = done["out"]
+        else:
+            # run tblastn
+            with instrument.span("blastdb"):
+                tblastn.ensure_blastdb(args.genome)
+            with instrument.span("tblastn"):
+                tblastn_out = tblastn.run_tblastn(args.queries, args.genome,
+                                                  args.threads, cache=results,
+                                                  shards=args.tblastn_shards,
+                                                  genome_shards=args.genome_shards)
+            progress.stage_done("tblastn", out=tblastn_out,
+                                files=[tblastn_out])
+        with instrument.span("parse_hits"):
+            tblastn_hits, mean_hit_len = parse_hits(tblastn_out)
+    if ranges is None:
+        with instrument.span("find_ranges"):
+            ranges = find_ranges(tblastn_hits, mean_hit_len,
+                                 args.intronlength, args.stranded,
+                                 None if args.fixed_windows
+                                 else queries.lengths(), args.genome)
+        with instrument.span("screen_queries"):
+            screen_queries(ranges, tblastn_hits, queries, args.max_queries,
+                           args.collapse_similar)
+        # start pulling subsequences
+        with instrument.span("write_subseq"):
+            # pipelined runs extract each as it is needed; ranges on contigs
+            # missing from the genome are dropped here, before any alignment
+            ranges = [r for r in ranges if subseq.name_window(args.genome, r)]
+            stored = stored_windows(store, genome_key, ranges, queries,
+                                    args.species)
+            if not args.pipelined:
+                subseq.write_subseq(args.genome, [r for r in ranges
+                                                  if r.seqid not in stored])
+        progress.stage_done("ranges", ranges=checkpoint.ranges_to_json(ranges))
+    else:
+        stored = stored_windows(store, genome_key, ranges, queries,
+                                args.species)
+    todo = [r for r in ranges if r.seqid not in stored]
+    finished = []
+    with instrument.span("process_ranges"):
+        if args.pipelined:
+            goodres, badres = process_ranges_pipelined(todo, args.genome,
+                                                       queries,
+                                                       args.species,
+                                                       args.threads,
+                                                       cache=results,
+                                                       chunks=args.exonerate_chunks,
+                                                       progress=progress,
+                                                       finished=finished)
+        else:
+            goodres, badres = process_ranges(todo,
+                                             queries,
+                                             args.species,
+                                             args.threads, cache=results,
+                                             batch_augustus=args.batch_augustus,
+                                             chunks=args.exonerate_chunks,
+                                             progress=progress,
+                                             finished=finished)
+    goodres, badres = store_windows(store, genome_key, ranges, stored,
+                                    finished, goodres, badres, queries,
+                                    args.species)
+    if results is not None:
+        results.report()
+
+    # augustus.rename(goodres)
+
+    with instrument.span("write_results"):
+        write_results(goodres, badres)
+    progress.stage_done("results")
+    progress.close()
+    finish_trace(args)
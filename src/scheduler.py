@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import heapq
+import asyncio
+import tempfile
+import itertools
+import contextlib
+import subprocess
+import utils
+import subseq
+import exonerate
+import augustus
+import instrument
+import checkpoint
+
+
+# lower runs first: finishing a range's augustus frees its files and
+# yields results sooner than starting another range's exonerate
+AUGUSTUS = 0
+EXONERATE = 1
+
+
+class cpu_slots():
+    """
+    a budget of CPU slots (normally --threads) shared by every tool process
+    the scheduler starts. Waiting tasks are granted slots by priority, then
+    in the order they asked; the head of the queue is never overtaken, so a
+    task wanting several slots is not starved by smaller ones
+    """
+    def __init__(self, total: int):
+        self.total = max(1, total)
+        self.free = self.total
+        self._waiting = []
+        self._order = itertools.count()
+
+    async def acquire(self, n=1, priority=EXONERATE) -> int:
+        n = min(n, self.total)
+        if not self._waiting and self.free >= n:
+            self.free -= n
+            return n
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._order), n, fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():  # granted, then cancelled
+                self.release(n)
+            raise
+        return n
+
+    def release(self, n: int):
+        self.free += n
+        while self._waiting and self._waiting[0][2] <= self.free:
+            _, _, m, fut = heapq.heappop(self._waiting)
+            if fut.done():  # cancelled while waiting
+                continue
+            self.free -= m
+            fut.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, n=1, priority=EXONERATE):
+        n = await self.acquire(n, priority)
+        try:
+            yield
+        finally:
+            self.release(n)
+
+
+async def run(cmd: list[str], slots: cpu_slots, priority: int, stdout,
+              inputs=(), outputs=(), feed=None, flush=()):
+    """
+    run cmd once a slot is free, writing stdout to a file object, or passing
+    it line by line to feed. Files in flush are flushed before output sizes
+    are traced. Raises CalledProcessError, with the captured stderr, on
+    failure. Processes are reaped by the event loop, so only their wall time
+    is traced
+    """
+    async with slots.hold(1, priority):
+        sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
+        start = instrument.now()
+        with tempfile.TemporaryFile() as errf:
+            p = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE if feed else stdout,
+                stderr=errf, limit=1 << 24)
+            if feed is not None:
+                async for line in p.stdout:
+                    feed(line.decode())
+            returncode = await p.wait()
+            for f in flush:
+                f.flush()
+            instrument.process(cmd, returncode, start, inputs=inputs,
+                               outputs=outputs)
+            if returncode != 0:
+                errf.seek(0)
+                raise subprocess.CalledProcessError(returncode, cmd,
+                                                    stderr=errf.read().decode())
+
+
+async def stream_exonerate(cmd: list[str], out: str, outgff: str,
+                           queryf: str, trim: int, slots: cpu_slots) -> bool:
+    """
+    as exonerate.stream_exonerate, without holding a thread
+    """
+    with open(out, "w", encoding="utf-8") as rawf, \
+            open(outgff, "w", encoding="utf-8") as outf:
+        hints = exonerate.hint_writer(outf, queryf, trim)
+
+        def feed(line):
+            rawf.write(line)
+            hints.feed(line)
+
+        await run(cmd, slots, EXONERATE, None, cmd[-2:], [out, outgff], feed,
+                  [rawf, outf])
+    return hints.result
+
+
+async def run_exonerate(dbf: str, queryf: str, slots: cpu_slots,
+                        model="protein2genome", trim=9, cache=None, chunks=1):
+    """
+    as exonerate.run_exonerate, with each query chunk taking its own slot
+    """
+    cmd, out, outgff = exonerate.exonerate_cmd(dbf, queryf, model)
+    key, result = exonerate.fetch_cached(cache, cmd, dbf, queryf, out, outgff,
+                                         trim)
+    if result is not None:
+        return out, outgff, result
+    if chunks > 1:
+        results = await asyncio.gather(*[
+            stream_exonerate(exonerate.chunk_cmd(cmd, i, chunks),
+                             "%s.%d" % (out, i), "%s.%d" % (outgff, i),
+                             queryf, trim, slots)
+            for i in range(1, chunks + 1)])
+        exonerate.join_chunks(out, outgff, chunks)
+        result = any(results)
+    else:
+        result = await stream_exonerate(cmd, out, outgff, queryf, trim, slots)
+    exonerate.store_cached(cache, key, out, outgff, result)
+    return out, outgff, result
+
+
+async def run_augustus(dbf: str, hintsf: str, slots: cpu_slots,
+                       species="arabidopsis", coding=True, cache=None) -> str:
+    """
+    as augustus.run_augustus
+    """
+    cmd, out = augustus.augustus_cmd(dbf, hintsf, species, coding)
+    key, hit = augustus.fetch_cached(cache, cmd, dbf, hintsf, out)
+    if hit:
+        return out
+    with open(out, "w", encoding="utf-8") as outf:
+        await run(cmd, slots, AUGUSTUS, outf, [dbf, hintsf], [out])
+    augustus.store_cached(cache, key, out)
+    return out
+
+
+async def process_range(r: utils.genome_range, genome: str,
+                        queries: utils.query_store, slots: cpu_slots,
+                        species="arabidopsis", cache=None, chunks=1,
+                        progress=None, outdir=None):
+    """
+    extract, align and predict on one range, each step starting as soon as
+    the one before it is done. Returns augustus predictions, or [] if
+    nothing aligned
+    """
+    if not r.file and subseq.name_window(genome, r, outdir) is None:
+        return []
+    done = checkpoint.finished_step(progress, r, "exonerate")
+    if done is None and not os.path.isfile(r.file):
+        await asyncio.to_thread(subseq.write_subseq, genome, [r],
+                                outdir=outdir)
+    with instrument.span(r.seqid, cat="range"):
+        if done is not None:
+            hintsf = done["hints"]
+        else:
+            with instrument.span("exonerate"):
+                qf = queries.subset(r.queries)
+                _, hintsf, res = await run_exonerate(r.file, qf, slots,
+                                                     cache=cache,
+                                                     chunks=chunks)
+            hintsf = exonerate.finish_range(r, hintsf, res, progress)
+        if hintsf is None:
+            return []
+        done = checkpoint.finished_step(progress, r, "augustus")
+        with instrument.span("augustus"):
+            if done is not None:
+                augout = done["out"]
+            else:
+                augout = await run_augustus(r.file, hintsf, slots, species,
+                                            cache=cache)
+                augustus.finish_range(r, augout, progress)
+            return await asyncio.to_thread(augustus.parse_augustus, augout)
+
+
+async def process_ranges(ranges: list[utils.genome_range], genome: str,
+                         queries: utils.query_store, species="arabidopsis",
+                         threads=1, cache=None, chunks=1, progress=None,
+                         outdir=None) -> list:
+    slots = cpu_slots(threads)
+
+    async def one(r):
+        try:
+            return await process_range(r, genome, queries, slots, species,
+                                       cache, chunks, progress, outdir)
+        except Exception as e:
+            sys.stderr.write("Failed to process %s: %s, discarding\n"
+                             % (r.file or r.subject, e))
+            return None
+
+    return await asyncio.gather(*[one(r) for r in ranges])
+
+
+def run_ranges(ranges: list[utils.genome_range], genome: str,
+               queries: utils.query_store, species="arabidopsis", threads=1,
+               cache=None, chunks=1, progress=None, outdir=None) -> list:
+    """
+    process every range as its own chain of extract, exonerate and augustus
+    tasks on an asyncio event loop, with all tool processes sharing threads
+    CPU slots. Returns each range's augustus predictions in the order of
+    ranges, or None for a range that failed
+    """
+    return asyncio.run(process_ranges(ranges, genome, queries, species,
+                                      threads, cache, chunks, progress,
+                                      outdir))
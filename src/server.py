@@ -0,0 +1,292 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import socketserver
+import concurrent.futures
+import utils
+import cache
+import subseq
+import tblastn
+import peppercorn
+
+
+class warm_state():
+    """
+    everything a server keeps between jobs: the result cache (with its input
+    digests), the genomes whose blast dbs and faidx indexes are known to be
+    current, and one pool of workers shared by the ranges of every job
+    """
+    def __init__(self, threads=1, results=None):
+        self.threads = threads
+        self.results = results
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.genomes = {}  # genome: mtime_ns when its db and index were checked
+        self.jobs = 0
+        self._lock = threading.Lock()
+        self._genome_locks = {}
+
+    def prepare(self, genome: str):
+        """
+        make sure genome's blast db and faidx index are current, checking only
+        when it has changed since the last job against it. Jobs against other
+        genomes do not wait for the check
+        """
+        mtime = os.stat(genome).st_mtime_ns
+        with self._lock:
+            if self.genomes.get(genome) == mtime:
+                return
+            lock = self._genome_locks.setdefault(genome, threading.Lock())
+        with lock:
+            with self._lock:
+                if self.genomes.get(genome) == mtime:  # checked while we waited
+                    return
+            tblastn.ensure_blastdb(genome)
+            subseq.load_index(genome)
+            with self._lock:
+                self.genomes[genome] = mtime
+
+
+def prediction(a) -> dict:
+    return {"gene": a.gene, "fasta": a.write_fasta(coding=True),
+            "gtf": "".join("\t".join(x) + "\n" for x in a.gff)}
+
+
+def run_job(state: warm_state, job: dict, send):
+    """
+    annotate one family: job names a genome and an outdir (absolute paths, as
+    the server's working directory is its own) and carries the query FASTA
+    text, written to a file of the job's own so jobs sharing an outdir do
+    not overwrite each other's. Each range's predictions are sent as soon as
+    it finishes, then a final summary
+    """
+    genome = job["genome"]
+    outdir = job["outdir"]
+    os.makedirs(outdir, exist_ok=True)
+    fd, queryf = tempfile.mkstemp(prefix="queries.", suffix=".pep.fa",
+                                  dir=outdir)
+    with os.fdopen(fd, "w", encoding="utf-8") as outf:
+        outf.write(job["queries"])
+    state.prepare(genome)
+    tblastn_out = tblastn.run_tblastn(queryf, genome, state.threads,
+                                      cache=state.results)
+    tblastn_hits, mean_hit_len = peppercorn.parse_hits(tblastn_out)
+    queries = utils.query_store(queryf, outdir)
+    ranges = peppercorn.find_ranges(tblastn_hits, mean_hit_len,
+                                    job.get("intronlength", 3000),
+                                    job.get("stranded", False),
+                                    None if job.get("fixed_windows")
+                                    else queries.lengths(), genome)
+    peppercorn.screen_queries(ranges, tblastn_hits, queries,
+                              job.get("max_queries", 5),
+                              job.get("collapse_similar"))
+    subseq.write_subseq(genome, ranges, outdir=outdir)
+    send({"event": "ranges", "ranges": len(ranges)})
+    futures = {state.pool.submit(peppercorn.process_range, r, queries,
+                                 job.get("species", "arabidopsis"),
+                                 state.results,
+                                 job.get("exonerate_chunks", 1)): i
+               for i, r in enumerate(ranges)}
+    counts = [0, 0]
+    for f in concurrent.futures.as_completed(futures):
+        i = futures[f]
+        try:
+            good, bad = f.result()
+        except Exception as e:
+            send({"event": "failed", "index": i, "range": ranges[i].seqid,
+                  "message": str(e)})
+            continue
+        counts[0] += len(good)
+        counts[1] += len(bad)
+        send({"event": "range", "index": i, "range": ranges[i].seqid,
+              "supported": [prediction(a) for a in good],
+              "unsupported": [prediction(a) for a in bad]})
+    send({"event": "done", "supported": counts[0], "unsupported": counts[1]})
+
+
+class job_handler(socketserver.StreamRequestHandler):
+    """
+    one connection, one request: a JSON object on a single line, answered
+    with JSON lines. {"op": "status"} describes the warm state; anything
+    else is a job for run_job
+    """
+    def handle(self):
+        state = self.server.state
+
+        def send(msg: dict):
+            self.wfile.write((json.dumps(msg) + "\n").encode())
+            self.wfile.flush()
+
+        try:
+            job = json.loads(self.rfile.readline())
+            if job.get("op") == "status":
+                send({"event": "status", "jobs": state.jobs,
+                      "genomes": sorted(state.genomes),
+                      "threads": state.threads})
+                return
+            with state._lock:
+                state.jobs += 1
+            run_job(state, job, send)
+        except BrokenPipeError:
+            sys.stderr.write("Client went away\n\n")
+        except Exception as e:
+            sys.stderr.write("Job failed: %s\n\n" % e)
+            try:
+                send({"event": "error", "message": str(e)})
+            except OSError:
+                pass
+        if state.results is not None:
+            state.results.report()
+
+
+class job_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, state: warm_state):
+        self.state = state
+        if os.path.exists(path):  # left by a server that did not exit cleanly
+            os.remove(path)
+        super().__init__(path, job_handler)
+
+
+def serve(path: str, threads=1, results=None):
+    state = warm_state(threads, results)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with job_server(path, state) as server:
+        sys.stderr.write("Listening on %s\n\n" % path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+            state.pool.shutdown()
+
+
+def submit(path: str, job: dict):
+    """
+    send a job to a server, yielding its replies as they arrive
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(job) + "\n").encode())
+        with sock.makefile("r", encoding="utf-8") as replies:
+            for line in replies:
+                yield json.loads(line)
+
+
+def write_replies(replies, outdir: str) -> bool:
+    """
+    write predictions sent by a server to outdir's final_* files, in range
+    order as peppercorn.py writes them, returning whether the job finished
+    """
+    ranges = {}
+    finished = False
+    for msg in replies:
+        if msg["event"] == "ranges":
+            sys.stderr.write("%d ranges\n\n" % msg["ranges"])
+        elif msg["event"] == "range":
+            sys.stderr.write("%s: %d supported, %d unsupported\n\n"
+                             % (msg["range"], len(msg["supported"]),
+                                len(msg["unsupported"])))
+            ranges[msg["index"]] = msg
+        elif msg["event"] == "failed":
+            sys.stderr.write("Failed to process %s: %s, discarding\n"
+                             % (msg["range"], msg["message"]))
+        elif msg["event"] == "error":
+            sys.stderr.write("Job failed: %s\n" % msg["message"])
+        elif msg["event"] == "done":
+            finished = True
+    for kind in ["supported", "unsupported"]:
+        with open(os.path.join(outdir, "final_%s_predictions.cds.fa" % kind),
+                  "w") as outf, \
+                open(os.path.join(outdir, "final_%s_predictions.gtf" % kind),
+                     "w") as outg:
+            for i in sorted(ranges):
+                for p in ranges[i][kind]:
+                    outf.write(p["fasta"])
+                    outg.write(p["gtf"])
+    return finished
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Run peppercorn as a \
+                                     local server that keeps genome indexes, \
+                                     blast db checks, the result cache and a \
+                                     worker pool warm between jobs, or submit \
+                                     a job to one")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="Listen for jobs")
+    serve_parser.add_argument("socket", help="Unix socket path to listen on")
+    serve_parser.add_argument("-t", "--threads", help="Number of threads, \
+                              shared by all jobs [1]", type=int, default=1)
+    serve_parser.add_argument("--no-cache", help="Always rerun tblastn, \
+                              exonerate and augustus instead of reusing \
+                              cached results", action="store_true")
+    serve_parser.add_argument("--cachedir", help="Directory for cached tool \
+                              results [$XDG_CACHE_HOME/peppercorn]", type=str,
+                              default=cache.default_cachedir())
+    serve_parser.add_argument("--cachesize", help="Maximum size of the \
+                              result cache in GB [10]", type=float, default=10)
+    submit_parser = sub.add_parser("submit", help="Annotate one family with \
+                                   a running server, writing final_* files \
+                                   as peppercorn.py does")
+    submit_parser.add_argument("socket", help="Unix socket of the server")
+    submit_parser.add_argument("genome", help="FASTA-formatted genomic \
+                               contigs to annotate homologues")
+    submit_parser.add_argument("queries", help="FASTA-formatted protein \
+                               queries for homology-based annotation")
+    submit_parser.add_argument("-o", "--outdir", help="Directory for \
+                               intermediate and final files [.]", type=str,
+                               default=".")
+    submit_parser.add_argument("-i", "--intronlength", help="Expected \
+                               maximum intron length [3000]", type=int,
+                               default=3000)
+    submit_parser.add_argument("-s", "--species", help="Species model to use \
+                               for Augustus [arabidopsis]", type=str,
+                               default="arabidopsis")
+    submit_parser.add_argument("--stranded", help="Only join hits on the \
+                               same strand of a contig into ranges",
+                               action="store_true")
+    submit_parser.add_argument("--exonerate-chunks", help="Split each \
+                               range's queries over this many concurrent \
+                               exonerate processes [1]", type=int, default=1)
+    submit_parser.add_argument("--fixed-windows", help="Pad every range \
+                               by intronlength plus the mean hit length, \
+                               instead of by how much of each query its hits \
+                               left uncovered", action="store_true")
+    submit_parser.add_argument("--max-queries", help="Align at most this \
+                               many queries per range with exonerate (0 for \
+                               all) [5]", type=int, default=5)
+    submit_parser.add_argument("--collapse-similar", help="Drop queries \
+                               whose 3-mer Jaccard similarity to a better one \
+                               is at least this (0-1)", type=float,
+                               default=None)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.socket, args.threads, peppercorn.open_cache(args))
+    else:
+        with open(args.queries, "r", encoding="utf-8") as inf:
+            query_text = inf.read()
+        job = {"genome": os.path.abspath(args.genome),
+               "outdir": os.path.abspath(args.outdir),
+               "queries": query_text, "intronlength": args.intronlength,
+               "species": args.species, "stranded": args.stranded,
+               "exonerate_chunks": args.exonerate_chunks,
+               "fixed_windows": args.fixed_windows,
+               "max_queries": args.max_queries,
+               "collapse_similar": args.collapse_similar}
+        os.makedirs(args.outdir, exist_ok=True)
+        if not write_replies(submit(args.socket, job), args.outdir):
+            sys.exit(1)
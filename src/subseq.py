@@ -1,38 +1,173 @@
 #! /usr/bin/python3
 
 
+import os
 import sys
 import argparse
+import threading
 from utils import genome_range
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
 
 
-def write_subseq(dbf, ranges: list[genome_range]):
-    coord_dict = {}
+class faidx_entry():
+    """
+    simple referenceable data class for a samtools faidx index line
+    """
+    def __init__(self, input=[]):
+        self.name = input[0]
+        self.length = int(input[1])
+        self.offset = int(input[2])
+        self.linebases = int(input[3])
+        self.linewidth = int(input[4])
+
+    def to_line(self) -> str:
+        return "\t".join([self.name, str(self.length), str(self.offset),
+                          str(self.linebases), str(self.linewidth)]) + "\n"
+
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def build_index(dbf: str) -> dict[str, faidx_entry]:
+    """
+    single pass over dbf recording, for each contig, its length, the byte
+    offset of its first base and its line geometry, as in samtools faidx.
+    Requires all lines of a record but the last to be the same length, and
+    no blank lines between them
+    """
+    out = {}
+    with open(dbf, "rb") as handle:
+        name = None
+        offset = length = linebases = linewidth = 0
+        last_short = blank = False
+        pos = 0
+        for line in handle:
+            pos += len(line)
+            if line.startswith(b">"):
+                if name is not None:
+                    out[name] = faidx_entry([name, length, offset,
+                                             linebases, linewidth])
+                name = line[1:].split()[0].decode()
+                if name in out:
+                    raise ValueError("Duplicate sequence %s in %s"
+                                     % (name, dbf))
+                offset = pos
+                length = linebases = linewidth = 0
+                last_short = blank = False
+                continue
+            bases = len(line.rstrip(b"\r\n"))
+            if bases == 0:
+                blank = True
+                continue
+            if blank:
+                raise ValueError("Blank line within %s in %s"
+                                 % (name, dbf))
+            if last_short:
+                raise ValueError("Inconsistent line lengths for %s in %s"
+                                 % (name, dbf))
+            if linebases == 0:
+                linebases = bases
+                linewidth = len(line)
+            elif bases > linebases:
+                raise ValueError("Inconsistent line lengths for %s in %s"
+                                 % (name, dbf))
+            last_short = bases < linebases
+            length += bases
+        if name is not None:
+            out[name] = faidx_entry([name, length, offset,
+                                     linebases, linewidth])
+    return out
+
+
+def load_index(dbf: str) -> dict[str, faidx_entry]:
+    """
+    return the faidx index for dbf, reading dbf.fai if it is newer than dbf
+    and (re)building it otherwise. Indexes are kept in memory per process
+    """
+    idxf = dbf + ".fai"
+    mtime = os.path.getmtime(dbf)
+    with _index_lock:
+        cached = _index_cache.get(dbf)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        if os.path.isfile(idxf) and os.path.getmtime(idxf) >= mtime:
+            with open(idxf, "r", encoding="utf-8") as inf:
+                index = {}
+                for line in inf:
+                    e = faidx_entry(line.rstrip("\n").split("\t"))
+                    index[e.name] = e
+        else:
+            sys.stderr.write("Indexing %s\n\n" % dbf)
+            index = build_index(dbf)
+            tmp = idxf + ".tmp.%d" % os.getpid()
+            with open(tmp, "w", encoding="utf-8") as outf:
+                for e in index.values():
+                    outf.write(e.to_line())
+            os.replace(tmp, idxf)
+        _index_cache[dbf] = (mtime, index)
+    return index
+
+
+def fetch(handle, entry: faidx_entry, start: int, end: int) -> bytes:
+    """
+    read bases [start, end) (0-indexed) of entry from an open binary handle,
+    seeking straight to the containing lines
+    """
+    start = max(0, start)
+    end = min(end, entry.length)
+    if start >= end:
+        return b""
+    first = entry.offset + (start // entry.linebases) * entry.linewidth + \
+        start % entry.linebases
+    last = entry.offset + ((end - 1) // entry.linebases) * entry.linewidth + \
+        (end - 1) % entry.linebases
+    handle.seek(first)
+    raw = handle.read(last - first + 1)
+    return raw.replace(b"\n", b"").replace(b"\r", b"")
+
+
+def name_window(dbf, r: genome_range, outdir=None):
+    """
+    clamp r's end to its contig and set the file and sequence id its window
+    is written to, without writing it. Returns the contig's index entry, or
+    None, with a warning, if dbf has no such contig; callers drop those ranges
+    """
+    try:
+        entry = load_index(dbf)[r.subject]
+    except KeyError:
+        sys.stderr.write("%s not found in %s, skipping\n\n"
+                         % (r.subject, dbf))
+        return None
+    if r.end > entry.length:
+        r.new_end(entry.length)
+    prefix = dbf
+    if outdir is not None:
+        prefix = os.path.join(outdir, os.path.basename(dbf))
+    r.file = "_".join([prefix, r.subject,
+                       str(r.start),
+                       str(r.end)])
+    r.seqid = r.subject + "_" + str(r.start) + "_" + str(r.end)
+    return entry
+
+
+def write_subseq(dbf, ranges: list[genome_range], width=60, outdir=None):
+    """
+    write each range (1-indexed, inclusive) to its own FASTA, reading only the
+    requested bytes of dbf through its faidx index. Range ends are clamped to
+    the contig length. Files are written next to dbf, or to outdir if given
+    """
     out = []
-    for r in ranges:
-        output = "_".join([dbf, r.subject,
-                           str(r.start),
-                           str(r.end)])
-        r.file = output
-        try:
-            coord_dict[r.subject].append((r.start, r.end, output))
-        except KeyError:
-            coord_dict[r.subject] = [(r.start, r.end, output)]
-    for rec in SeqIO.parse(dbf, "fasta"):
-        if rec.id in coord_dict.keys():
-            for coords in coord_dict[rec.id]:  # tuples
-                newid = rec.id + "_" + str(coords[0]) + "_" + str(coords[1])
-                # print((coords[1]-1, coords[2]-1))
-                newrec = SeqRecord(
-                    Seq(rec.seq[coords[0]-1:coords[1]-1]),
-                    id=newid,
-                    description="",
-                    )
-                SeqIO.write(newrec, coords[2], "fasta")
-                out.append((coords[2], rec.id, output))
+    with open(dbf, "rb") as handle:
+        for r in ranges:
+            entry = name_window(dbf, r, outdir)
+            if entry is None:
+                continue
+            seq = fetch(handle, entry, r.start - 1, r.end).decode()
+            with open(r.file, "w", encoding="utf-8") as outf:
+                outf.write(">%s\n" % r.seqid)
+                for i in range(0, len(seq), width):
+                    outf.write(seq[i:i+width] + "\n")
+            out.append((r.file, r.subject, r.seqid))
     return out
 
 
@@ -126,11 +261,7 @@ if __name__ == "__main__":
                         type=int, nargs=2)
     args = parser.parse_args()
 
-    coord_dict = {"OW204023.1": [(24000, 25000), (24500, 25500)],
-                  "OW204024.1": [(24000, 25000), (24500, 25500)]}
-
-    # coord_dict = redundant_ranges(coord_dict, 300)
-    # print(coord_dict)
+    ranges = [genome_range([args.id, args.id, args.range[0], args.range[1]])]
 
-    files = write_subseq(args.database, coord_dict)
+    files = write_subseq(args.database, ranges)
     print(files)
@@ -2,28 +2,245 @@
 
 import os
 import sys
+import copy
+import bisect
+import json
+import fcntl
+import shutil
 import argparse
+import tempfile
 import subprocess
-from utils import tblastnhit, genome_range
+import concurrent.futures
+import subseq
+import instrument
+from utils import tblastnhit, genome_range, tool_version, parse_fasta
 
 
 def run_makeblastdb(dbf: str, dbtype="nucl"):
     sys.stderr.write("Making blast db\n\n")
     cmd = ["makeblastdb", "-in", dbf, "-dbtype", dbtype, "-parse_seqids"]
     sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
-    subprocess.run(cmd, shell=False)
+    instrument.run(cmd, check=True, inputs=[dbf])
 
 
-def run_tblastn(queryf: str, dbf: str, threads=1) -> str:
+def blastdb_manifest(dbf: str, dbtype="nucl") -> dict:
+    """
+    describe the current state of dbf and its blast db: the FASTA's size and
+    mtime, the makeblastdb version and the db files present
+    """
+    st = os.stat(dbf)
+    prefix = os.path.basename(dbf) + "." + dbtype[0]
+    files = sorted(f for f in os.listdir(os.path.dirname(dbf) or ".")
+                   if f.startswith(prefix))
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+            "dbtype": dbtype, "makeblastdb": tool_version("makeblastdb"),
+            "files": files}
+
+
+def blastdb_fresh(dbf: str, dbtype="nucl") -> bool:
+    try:
+        with open(dbf + ".blastdb.json", "r", encoding="utf-8") as inf:
+            recorded = json.load(inf)
+    except (OSError, ValueError):
+        return False
+    current = blastdb_manifest(dbf, dbtype)
+    return (all(recorded.get(k) == current[k]
+                for k in ["size", "mtime_ns", "dbtype", "makeblastdb"]) and
+            bool(recorded.get("files")) and
+            set(recorded["files"]) <= set(current["files"]))
+
+
+def ensure_blastdb(dbf: str, dbtype="nucl") -> bool:
+    """
+    build the blast db for dbf unless its manifest (dbf.blastdb.json) shows
+    an up to date build, returning whether makeblastdb was run. Concurrent
+    callers serialise on dbf.blastdb.lock, so only one of them builds
+    """
+    if blastdb_fresh(dbf, dbtype):
+        return False
+    with open(dbf + ".blastdb.lock", "w") as lockf:
+        fcntl.flock(lockf, fcntl.LOCK_EX)
+        try:
+            if blastdb_fresh(dbf, dbtype):  # built while we waited
+                return False
+            run_makeblastdb(dbf, dbtype)
+            manifest = blastdb_manifest(dbf, dbtype)
+            tmp = dbf + ".blastdb.json.tmp"
+            with open(tmp, "w", encoding="utf-8") as outf:
+                json.dump(manifest, outf, indent=1)
+            os.replace(tmp, dbf + ".blastdb.json")
+        finally:
+            fcntl.flock(lockf, fcntl.LOCK_UN)
+    return True
+
+
+def run_tblastn(queryf: str, dbf: str, threads=1, cache=None, shards=1,
+                genome_shards=1) -> str:
     sys.stderr.write("Searching for matches to quer(y/ies)\n\n")
     outf = queryf + ".tblastn.outfmt7"
     cmd = ["tblastn", "-query", queryf, "-db", dbf, "-outfmt", "7", "-out",
-           outf, "-num_threads", str(threads)]
-    sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
-    subprocess.run(cmd, shell=False)
+           outf]
+    if cache is not None:  # thread count does not change the result
+        keycmd = cmd
+        if genome_shards > 1:  # see run_tblastn_sharded
+            keycmd = cmd + ["genome_shards=%d" % genome_shards]
+        key = cache.key("tblastn", keycmd, [queryf, dbf])
+        if cache.fetch("tblastn", key, [outf]) is not None:
+            return outf
+    if shards > 1 or genome_shards > 1:
+        run_tblastn_sharded(queryf, dbf, outf, threads, shards,
+                            genome_shards)
+    else:
+        cmd += ["-num_threads", str(threads)]
+        sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
+        instrument.run(cmd, check=True, inputs=[queryf, dbf],
+                       outputs=[outf])
+    if cache is not None:
+        cache.store("tblastn", key, [outf])
     return outf
 
 
+def split_queries(queryf: str, shards: int) -> list[str]:
+    """
+    split queryf into up to shards files of roughly equal residue count,
+    keeping the original order of queries within each shard
+    """
+    seqs = list(parse_fasta(queryf))
+    shards = max(1, min(shards, len(seqs)))
+    sizes = [0] * shards
+    assigned = [[] for _ in range(shards)]
+    order = sorted(range(len(seqs)), key=lambda i: -len(seqs[i][1]))
+    for i in order:  # longest first into the lightest shard
+        j = sizes.index(min(sizes))
+        sizes[j] += len(seqs[i][1])
+        assigned[j].append(i)
+    out = []
+    for j, idx in enumerate(assigned):
+        shardf = "%s.%dof%d.fa" % (queryf, j + 1, shards)
+        with open(shardf, "w", encoding="utf-8") as outf:
+            for i in sorted(idx):
+                outf.write(">%s\n%s\n" % seqs[i])
+        out.append(shardf)
+    return out
+
+
+def split_genome(dbf: str, shards: int) -> list[str]:
+    """
+    split dbf into up to shards groups of whole contigs with roughly equal
+    total length. Shard files are kept and only rewritten when dbf changes,
+    so their blast dbs stay fresh between runs
+    """
+    index = subseq.load_index(dbf)
+    shards = max(1, min(shards, len(index)))
+    files = ["%s.%dof%d.fa" % (dbf, j + 1, shards) for j in range(shards)]
+    mtime = os.path.getmtime(dbf)
+    if all(os.path.isfile(f) and os.path.getmtime(f) >= mtime
+           for f in files):
+        return files
+    sizes = [0] * shards
+    group = {}
+    for e in sorted(index.values(), key=lambda x: -x.length):
+        j = sizes.index(min(sizes))
+        sizes[j] += e.length
+        group[e.name] = j
+    handles = [open(f + ".tmp", "wb") for f in files]
+    try:
+        with open(dbf, "rb") as inf:
+            out = handles[0]
+            for line in inf:
+                if line.startswith(b">"):
+                    out = handles[group[line[1:].split()[0].decode()]]
+                out.write(line)
+    finally:
+        for h in handles:
+            h.close()
+    for f in files:
+        os.replace(f + ".tmp", f)
+    return files
+
+
+# tblastn's default -max_target_seqs for tabular output
+MAX_TARGET_SEQS = 500
+
+
+def top_subjects(outfs: list[str], max_targets=MAX_TARGET_SEQS) -> set:
+    """
+    the (query, subject) pairs of the max_targets best subjects of each
+    query over the outfmt 7 files outfs, ranked by their best hit's e-value
+    then bitscore
+    """
+    best = {}
+    for f in outfs:
+        with open(f, "r") as inf:
+            for line in inf:
+                if line.startswith("#") or not line.strip():
+                    continue
+                row = line.split("\t")
+                score = (float(row[10]), -float(row[11]), row[1])
+                pair = (row[0], row[1])
+                if pair not in best or score < best[pair]:
+                    best[pair] = score
+    byquery = {}
+    for (q, s), score in best.items():
+        byquery.setdefault(q, []).append((score, s))
+    return {(q, s) for q, ranked in byquery.items()
+            for _, s in sorted(ranked)[:max_targets]}
+
+
+def run_tblastn_sharded(queryf: str, dbf: str, outf: str, threads=1,
+                        shards=2, genome_shards=1):
+    """
+    run tblastn over every combination of query shard and genome shard as
+    concurrent processes, concatenating the outfmt 7 results into outf.
+
+    Query sharding gives the same hits as a single search. Genome shards are
+    searched with -dbsize set to the whole genome, so e-values are computed
+    against the full database. Each shard reports up to -max_target_seqs
+    subjects per query, so the merged hits are cut back to the best
+    MAX_TARGET_SEQS subjects of each query over all shards (see
+    top_subjects)
+    """
+    queryfs = split_queries(queryf, shards)
+    dbfs = [dbf]
+    extra = []
+    if genome_shards > 1:
+        dbfs = split_genome(dbf, genome_shards)
+        for d in dbfs:
+            ensure_blastdb(d)
+        total = sum(e.length for e in subseq.load_index(dbf).values())
+        extra = ["-dbsize", str(total)]
+    jobs = [(q, d) for q in queryfs for d in dbfs]
+    workers = max(1, min(len(jobs), threads))
+    per_job = max(1, threads // workers)
+
+    def search(job):
+        q, d = job
+        shardout = "%s.%s.tblastn.outfmt7" % (q, os.path.basename(d))
+        cmd = ["tblastn", "-query", q, "-db", d, "-outfmt", "7", "-out",
+               shardout, "-num_threads", str(per_job)] + extra
+        sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
+        instrument.run(cmd, check=True, inputs=[q, d], outputs=[shardout])
+        return shardout
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        shardouts = list(pool.map(search, jobs))
+    kept = top_subjects(shardouts) if len(dbfs) > 1 else None
+    with open(outf, "w") as out:
+        for f in shardouts:
+            with open(f, "r") as inf:
+                if kept is None:
+                    shutil.copyfileobj(inf, out)
+                else:
+                    for line in inf:
+                        row = line.split("\t", 2)
+                        if line.startswith("#") or len(row) < 3 or \
+                                (row[0], row[1]) in kept:
+                            out.write(line)
+            os.remove(f)
+    for q in queryfs:
+        os.remove(q)
+
+
 def parse_tblastn(outf: str, e=1e-5, bitscore=30) -> list[tblastnhit]:
     sys.stderr.write("Parsing tblastn hits\n\n")
     out = []
@@ -38,32 +255,170 @@ def parse_tblastn(outf: str, e=1e-5, bitscore=30) -> list[tblastnhit]:
     return out  # list of lists
 
 
-def unique_hits(tblastn_out: list[tblastnhit]) -> list[tblastnhit]:
-    out = []
+def stream_tblastn(queryf: str, dbf: str, threads=1, e=1e-5, bitscore=30):
+    """
+    run tblastn with commented tabular output (outfmt 7) on a pipe, yielding
+    (query, hits) for each query as soon as tblastn moves on to the next.
+    Rows are filtered as in parse_tblastn as they arrive, so the unfiltered
+    hits are never written or held. Every query is yielded, with [] if none
+    of its hits passed
+    """
+    sys.stderr.write("Searching for matches to quer(y/ies)\n\n")
+    cmd = ["tblastn", "-query", queryf, "-db", dbf, "-outfmt", "7",
+           "-num_threads", str(threads)]
+    sys.stderr.write(subprocess.list2cmdline(cmd) + "\n\n")
+    start = instrument.now()
+    with tempfile.TemporaryFile() as errf:
+        p = subprocess.Popen(cmd, shell=False, stdout=subprocess.PIPE,
+                             stderr=errf, text=True)
+        try:
+            query = None
+            hits = []
+            for line in p.stdout:
+                if line.startswith("# Query:"):
+                    if query is not None:
+                        yield query, hits
+                    query = line[len("# Query:"):].split()[0]
+                    hits = []
+                elif not line.startswith("#"):
+                    rec = line.split()
+                    if rec and float(rec[10]) < e and float(rec[11]) > bitscore:
+                        hits.append(tblastnhit(input=rec))
+            p.stdout.close()
+            if instrument.wait(p, [queryf], [], start) != 0:
+                errf.seek(0)
+                raise subprocess.CalledProcessError(p.returncode, cmd,
+                                                    stderr=errf.read().decode())
+        finally:
+            if p.returncode is None:  # the consumer stopped early
+                p.kill()
+                instrument.wait(p, start=start)
+    if query is not None:
+        yield query, hits
+
+
+def group_batches(batches, owner=None):
+    """
+    gather stream_tblastn's per-query batches into (group, hits) for each
+    group of queries (owner maps query to group), yielding a group as soon as
+    the stream moves past its last query. Groups must be contiguous in query
+    order. Without owner, all queries form one group, yielded at the end
+    """
+    started = False
+    group = None
+    hits = []
+    for query, batch in batches:
+        g = owner[query] if owner is not None else None
+        if started and g != group:
+            yield group, hits
+            hits = []
+        group = g
+        started = True
+        hits += batch
+    if started:
+        yield group, hits
+
+
+def group_hits(tblastn_out: list[tblastnhit],
+               stranded=False) -> dict[tuple, list[tblastnhit]]:
+    """
+    bucket hits by subject (and strand, if stranded) in a single pass, each
+    bucket sorted by subject start, longest span then best hit first
+    """
+    groups = {}
     for h in tblastn_out:
+        key = (h.subject, h.sstart > h.send) if stranded else (h.subject,)
+        try:
+            groups[key].append(h)
+        except KeyError:
+            groups[key] = [h]
+    for v in groups.values():
+        v.sort(key=lambda x: (x.sstartorder, -x.sendorder,
+                              x.evalue, -x.bitscore))
+    return dict(sorted(groups.items()))
+
+
+def sweep_unique(ordered: list[tblastnhit]) -> list[tblastnhit]:
+    """
+    sweep over hits on one subject, as ordered by group_hits, dropping those
+    with the same span as a better hit or strictly inside another hit
+    """
+    out = []
+    reach = 0  # furthest end of any hit starting before the current start
+    block_start = None
+    block_reach = 0
+    for h in ordered:
+        if h.sstartorder != block_start:
+            reach = max(reach, block_reach)
+            block_start = h.sstartorder
+            block_reach = 0
+        elif out and h.sendorder == out[-1].sendorder and \
+                h.sstartorder == out[-1].sstartorder:
+            continue  # same span, earlier hit is better
+        block_reach = max(block_reach, h.sendorder)
+        if reach > h.sendorder:  # fully subsumed
+            continue
         out.append(h)
-    for hit in out:
-        for j in out:
-            if hit == j:
-                continue  # exclude self
-            if (
-                j.sstartorder == hit.sstartorder and
-                j.sendorder == hit.sendorder  # same subject span
-            ):
-                if j.evalue < hit.evalue and j.bitscore > hit.bitscore:
-                    out.remove(hit)  # other hit is better
-                else:
-                    out.remove(j)
-            elif (
-                j.sstartorder < hit.sstartorder and
-                j.sendorder > hit.sendorder  # fully subsumed
-            ):
-                out.remove(hit)
+    return out
+
+
+def sweep_join(ordered: list[tblastnhit], length=3000,
+               over=500) -> list[tblastnhit]:
+    """
+    sweep over hits on one subject, ordered by start, merging each hit into
+    the current cluster if the gap to it is less than length. A hit of
+    another query overlapping the cluster by more than over takes the
+    cluster over if it scores better. Clusters are new tblastnhit objects;
+    the input hits are left untouched
+    """
+    out = []
+    last_hit = None
+    for next_hit in ordered:
+        if last_hit is not None:
+            gap = next_hit.sstartorder - last_hit.sendorder
+            if gap < length:
+                last_hit.sendorder = max(last_hit.sendorder,
+                                         next_hit.sendorder)
+                if gap > 0:  # not overlapping
+                    if next_hit.query not in last_hit.queries:
+                        last_hit.queries.append(next_hit.query)
+                elif -gap > over:   # overlapping, attribute to the better
+                    if last_hit.query != next_hit.query and (
+                        next_hit.evalue < last_hit.evalue or
+                        next_hit.bitscore > last_hit.bitscore
+                    ):
+                        sys.stderr.write("Replacing %s with %s\n\n" %
+                                         (last_hit.query, next_hit.query))
+                        i = last_hit.queries.index(last_hit.query)
+                        if next_hit.query in last_hit.queries:
+                            del last_hit.queries[i]
+                        else:
+                            last_hit.queries[i] = next_hit.query
+                        last_hit.query = next_hit.query
+                        last_hit.evalue = next_hit.evalue
+                        last_hit.bitscore = next_hit.bitscore
+                continue
+            out.append(last_hit)
+        last_hit = copy.copy(next_hit)
+        last_hit.queries = list(next_hit.queries)
+    if last_hit is not None:
+        out.append(last_hit)
+    return out
+
+
+def unique_hits(tblastn_out: list[tblastnhit],
+                stranded=False) -> list[tblastnhit]:
+    """
+    remove duplicate and subsumed hits per subject in O(n log n)
+    """
+    out = []
+    for v in group_hits(tblastn_out, stranded).values():
+        out += sweep_unique(v)
     return out
 
 
 def join_hits(tblastn_out: list[tblastnhit],
-              length=3000, over=500) -> list[tblastnhit]:
+              length=3000, over=500, stranded=False) -> list[tblastnhit]:
     """
     connects hits (assumed separate exons) into ranges if distance between
     hits is less than length. Therefore, length should be longer than expected
@@ -71,35 +426,12 @@ def join_hits(tblastn_out: list[tblastnhit],
 
     This has the pleasing benefit of merging overlaps, because diff is -ve
     which is less than length.
+
+    Hits are swept per subject (and per strand, if stranded) in O(n log n).
     """
     out = []
-    subjects = set(x.subject for x in tblastn_out)
-    for s in subjects:
-        ordered = sorted([x for x in tblastn_out if x.subject == s],
-                         key=lambda x: x.sstartorder)
-        or_iter = iter(ordered)
-        last_hit = next(or_iter)
-        for next_hit in or_iter:
-            gap = next_hit.sstartorder - last_hit.sendorder
-            if gap < length:
-                last_hit.sendorder = next_hit.sendorder
-                if gap > 0:  # not overlapping
-                    if last_hit.query != next_hit.query:
-                        if next_hit.query not in last_hit.queries:
-                            last_hit.queries.append(next_hit.query)
-                elif -gap > over:   # overlapping, want to merge
-                    if last_hit.query != next_hit.query:
-                        if (
-                            last_hit.evalue < next_hit.evalue or
-                            last_hit.bitscore > next_hit.bitscore
-                        ):
-                            sys.stderr.write("Replacing %s with %s\n\n" %
-                                             (next_hit.query, last_hit.query))
-                            next_hit.query = last_hit.query  # replace with
-            else:
-                out.append(last_hit)
-                last_hit = next_hit
-        out.append(last_hit)
+    for v in group_hits(tblastn_out, stranded).values():
+        out += sweep_join(v, length, over)
     return out
 
 
@@ -129,6 +461,145 @@ def pad_range(ranges: list[genome_range], length=3000):
         r.new_end(newe)
 
 
+def cluster_members(clusters: list[tblastnhit], tblastn_out: list[tblastnhit],
+                    stranded=False) -> list[list[tblastnhit]]:
+    """
+    the hits join_hits joined into each of clusters. A subject's clusters
+    are disjoint and sorted by start, so each hit's is found by bisection
+    """
+    index = {}
+    for i, c in enumerate(clusters):
+        key = (c.subject, c.sstart > c.send) if stranded else (c.subject,)
+        index.setdefault(key, []).append(i)
+    starts = {k: [clusters[i].sstartorder for i in v]
+              for k, v in index.items()}
+    members = [[] for _ in clusters]
+    for h in tblastn_out:
+        key = (h.subject, h.sstart > h.send) if stranded else (h.subject,)
+        if key not in index:
+            continue
+        j = bisect.bisect_right(starts[key], h.sstartorder) - 1
+        if j >= 0 and h.sendorder <= clusters[index[key][j]].sendorder:
+            members[index[key][j]].append(h)
+    return members
+
+
+def range_members(ranges: list[genome_range],
+                  tblastn_out: list[tblastnhit]) -> list[list[tblastnhit]]:
+    """
+    the hits lying within each of ranges, which must not overlap (as
+    returned by merge_range)
+    """
+    index = {}
+    for i, r in enumerate(ranges):
+        index.setdefault(r.subject, []).append(i)
+    starts = {k: [ranges[i].start for i in v] for k, v in index.items()}
+    members = [[] for _ in ranges]
+    for h in tblastn_out:
+        if h.subject not in index:
+            continue
+        j = bisect.bisect_right(starts[h.subject], h.sstartorder) - 1
+        if j >= 0 and h.sendorder <= ranges[index[h.subject][j]].end:
+            members[index[h.subject][j]].append(h)
+    return members
+
+
+def rank_queries(members: list[tblastnhit],
+                 qlens: dict[str, int]) -> list[str]:
+    """
+    queries hitting a window, best first: by the summed bitscore of their
+    hits, then by the fraction of the query those hits cover
+    """
+    byquery = {}
+    for h in members:
+        byquery.setdefault(h.query, []).append(h)
+    scores = {}
+    for q, hits in byquery.items():
+        covered = 0
+        reach = 0
+        for qstart, qend in sorted((h.qstart, h.qend) for h in hits):
+            covered += max(0, qend - max(qstart - 1, reach))
+            reach = max(reach, qend)
+        scores[q] = (sum(h.bitscore for h in hits),
+                     covered / qlens.get(q, reach))
+    return sorted(scores, key=lambda q: (-scores[q][0], -scores[q][1]))
+
+
+def window_pads(members: list[tblastnhit], qlens: dict[str, int],
+                limit=3000) -> tuple[int, int]:
+    """
+    padding before and after one cluster: room for the residues of each
+    query its hits left uncovered, at the cluster's own ratio of genomic
+    span to aligned residues (at least 3, for a gene without introns), plus
+    the cluster's mean hit length as flank. Padding is put on the genomic
+    side each query's N- or C-terminus lies on, and never exceeds limit
+    """
+    if not members:
+        return limit, limit
+    byquery = {}
+    for h in members:
+        byquery.setdefault(h.query, []).append(h)
+    before = after = 0.0
+    for q, hits in byquery.items():
+        if q not in qlens:  # length unknown, pad as much as allowed
+            return limit, limit
+        qstart = min(h.qstart for h in hits)
+        qend = max(h.qend for h in hits)
+        span = max(h.sendorder for h in hits) - \
+            min(h.sstartorder for h in hits) + 1
+        ratio = max(3.0, span / (qend - qstart + 1))
+        nterm = ratio * (qstart - 1)
+        cterm = ratio * max(0, qlens[q] - qend)
+        reverse = sum(h.bitscore for h in hits if h.sstart > h.send)
+        if reverse > sum(h.bitscore for h in hits) / 2:
+            nterm, cterm = cterm, nterm
+        before = max(before, nterm)
+        after = max(after, cterm)
+    flank = sum(h.sendorder - h.sstartorder for h in members) / len(members)
+    return (min(limit, round(before + flank)),
+            min(limit, round(after + flank)))
+
+
+def pad_adaptive(ranges: list[genome_range], members: list[list[tblastnhit]],
+                 qlens: dict[str, int], limit=3000):
+    """
+    pad each range by window_pads over its cluster's hits
+    """
+    for r, m in zip(ranges, members):
+        before, after = window_pads(m, qlens, limit)
+        r.new_start(max(1, r.start - before))
+        r.new_end(r.end + after)
+
+
+def clamp_range(ranges: list[genome_range], lengths: dict[str, int]):
+    """
+    clamp range ends to the length of their contig
+    """
+    for r in ranges:
+        if r.subject in lengths and r.end > lengths[r.subject]:
+            r.new_end(lengths[r.subject])
+
+
+def merge_range(ranges: list[genome_range]) -> list[genome_range]:
+    """
+    merge ranges overlapping on a subject into one, with the queries of
+    both, so no part of the genome is aligned and predicted on twice.
+    Ranges are returned sorted by subject and start
+    """
+    out = []
+    for r in sorted(ranges, key=lambda x: (x.subject, x.start, x.end)):
+        last = out[-1] if out else None
+        if last is not None and last.subject == r.subject and \
+                r.start <= last.end:
+            last.new_end(max(last.end, r.end))
+            for q in r.queries:
+                if q not in last.queries:
+                    last.queries.append(q)
+            continue
+        out.append(r)
+    return out
+
+
 
 if __name__ == "__main__":
     if len(sys.argv[1:]) == 0:
@@ -140,11 +611,7 @@ if __name__ == "__main__":
     parser.add_argument("query", help="FASTA-formatted protein query")
     args = parser.parse_args()
 
-    blastdbsuf = [".ndb", ".nhr", ".nin", ".nog", ".nos", ".not",
-                  ".nsq", ".ntf", ".nto"]
-    for s in blastdbsuf:
-        if not os.path.isfile(args.database + s):
-            run_makeblastdb(args.database)
+    ensure_blastdb(args.database)
     tblastn_out = run_tblastn(args.query, args.database)
     out = parse_tblastn(tblastn_out)
     print([(x.query, x.subject,
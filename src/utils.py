@@ -1,30 +1,152 @@
 #! /usr/bin/python3
 
 
-# courtesy of Jonathan Chang https://gist.github.com/jonchang/6471846
-def parse_fasta(path):
-    """Given a path tries to parse a fasta file. Returns an iterator which
-    yields a (name, sequence) tuple"""
-    with open(path) as handle:
-        name = sequence = ""
-        for line in handle:
-            line = line.strip()
-            if line.startswith(">"):
-                if name:
-                    yield name, sequence
-                name = line[1:]
-                sequence = ""
+import os
+import gzip
+import mmap
+import queue
+import hashlib
+import functools
+import contextlib
+import threading
+import subprocess
+
+
+GZIP_MAGIC = b"\x1f\x8b"  # also the start of every bgzip block
+WHITESPACE = b" \t\r\n\v\f"
+
+
+def open_fasta(path: str):
+    """
+    open path for binary reading, decompressing gzip or bgzip input
+    (recognised by its magic bytes, not its name)
+    """
+    with open(path, "rb") as inf:
+        magic = inf.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def fasta_blocks(handle, size=1 << 20):
+    """
+    (name, sequence) as bytes from a binary handle, read in blocks of size
+    bytes. Records are found by searching each block for newline-">", and
+    each record's pieces are joined and stripped of whitespace once
+    """
+    name = b""
+    seq = []
+    header = None  # pieces of a header line running across blocks
+    bol = True  # whether the next block starts a line
+    for block in iter(lambda: handle.read(size), b""):
+        pos = 0
+        h = -1  # start of a header in this block
+        if header is not None:
+            eol = block.find(b"\n")
+            if eol < 0:
+                header.append(block)
                 continue
-            sequence += line
-        # yield the last sequence
-        if name and sequence:
-            yield name, sequence
+            header.append(block[:eol])
+            name = b"".join(header)[1:].strip()
+            header = None
+            pos = eol
+        elif bol and block.startswith(b">"):
+            h = 0
+        while True:
+            if h >= 0:
+                if name:
+                    yield name, b"".join(seq).translate(None, WHITESPACE)
+                name = b""
+                seq = []
+                eol = block.find(b"\n", h)
+                if eol < 0:
+                    header = [block[h:]]
+                    break
+                name = block[h + 1:eol].strip()
+                pos = eol
+            nxt = block.find(b"\n>", pos)
+            if nxt < 0:
+                seq.append(block[pos:])
+                break
+            seq.append(block[pos:nxt])
+            h = nxt + 1
+        bol = block.endswith(b"\n")
+    if header is not None:
+        name = b"".join(header)[1:].strip()
+    last = b"".join(seq).translate(None, WHITESPACE)
+    if name and last:
+        yield name, last
+
+
+def fasta_mmap(mm):
+    """
+    (name, sequence) as bytes from a mapped FASTA, slicing each record out
+    whole rather than reading it line by line
+    """
+    if mm[:1] == b">":
+        start = 0
+    else:
+        start = mm.find(b"\n>") + 1
+        if start == 0:  # no records
+            return
+    while True:
+        eol = mm.find(b"\n", start)
+        if eol < 0:
+            eol = len(mm)
+        nxt = mm.find(b"\n>", eol)
+        end = nxt if nxt >= 0 else len(mm)
+        name = mm[start + 1:eol].strip()
+        seq = mm[eol:end].translate(None, WHITESPACE)
+        if name and (seq or nxt >= 0):  # as fasta_blocks, for the last record
+            yield name, seq
+        if nxt < 0:
+            return
+        start = nxt + 1
+
+
+def parse_fasta(path, binary=False, use_mmap=False):
+    """Given a path tries to parse a fasta file, plain, gzip or bgzip.
+    Returns an iterator which yields a (name, sequence) tuple, as bytes if
+    binary, otherwise str. use_mmap maps uncompressed files instead of
+    reading them line by line"""
+    with open_fasta(path) as handle:
+        mapped = (use_mmap and not isinstance(handle, gzip.GzipFile) and
+                  os.fstat(handle.fileno()).st_size > 0)
+        with (mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+              if mapped else contextlib.nullcontext()) as mm:
+            records = fasta_mmap(mm) if mapped else fasta_blocks(handle)
+            if binary:
+                yield from records
+            else:
+                for name, seq in records:
+                    yield name.decode(), seq.decode()
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """
+    return the version string reported by an external tool, or "" if it
+    cannot be run. BLAST+ tools take -version, the others --version
+    """
+    flag = "-version" if tool in ("tblastn", "makeblastdb") else "--version"
+    try:
+        p = subprocess.run([tool, flag], shell=False, capture_output=True,
+                           text=True)
+    except OSError:
+        return ""
+    if p.returncode != 0:
+        return ""
+    return (p.stdout + p.stderr).strip()
 
 
 class tblastnhit():
     """
     simple referencable data class for tblastn outfmt 7
     """
+    __slots__ = ("query", "subject", "id", "len", "mm", "gapopens",
+                 "qstart", "qend", "sstart", "send", "evalue", "bitscore",
+                 "sstartorder", "sendorder", "queries")
+
     def __init__(self, input=[]):
         self.query = input[0]
         self.subject = input[1]
@@ -60,9 +182,96 @@ class genome_range():
         self.end = input[3]
         self.queries = [self.query]
         self.file = ""
+        self.seqid = ""  # sequence id of the extracted window
 
     def new_start(self, start: int):
         self.start = start
 
     def new_end(self, end: int):
         self.end = end 
+
+
+class query_store():
+    """
+    protein queries parsed once and keyed by id (the first word of the
+    header). subset() writes each distinct set of queries once, to a file
+    named after its contents, so ranges sharing queries share one file and
+    concurrent ranges never write to a file another is reading
+    """
+    def __init__(self, queryf: str, outdir=""):
+        self.queryf = queryf
+        self.outdir = outdir
+        self.seqs = {}
+        self.order = {}  # position in queryf, so subsets keep file order
+        for name, seq in parse_fasta(queryf):
+            qid = name.split()[0]
+            self.order[qid] = len(self.order)
+            self.seqs[qid] = (name, seq)
+        self._written = {}
+        self._kmers = {}
+        self._lock = threading.Lock()
+
+    def lengths(self) -> dict[str, int]:
+        return {qid: len(seq) for qid, (_, seq) in self.seqs.items()}
+
+    def similarity(self, a: str, b: str, k=3) -> float:
+        """
+        Jaccard similarity of the k-mer sets of queries a and b
+        """
+        sets = []
+        for qid in (a, b):
+            if (qid, k) not in self._kmers:
+                seq = self.seqs[qid][1]
+                self._kmers[(qid, k)] = {seq[i:i + k]
+                                         for i in range(len(seq) - k + 1)}
+            sets.append(self._kmers[(qid, k)])
+        union = len(sets[0] | sets[1])
+        return len(sets[0] & sets[1]) / union if union else 1.0
+
+    def subset(self, queries: list[str]) -> str:
+        """
+        path of a FASTA holding queries, written atomically on first use
+        """
+        ids = sorted(set(queries), key=lambda x: self.order[x])
+        text = "".join(">%s\n%s\n" % self.seqs[x] for x in ids)
+        digest = hashlib.sha1(text.encode()).hexdigest()[:16]
+        with self._lock:
+            if digest in self._written:
+                return self._written[digest]
+            outf = os.path.join(self.outdir, "queries_%s.pep.fa" % digest)
+            if not os.path.isfile(outf):  # else left by an earlier run
+                tmp = "%s.%d.tmp" % (outf, os.getpid())
+                with open(tmp, "w", encoding="utf-8") as out:
+                    out.write(text)
+                os.replace(tmp, outf)
+            self._written[digest] = outf
+        return outf
+
+
+def read_ahead(iterable, size=0):
+    """
+    iterate over iterable in a background thread, so whatever it reads from
+    (such as a child process's pipe) keeps being drained while the consumer
+    is busy. size bounds the items buffered (0 for no bound). Exceptions are
+    re-raised in the consumer
+    """
+    items = queue.Queue(size)
+    done = object()
+
+    def pump():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((done, e))
+            return
+        items.put((done, None))
+
+    threading.Thread(target=pump, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if item is done:
+            if error is not None:
+                raise error
+            return
+        yield item
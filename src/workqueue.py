@@ -0,0 +1,372 @@
+#! /usr/bin/python3
+
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import utils
+import cache
+import subseq
+import server
+import tblastn
+import checkpoint
+import kmerseed
+import peppercorn
+
+
+class work_queue():
+    """
+    jobs as JSON files in a directory shared by every node: a job is queued
+    in pending/, claimed by the worker that renames it into running/ (rename
+    being atomic, only one can), kept fresh there by the worker touching it,
+    and answered with a file of the same name in done/. queue.json holds what
+    workers need to know about the run
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.dirs = {s: os.path.join(root, s)
+                     for s in ["pending", "running", "done"]}
+
+    def path(self, state: str, name: str) -> str:
+        return os.path.join(self.dirs[state], name)
+
+    def _write(self, path: str, obj):
+        tmp = "%s.%s.%d.%d.tmp" % (path, socket.gethostname(), os.getpid(),
+                                   threading.get_ident())
+        with open(tmp, "w", encoding="utf-8") as outf:
+            json.dump(obj, outf)
+        os.replace(tmp, path)
+
+    def _read(self, path: str):
+        with open(path, "r", encoding="utf-8") as inf:
+            return json.load(inf)
+
+    def jobs(self, state: str) -> list[str]:
+        return sorted(f for f in os.listdir(self.dirs[state])
+                      if f.endswith(".json"))
+
+    def create(self, info: dict) -> bool:
+        """
+        set up the queue for a run described by info, returning False if it
+        already holds a run with the same info["params"], whose jobs are
+        then kept
+        """
+        infof = os.path.join(self.root, "queue.json")
+        fresh = not os.path.isfile(infof)
+        if not fresh and self._read(infof)["params"] != \
+                json.loads(json.dumps(info["params"])):
+            raise ValueError("%s holds the jobs of another run" % self.root)
+        for d in self.dirs.values():
+            os.makedirs(d, exist_ok=True)
+        self._write(infof, info)
+        return fresh
+
+    def info(self):
+        """
+        the run's queue.json, or None if the coordinator has not created it
+        """
+        try:
+            return self._read(os.path.join(self.root, "queue.json"))
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, job: dict):
+        self._write(self.path("pending", name), job)
+
+    def claim(self):
+        """
+        take the first pending job, returning (name, job), or None if there
+        are none. The job is touched before it is moved, as rename keeps its
+        mtime and requeue_stale would otherwise take back one that waited
+        in pending/ longer than the stale age
+        """
+        for name in self.jobs("pending"):
+            try:
+                os.utime(self.path("pending", name))
+                os.rename(self.path("pending", name),
+                          self.path("running", name))
+                return name, self._read(self.path("running", name))
+            except FileNotFoundError:  # claimed by another worker
+                continue
+        return None
+
+    def heartbeat(self, name: str):
+        try:
+            os.utime(self.path("running", name))
+        except FileNotFoundError:  # re-queued as stale
+            pass
+
+    def finish(self, name: str, result: dict):
+        self._write(self.path("done", name), result)
+        try:
+            os.remove(self.path("running", name))
+        except FileNotFoundError:
+            pass
+
+    def requeue_stale(self, age: float) -> list[str]:
+        """
+        return running jobs not touched for age seconds, whose worker must
+        have died, to pending
+        """
+        out = []
+        now = time.time()
+        for name in self.jobs("running"):
+            try:
+                if now - os.path.getmtime(self.path("running", name)) < age:
+                    continue
+                os.rename(self.path("running", name),
+                          self.path("pending", name))
+            except FileNotFoundError:  # finished meanwhile
+                continue
+            out.append(name)
+        return out
+
+    def results(self) -> dict[str, dict]:
+        return {name: self._read(self.path("done", name))
+                for name in self.jobs("done")}
+
+    def close(self):
+        """
+        tell idle workers there will be no more jobs
+        """
+        with open(os.path.join(self.root, "finished"), "w"):
+            pass
+
+    def closed(self) -> bool:
+        return os.path.isfile(os.path.join(self.root, "finished"))
+
+
+def run_job(job: dict, queries: utils.query_store, info: dict,
+            results=None) -> dict:
+    """
+    exonerate and augustus over the range of one job, returning its result
+    as the server's reply for a range
+    """
+    r = checkpoint.ranges_from_json([job["range"]])[0]
+    try:
+        good, bad = peppercorn.process_range(r, queries, info["species"],
+                                             results, info["chunks"])
+    except Exception as e:
+        sys.stderr.write("Failed to process %s: %s, discarding\n"
+                         % (r.file, e))
+        return {"event": "failed", "index": job["index"], "range": r.seqid,
+                "message": str(e)}
+    return {"event": "range", "index": job["index"], "range": r.seqid,
+            "supported": [server.prediction(a) for a in good],
+            "unsupported": [server.prediction(a) for a in bad]}
+
+
+def work(root: str, threads=1, results=None, poll=2.0):
+    """
+    claim and run jobs from the queue at root until the coordinator closes
+    it, with at most threads exonerate or augustus processes at a time
+    """
+    queue = work_queue(root)
+    queryf = os.path.join(root, "queries.pep.fa")
+    info = queue.info()
+    while info is None or not os.path.isfile(queryf):
+        time.sleep(poll)
+        info = queue.info()
+    queries = utils.query_store(queryf, os.path.join(root, "windows"))
+    held = set()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(info["stale"] / 5):
+            with lock:
+                names = list(held)
+            for name in names:
+                queue.heartbeat(name)
+
+    def loop():
+        while True:
+            claimed = queue.claim()
+            if claimed is None:
+                if queue.closed():
+                    return
+                time.sleep(poll)
+                continue
+            name, job = claimed
+            with lock:
+                held.add(name)
+            result = run_job(job, queries, info, results)
+            try:
+                queue.finish(name, result)
+            except OSError as e:  # stops being touched, so it is re-queued
+                sys.stderr.write("Failed to record %s: %s\n\n" % (name, e))
+            with lock:
+                held.discard(name)
+
+    threading.Thread(target=beat, daemon=True).start()
+    loops = [threading.Thread(target=loop) for _ in
+             range(peppercorn.range_workers(threads, info["chunks"]))]
+    for t in loops:
+        t.start()
+    for t in loops:
+        t.join()
+    stop.set()
+    if results is not None:
+        results.report()
+
+
+def enqueue(queue: work_queue, genome: str, ranges: list[utils.genome_range]):
+    """
+    write each range's window to the queue's windows/ and queue a job for it
+    """
+    windir = os.path.join(queue.root, "windows")
+    os.makedirs(windir, exist_ok=True)
+    ranges = [r for r in ranges if subseq.name_window(genome, r, windir)]
+    subseq.write_subseq(genome, ranges, outdir=windir)
+    for i, r in enumerate(ranges):
+        queue.put("%06d.json" % i, {"index": i,
+                                    "range": checkpoint.ranges_to_json([r])[0]})
+    return len(ranges)
+
+
+def collect(queue: work_queue, total: int, stale=300.0, poll=2.0) -> list:
+    """
+    wait for every job to be done, re-queueing those whose worker stopped
+    touching them, and return their results
+    """
+    finished = 0
+    while True:
+        done = queue.jobs("done")
+        if len(done) != finished:
+            finished = len(done)
+            sys.stderr.write("%d of %d ranges done\n\n" % (finished, total))
+        if finished >= total:
+            return list(queue.results().values())
+        for name in queue.requeue_stale(stale):
+            sys.stderr.write("Re-queueing %s, its worker went away\n\n" % name)
+        time.sleep(poll)
+
+
+# add_run_args options a queued run does not honour
+unsupported = ["resume", "pipelined", "batch_augustus", "stream_tblastn",
+               "hitstore", "profile", "trace"]
+
+
+def cache_args(args) -> list[str]:
+    if args.no_cache:
+        return ["--no-cache"]
+    return ["--cachedir", args.cachedir, "--cachesize", str(args.cachesize)]
+
+
+if __name__ == "__main__":
+    if len(sys.argv[1:]) == 0:
+        sys.argv.append("-h")
+
+    parser = argparse.ArgumentParser(description="Process ranges on any \
+                                     number of nodes through a queue in a \
+                                     shared directory: the coordinator (run) \
+                                     finds ranges and queues one job per \
+                                     range, workers (work) run exonerate and \
+                                     augustus on them")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Find ranges, queue them and \
+                                collect the results into final_* files")
+    run_parser.add_argument("genome", help="FASTA-formatted genomic contigs \
+                            to annotate homologues")
+    run_parser.add_argument("queries", help="FASTA-formatted protein queries \
+                            for homology-based annotation")
+    run_parser.add_argument("queue", help="Queue directory, on a filesystem \
+                            shared with the workers. Rerunning with the same \
+                            queue picks up its jobs where they were left")
+    run_parser.add_argument("-o", "--outdir", help="Directory for final \
+                            files [.]", type=str, default=".")
+    run_parser.add_argument("-w", "--workers", help="Also start this many \
+                            local workers [0]", type=int, default=0)
+    run_parser.add_argument("--stale", help="Re-queue a job whose worker has \
+                            not touched it for this many seconds [300]",
+                            type=float, default=300)
+    peppercorn.add_run_args(run_parser)
+    work_parser = sub.add_parser("work", help="Run queued jobs until the \
+                                 coordinator has collected them all")
+    work_parser.add_argument("queue", help="Queue directory")
+    work_parser.add_argument("-t", "--threads", help="Number of tool \
+                             processes to run at once; each job takes as many \
+                             as the run's --exonerate-chunks [1]", type=int,
+                             default=1)
+    work_parser.add_argument("--no-cache", help="Always rerun exonerate and \
+                             augustus instead of reusing cached results",
+                             action="store_true")
+    work_parser.add_argument("--cachedir", help="Directory for cached tool \
+                             results [$XDG_CACHE_HOME/peppercorn]", type=str,
+                             default=cache.default_cachedir())
+    work_parser.add_argument("--cachesize", help="Maximum size of the result \
+                             cache in GB [10]", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.command == "work":
+        work(args.queue, args.threads, peppercorn.open_cache(args))
+        sys.exit(0)
+
+    given = ["--" + x.replace("_", "-") for x in unsupported
+             if getattr(args, x) not in (None, False)]
+    if given:
+        run_parser.error("%s cannot be used with run" % ", ".join(given))
+    results = peppercorn.open_cache(args)
+    # job files name paths, so they must resolve the same on every node
+    args.queue = os.path.abspath(args.queue)
+    queue = work_queue(args.queue)
+    genome = os.path.abspath(args.genome)
+    os.makedirs(args.queue, exist_ok=True)
+    info = {"genome": genome, "species": args.species,
+            "chunks": args.exonerate_chunks, "stale": args.stale,
+            "params": peppercorn.run_params(args, [genome, args.queries])}
+    totalf = os.path.join(args.queue, "total")
+    try:
+        # queued jobs are only complete once their count is written
+        fresh = queue.create(info) or not os.path.isfile(totalf)
+    except ValueError as e:
+        sys.exit(str(e))
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                 "work", args.queue, "-t", str(args.threads)] +
+                                cache_args(args))
+               for _ in range(args.workers)]
+    if fresh:
+        queryf = os.path.join(args.queue, "queries.pep.fa")
+        with open(args.queries, "r", encoding="utf-8") as inf, \
+                open(queryf + ".tmp", "w", encoding="utf-8") as outf:
+            outf.write(inf.read())
+        os.replace(queryf + ".tmp", queryf)  # workers start once it is there
+        if args.finder == "kmer":
+            tblastn_hits = [h for _, hits in
+                            kmerseed.stream_kmer(queryf, genome,
+                                                 args.kmer_size, args.threads)
+                            for h in hits]
+            mean_hit_len = peppercorn.mean_length(tblastn_hits)
+        else:
+            tblastn.ensure_blastdb(genome)
+            tblastn_out = tblastn.run_tblastn(queryf, genome, args.threads,
+                                              cache=results,
+                                              shards=args.tblastn_shards,
+                                              genome_shards=args.genome_shards)
+            tblastn_hits, mean_hit_len = peppercorn.parse_hits(tblastn_out)
+        queries = utils.query_store(queryf)
+        ranges = peppercorn.find_ranges(tblastn_hits, mean_hit_len,
+                                        args.intronlength, args.stranded,
+                                        None if args.fixed_windows
+                                        else queries.lengths(), genome)
+        peppercorn.screen_queries(ranges, tblastn_hits, queries,
+                                  args.max_queries, args.collapse_similar)
+        total = enqueue(queue, genome, ranges)
+        with open(totalf, "w") as outf:
+            outf.write("%d\n" % total)
+    else:
+        with open(totalf, "r") as inf:
+            total = int(inf.read())
+        sys.stderr.write("Picking up %d queued ranges in %s\n\n"
+                         % (total, args.queue))
+    replies = collect(queue, total, args.stale)
+    queue.close()
+    for p in workers:
+        p.wait()
+    os.makedirs(args.outdir, exist_ok=True)
+    server.write_replies(replies + [{"event": "done"}], args.outdir)
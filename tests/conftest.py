@@ -0,0 +1,41 @@
+import os
+import sys
+import subprocess
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_dir = os.path.join(root, "src")
+bench_dir = os.path.join(root, "bench")
+sys.path[:0] = [src_dir, bench_dir]
+
+import synth  # noqa: E402
+
+
+@pytest.fixture
+def dataset(tmp_path) -> dict:
+    """
+    a small synthetic genome with planted families, its queries and truth
+    """
+    return synth.write_dataset(str(tmp_path / "data"), 1, contigs=2,
+                               contig_length=60000, families=2, members=3)
+
+
+def run_peppercorn(dataset: dict, outdir, *args, script="peppercorn.py"):
+    """
+    run a peppercorn entry point in outdir against the stub tools, returning
+    the contents of each final_* file it wrote
+    """
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(bench_dir, "stubs") + os.pathsep + env["PATH"]
+    env["PEPPERCORN_BENCH_TRUTH"] = dataset["truth"]
+    os.makedirs(outdir, exist_ok=True)
+    subprocess.run([sys.executable, os.path.join(src_dir, script),
+                    dataset["genome"], dataset["queries"], "--no-cache"] +
+                   list(args), cwd=outdir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    out = {}
+    for f in sorted(os.listdir(outdir)):
+        if f.startswith("final_"):
+            with open(os.path.join(outdir, f), "rb") as inf:
+                out[f] = inf.read()
+    return out
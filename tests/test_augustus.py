@@ -0,0 +1,23 @@
+import augustus
+from conftest import run_peppercorn
+
+
+def test_rename_rewrites_gff_ids():
+    a = augustus.AugustusRes()
+    a.gene = "g3"
+    a.gff = [["w", "AUGUSTUS", "gene", "1", "9", "1", "+", ".", "g3"],
+             ["w", "AUGUSTUS", "CDS", "1", "9", "1", "+", "0",
+              "transcript_id", '"g3.t1";', "gene_id", '"g3";']]
+    augustus.rename([a])
+    assert a.gene == "g1"
+    assert a.gff[0][8] == "g1"
+    assert a.gff[1][8:] == ["transcript_id", '"g1.t1";', "gene_id", '"g1";']
+
+
+def test_batched_matches_per_window(dataset, tmp_path):
+    single = run_peppercorn(dataset, tmp_path / "single")
+    assert single["final_supported_predictions.gtf"]
+    for threads in ["1", "3"]:
+        batched = run_peppercorn(dataset, tmp_path / ("batched" + threads),
+                                 "--batch-augustus", "-t", threads)
+        assert batched == single
@@ -0,0 +1,46 @@
+import os
+
+from cache import result_cache
+
+
+def disk_size(root):
+    return sum(os.path.getsize(os.path.join(d, f))
+               for d, _, files in os.walk(root) for f in files)
+
+
+def output(tmp_path, i):
+    path = str(tmp_path / ("out%d" % i))
+    with open(path, "wb") as outf:
+        outf.write(b"x" * 1000)
+    return path
+
+
+def test_evicts_least_recently_used_to_low_water(tmp_path):
+    cache = result_cache(str(tmp_path / "cache"), max_size=5000)
+    keys = ["%02x" % i + "0" * 62 for i in range(5)]
+    for i, key in enumerate(keys[:4]):
+        cache.store("exonerate", key, [output(tmp_path, i)])
+        os.utime(cache._entry(key), (1000 + i, 1000 + i))
+        assert cache._size == disk_size(cache.root)  # kept without a scan
+    # using the oldest entry makes the second oldest the one to go
+    assert cache.fetch("exonerate", keys[0], [str(tmp_path / "back")]) \
+        is not None
+    cache.store("exonerate", keys[4], [output(tmp_path, 4)])
+    kept = [os.path.isdir(cache._entry(k)) for k in keys]
+    assert kept == [True, False, True, True, True]
+    assert cache._size == disk_size(cache.root)
+    assert cache._size <= cache.max_size * cache.low_water
+    assert cache.fetch("exonerate", keys[1], [str(tmp_path / "back")]) \
+        is None
+    assert cache.stats["exonerate"] == {"hits": 1, "misses": 1}
+
+
+def test_rescan_notices_other_writers(tmp_path):
+    root = str(tmp_path / "cache")
+    cache = result_cache(root, max_size=10 ** 6, rescan=2)
+    other = result_cache(root, max_size=10 ** 6)
+    cache.store("augustus", "aa" + "0" * 62, [output(tmp_path, 0)])
+    other.store("augustus", "bb" + "0" * 62, [output(tmp_path, 1)])
+    assert cache._size < disk_size(root)
+    cache.store("augustus", "cc" + "0" * 62, [output(tmp_path, 2)])
+    assert cache._size == disk_size(root)
@@ -0,0 +1,54 @@
+import checkpoint
+from utils import genome_range
+
+
+def window(tmp_path, name):
+    r = genome_range(["q1", "chr1", 100, 900])
+    r.queries = ["q1", "q2"]
+    r.file = str(tmp_path / name)
+    r.seqid = "chr1_100_900"
+    with open(r.file, "w", encoding="utf-8") as outf:
+        outf.write(">%s\nACGT\n" % r.seqid)
+    return r
+
+
+def test_resume_round_trip(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    params = {"genome": "g.fa", "threads": 4}
+    r = window(tmp_path, "w1")
+    other = window(tmp_path, "w2")
+    progress = checkpoint.run_manifest(path, params)
+    progress.stage_done("ranges", files=[r.file],
+                        ranges=checkpoint.ranges_to_json([r]))
+    progress.step_done(r, "exonerate", files=[r.file], aligned=True)
+    progress.step_done(other, "exonerate", files=[other.file])
+    progress.close()
+    with open(path, "a", encoding="utf-8") as outf:
+        outf.write('{"range": "torn')  # killed mid-write
+
+    resumed = checkpoint.run_manifest(path, params, resume=True)
+    restored, = checkpoint.ranges_from_json(resumed.stage("ranges")["ranges"])
+    assert vars(restored) == vars(r)
+    assert resumed.step(r, "exonerate")["aligned"] is True
+    assert resumed.step(r, "augustus") is None
+    assert checkpoint.finished_step(None, r, "exonerate") is None
+    # a step whose outputs have gone is redone
+    (tmp_path / "w2").unlink()
+    assert resumed.step(other, "exonerate") is None
+    resumed.close()
+    with open(path, encoding="utf-8") as inf:
+        assert "torn" not in inf.read()
+
+
+def test_changed_params_start_over(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    r = window(tmp_path, "w1")
+    progress = checkpoint.run_manifest(path, {"threads": 4})
+    progress.stage_done("tblastn", files=[r.file])
+    progress.close()
+    fresh = checkpoint.run_manifest(path, {"threads": 8}, resume=True)
+    assert fresh.stage("tblastn") is None
+    fresh.close()
+    again = checkpoint.run_manifest(path, {"threads": 8}, resume=True)
+    assert again.stages == {}
+    again.close()
@@ -0,0 +1,33 @@
+import pytest
+import synth
+import kmerseed
+
+np = pytest.importorskip("numpy")
+
+
+def test_extend_stays_on_the_translation(tmp_path):
+    rng = synth.random.Random(3)
+    genome = str(tmp_path / "g.fa")
+    synth.write_fasta([("c1", synth.random_dna(rng, 600))], genome)
+    index = kmerseed.load_index(genome, 4)
+    aa = np.array(index.trans[:50])  # frame 0 of c1, from its first residue
+    # a chain whose seeds reach past either end of diagonal d
+    q0, q1, score = index.extend(aa, -2, 0, 49)
+    assert q0 >= 2 and q1 <= 49 and score < 0  # shifted, so mismatched
+    q0, q1, score = index.extend(aa, 0, 0, 49)
+    assert (q0, q1) == (0, 49) and score > 0
+    end = len(index.trans)
+    q0, q1, _ = index.extend(aa, end - 10, 0, 49)
+    assert q1 + end - 10 < end
+
+
+def test_search_finds_planted_exons(dataset):
+    truth = synth.read_truth(dataset["truth"])
+    found = {q: hits for q, hits in
+             kmerseed.stream_kmer(dataset["queries"], dataset["genome"], 5)}
+    for t in truth:
+        hits = found[t["query"]]
+        assert hits and all(h.gapopens == 0 for h in hits)
+        assert any(h.subject == t["contig"] and
+                   any(s <= h.sstartorder <= e or s <= h.sendorder <= e
+                       for s, e, _, _ in t["exons"]) for h in hits)
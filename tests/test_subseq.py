@@ -0,0 +1,30 @@
+import pytest
+
+import subseq
+from utils import genome_range
+
+
+def write_genome(path, text):
+    with open(path, "w", encoding="utf-8") as outf:
+        outf.write(text)
+    return str(path)
+
+
+def test_missing_contig_is_skipped(tmp_path):
+    genome = write_genome(tmp_path / "g.fa", ">chr1\nACGTACGTAC\nGTAC\n")
+    r = genome_range(["q1", "chr1", 3, 100])
+    missing = genome_range(["q1", "chr9", 1, 10])
+    assert subseq.name_window(genome, r, str(tmp_path)) is not None
+    assert r.end == 14 and r.seqid == "chr1_3_14"
+    assert subseq.name_window(genome, missing) is None
+    assert missing.file == ""
+    out = subseq.write_subseq(genome, [r, missing], outdir=str(tmp_path))
+    assert [seqid for _, _, seqid in out] == ["chr1_3_14"]
+    with open(r.file, encoding="utf-8") as inf:
+        assert inf.read() == ">chr1_3_14\nGTACGTACGTAC\n"
+
+
+def test_blank_line_inside_record_is_rejected(tmp_path):
+    genome = write_genome(tmp_path / "g.fa", ">chr1\nACGT\n\nACGT\n")
+    with pytest.raises(ValueError):
+        subseq.build_index(genome)
@@ -0,0 +1,88 @@
+import copy
+import random
+import tblastn
+from utils import tblastnhit
+
+
+def hit(query, subject, sstart, send, evalue=1e-10, bitscore=50.0):
+    return tblastnhit([query, subject, 90.0, 100, 10, 0, 1, 100, sstart,
+                       send, evalue, bitscore])
+
+
+def baseline_join(hits, length=3000, over=500):
+    """
+    join_hits as it was before the sweep rewrite, on copies, with the end
+    of a cluster kept at the furthest end seen
+    """
+    out = []
+    for s in set(x.subject for x in hits):
+        ordered = sorted([copy.deepcopy(x) for x in hits if x.subject == s],
+                         key=lambda x: x.sstartorder)
+        last_hit = ordered[0]
+        for next_hit in ordered[1:]:
+            gap = next_hit.sstartorder - last_hit.sendorder
+            if gap < length:
+                last_hit.sendorder = max(last_hit.sendorder,
+                                         next_hit.sendorder)
+                if gap > 0 and last_hit.query != next_hit.query and \
+                        next_hit.query not in last_hit.queries:
+                    last_hit.queries.append(next_hit.query)
+            else:
+                out.append(last_hit)
+                last_hit = next_hit
+        out.append(last_hit)
+    return out
+
+
+def summary(clusters):
+    return sorted((c.subject, c.sstartorder, c.sendorder, c.query,
+                   tuple(c.queries)) for c in clusters)
+
+
+def test_join_matches_baseline():
+    rng = random.Random(1)
+    for _ in range(50):
+        hits = []
+        # distinct starts, as the baseline left ties in input order
+        for start in rng.sample(range(1, 50000), rng.randint(1, 60)):
+            end = start + rng.randint(30, 3000)
+            if rng.random() < 0.5:
+                start, end = end, start
+            hits.append(hit("q%d" % rng.randint(1, 5),
+                            "chr%d" % rng.randint(1, 3), start, end))
+        before = summary(hits)
+        assert summary(tblastn.join_hits(hits, 2000)) == \
+            summary(baseline_join(hits, 2000))
+        assert summary(hits) == before  # inputs untouched
+
+
+def test_join_reassigns_overlap_to_better_query():
+    hits = [hit("a", "chr1", 100, 1200, 1e-5, 40.0),
+            hit("b", "chr1", 150, 1250, 1e-20, 90.0),
+            hit("c", "chr1", 4000, 4500)]
+    (cluster,) = tblastn.join_hits(hits, 3000)
+    assert (cluster.sstartorder, cluster.sendorder) == (100, 4500)
+    assert cluster.query == "b"
+    assert cluster.queries == ["b", "c"]
+    assert hits[0].query == "a" and hits[0].queries == ["a"]
+
+
+def test_join_keeps_better_cluster_query():
+    hits = [hit("a", "chr1", 100, 1200, 1e-20, 90.0),
+            hit("b", "chr1", 150, 1250, 1e-5, 40.0)]
+    (cluster,) = tblastn.join_hits(hits, 3000)
+    assert cluster.query == "a" and cluster.queries == ["a"]
+
+
+def test_top_subjects_keeps_best_per_query(tmp_path):
+    rows = [("q1", "s1", 1e-30, 90), ("q1", "s2", 1e-10, 50),
+            ("q1", "s3", 1e-20, 70), ("q2", "s2", 1e-5, 31)]
+    files = []
+    for i, part in enumerate([rows[:2], rows[2:]]):
+        f = tmp_path / ("shard%d.outfmt7" % i)
+        f.write_text("# Query: q1\n" + "".join(
+            "%s\t%s\t90.0\t100\t10\t0\t1\t100\t1\t300\t%g\t%g\n" % r
+            for r in part))
+        files.append(str(f))
+    assert tblastn.top_subjects(files, 2) == {("q1", "s1"), ("q1", "s3"),
+                                              ("q2", "s2")}
@@ -0,0 +1,61 @@
+import gzip
+import io
+import random
+
+import pytest
+
+import utils
+
+
+def reference_parse(text):
+    """the line-by-line parser parse_fasta replaced"""
+    name = sequence = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(">"):
+            if name:
+                yield name, sequence
+            name = line[1:]
+            sequence = ""
+            continue
+        sequence += line
+    if name and sequence:
+        yield name, sequence
+
+
+def random_fasta(rng, records=20):
+    out = []
+    if rng.random() < 0.5:
+        out.append("junk before the first record\n")
+    for i in range(records):
+        eol = "\r\n" if rng.random() < 0.2 else "\n"
+        out.append(">seq%d some description%s" % (i, eol))
+        seq = "".join(rng.choice("ACGTN") for _ in range(rng.randrange(200)))
+        width = rng.randrange(1, 80)
+        for j in range(0, len(seq), width):
+            out.append(seq[j:j+width] + eol)
+    return "".join(out)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 20])
+def test_fasta_blocks_matches_reference(seed, size):
+    text = random_fasta(random.Random(seed))
+    expected = list(reference_parse(text))
+    got = [(name.decode(), seq.decode()) for name, seq in
+           utils.fasta_blocks(io.BytesIO(text.encode()), size)]
+    assert got == expected
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_parse_fasta_plain_and_gzip(tmp_path, compress, use_mmap):
+    text = random_fasta(random.Random(7), records=50)
+    path = str(tmp_path / "g.fa")
+    opener = gzip.open if compress else open
+    with opener(path, "wb") as outf:
+        outf.write(text.encode())
+    expected = list(reference_parse(text))
+    assert list(utils.parse_fasta(path, use_mmap=use_mmap)) == expected
+    assert list(utils.parse_fasta(path, binary=True, use_mmap=use_mmap)) == \
+        [(name.encode(), seq.encode()) for name, seq in expected]
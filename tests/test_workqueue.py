@@ -0,0 +1,50 @@
+import os
+import time
+import pytest
+import workqueue
+
+
+def make_queue(tmp_path, jobs=2) -> workqueue.work_queue:
+    queue = workqueue.work_queue(str(tmp_path / "queue"))
+    assert queue.create({"params": {"a": 1}})
+    for i in range(jobs):
+        queue.put("%06d.json" % i, {"index": i})
+    return queue
+
+
+def test_claim_finish(tmp_path):
+    queue = make_queue(tmp_path)
+    name, job = queue.claim()
+    assert (name, job) == ("000000.json", {"index": 0})
+    assert queue.jobs("running") == [name]
+    queue.finish(name, {"event": "range", "index": 0})
+    assert queue.jobs("running") == []
+    assert queue.results() == {name: {"event": "range", "index": 0}}
+    assert queue.claim()[0] == "000001.json"
+    assert queue.claim() is None
+
+
+def test_old_pending_job_is_not_requeued_once_claimed(tmp_path):
+    queue = make_queue(tmp_path, 1)
+    old = time.time() - 3600
+    os.utime(queue.path("pending", "000000.json"), (old, old))
+    name, _ = queue.claim()
+    assert queue.requeue_stale(60) == []
+    assert queue.jobs("running") == [name]
+
+
+def test_requeue_stale(tmp_path):
+    queue = make_queue(tmp_path, 1)
+    name, _ = queue.claim()
+    old = time.time() - 3600
+    os.utime(queue.path("running", name), (old, old))
+    assert queue.requeue_stale(60) == [name]
+    assert queue.jobs("pending") == [name]
+    assert queue.claim()[0] == name
+
+
+def test_create_rejects_other_run(tmp_path):
+    queue = make_queue(tmp_path, 0)
+    assert not queue.create({"params": {"a": 1}})
+    with pytest.raises(ValueError):
+        queue.create({"params": {"a": 2}})